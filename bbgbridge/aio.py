@@ -0,0 +1,266 @@
+import asyncio
+import itertools
+import threading
+import time
+
+from blpapi import CorrelationId, Event
+
+from bbgbridge import metrics
+from bbgbridge.api import (
+    BloombergBridge,
+    DEFAULT_MAX_IN_FLIGHT,
+    DEFAULT_TICK_WINDOW,
+    RequestTimeoutError,
+    SessionTerminatedError,
+    _tick_window,
+    correlation_key,
+    is_session_down
+)
+from bbgbridge.parsing import parse_message
+from bbgbridge.result import BloombergRequestResult
+from bbgbridge.scheduling import current_priority
+from bbgbridge.streaming import create_collector
+from bbgbridge.subscriptions import SUBSCRIPTION_EVENTS
+from bbgbridge.util import to_timestamp
+
+
+def create_async_bloomberg_connection(session=None, cache=None):
+    return AsyncBloombergBridge(session, cache=cache)
+
+
+def _resolve(future, result=None, exception=None):
+    if future.done():  # e.g. the awaiting coroutine was cancelled
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
+class _PendingRequest(object):
+    def __init__(self, loop, future, collector, recorder=None, record=None):
+        self.loop = loop
+        self.future = future
+        self.collector = collector
+        self.recorder = recorder
+        self.record = record
+
+
+class AsyncBloombergBridge(BloombergBridge):
+    """
+    BloombergBridge whose requests are awaitable, e.g. await bridge.bdh(...)
+
+    One background thread reads all events of the session and resolves the
+    future of the request they belong to by correlation id, so any number of
+    coroutines can share a single session. The same thread hands subscription
+    events to the subscription manager. Requests still outstanding when the
+    bridge stops fail with SessionTerminatedError.
+    """
+
+    def __init__(self, session=None, chunk_plan=None, cache=None, scheduler=None, request_timeout=None):
+        super().__init__(session, chunk_plan, cache, scheduler, request_timeout)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._dispatcher = threading.Thread(target=self._dispatch_events, name='bbgbridge-dispatch', daemon=True)
+        self._dispatcher.start()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        self.stop()
+
+    def stop(self):
+        self._stopping.set()
+        self._dispatcher.join()
+        super().stop()
+        self._fail_pending(lambda: SessionTerminatedError('The bridge was stopped'))
+
+    def _dispatch_events(self):
+        while not self._stopping.is_set():
+            try:
+                self._dispatch(self.session.nextEvent(timeout=500))  # For stop() handling
+            except Exception as e:
+                # The outstanding requests may have lost messages, so fail them rather than let them wait forever
+                self._fail_pending(lambda: RuntimeError('Failed to dispatch the events of the session: {!r}'.format(e)), e)
+
+    def _dispatch(self, ev):
+        if ev.eventType() in SUBSCRIPTION_EVENTS:
+            if self.subscriptions is not None:
+                self.subscriptions.handle_event(ev)
+            return
+
+        completed = []
+        for msg in ev:
+            key = correlation_key(msg)
+            if key is None and is_session_down(msg):
+                self._fail_all(SessionTerminatedError('Session down: {}'.format(msg)))
+                continue
+            with self._lock:
+                pending = self._pending.get(key)
+            if pending is None:
+                continue
+
+            try:
+                if pending.record is None:
+                    pending.collector.add(msg)
+                else:
+                    parse_start = time.perf_counter()
+                    parsed = pending.collector.add(msg)
+                    pending.record.on_message(ev.eventType(), time.perf_counter() - parse_start, metrics.count_values(parsed))
+            except Exception as e:
+                with self._lock:
+                    self._pending.pop(key, None)
+                pending.loop.call_soon_threadsafe(_resolve, pending.future, None, e)
+                continue
+
+            if ev.eventType() == Event.RESPONSE and key not in completed:
+                completed.append(key)
+
+        for key in completed:
+            with self._lock:
+                pending = self._pending.pop(key, None)
+            if pending is not None:
+                if pending.record is not None:
+                    pending.recorder.finish(pending.record, pending.collector.to_frame())
+                pending.loop.call_soon_threadsafe(_resolve, pending.future, pending.collector)
+
+    def is_healthy(self):
+        # Session status events are read by the dispatcher thread
+        return self.alive
+
+    def _receive(self, inbox, timeout):
+        """ Events are read and handed out by the dispatcher thread, so there is nothing to receive but to wait """
+        self._stopping.wait(timeout)
+        return []
+
+    def _fail_all(self, exception):
+        self.alive = False
+        self._fail_pending(lambda: exception)
+
+    def _fail_pending(self, exception_factory, cause=None):
+        """ Fail every outstanding request, each with an exception of its own from exception_factory """
+        with self._lock:
+            pending, self._pending = list(self._pending.values()), {}
+        for x in pending:
+            exception = exception_factory()
+            if cause is not None:
+                exception.__cause__ = cause
+            try:
+                x.loop.call_soon_threadsafe(_resolve, x.future, None, exception)
+            except RuntimeError:
+                pass  # The loop of the request is closed, so nothing awaits it
+
+    async def _submit(self, request, req_object, collector, timeout=None):
+        """ Send a request and wait for all of its messages to be added to the collector """
+        loop = asyncio.get_running_loop()
+        correlation_id = CorrelationId(next(self._correlation_ids))
+        recorder = metrics.active
+        pending = _PendingRequest(loop, loop.create_future(), collector, recorder,
+                                  None if recorder is None else recorder.start(req_object))
+        with self._lock:
+            self._pending[correlation_id.value()] = pending
+        try:
+            self.session.sendRequest(request, correlationId=correlation_id)
+            try:
+                return await asyncio.wait_for(pending.future, timeout)
+            except asyncio.CancelledError:
+                self.session.cancel(correlation_id)
+                raise
+            except asyncio.TimeoutError:
+                self.session.cancel(correlation_id)
+                raise RequestTimeoutError('Request did not complete within {}s: {}'.format(timeout, str(req_object)[:500]))
+        finally:
+            with self._lock:
+                self._pending.pop(correlation_id.value(), None)
+
+    async def send_request(self, request, meta=None, converter=None, *, stream=False, keep_raw=False, native_dates=False, timeout=None):
+        return (await self.send_requests([request], [meta], converter, stream=stream, keep_raw=keep_raw, native_dates=native_dates,
+                                         timeout=timeout))[0]
+
+    async def send_requests(self, requests, metas=None, converter=None, *, max_in_flight=DEFAULT_MAX_IN_FLIGHT, stream=False, keep_raw=False,
+                            native_dates=False, timeout=None):
+        requests = list(requests)
+        if metas is None:
+            metas = [None] * len(requests)
+        if len(metas) != len(requests):
+            raise ValueError('Expected {} metas but got {}'.format(len(requests), len(metas)))
+        if max_in_flight < 1:
+            raise ValueError('max_in_flight must be at least 1, but was: {}'.format(max_in_flight))
+
+        semaphore = asyncio.Semaphore(max_in_flight)
+        if timeout is None:
+            timeout = self.request_timeout
+
+        use_cache = self.cache is not None and not stream and not native_dates
+
+        async def send(request, meta):
+            req_object = parse_message(request)
+            ret_object = self.cache.get(req_object) if use_cache else None
+            if ret_object is not None:
+                return BloombergRequestResult(ret_object, req_object, meta=meta, converter=converter)
+
+            async with semaphore:
+                if self.scheduler is not None:
+                    # admit blocks, and the priority of this task has to be read here rather than in the executor
+                    await asyncio.get_running_loop().run_in_executor(None, self.scheduler.admit, req_object, current_priority())
+                collector = await self._submit(request, req_object, create_collector(req_object, stream, keep_raw, native_dates), timeout)
+            if use_cache:
+                self.cache.put(req_object, collector.messages)
+            return BloombergRequestResult(collector.messages, req_object, meta=meta, converter=converter, frame=collector.to_frame())
+
+        return list(await asyncio.gather(*[send(request, meta) for request, meta in zip(requests, metas)]))
+
+    async def request_intraday_tick(self,
+                                    symbols,
+                                    start,
+                                    end,
+                                    event_types='TRADE',
+                                    *,
+                                    window=DEFAULT_TICK_WINDOW,
+                                    include_condition_codes=False,
+                                    max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                                    outdir=None):
+        """
+        Asynchronous generator of what BloombergBridge.request_intraday_tick
+        yields, e.g. async for frame in bridge.bdit(...). Requests are
+        created as windows complete, up to max_in_flight outstanding.
+        """
+        requests = self._intraday_tick_requests(symbols, start, end, event_types, window, include_condition_codes)
+        last_end = to_timestamp(end)
+
+        async def fetch(request):
+            req_object = parse_message(request)
+            if self.scheduler is not None:
+                await asyncio.get_running_loop().run_in_executor(None, self.scheduler.admit, req_object, current_priority())
+            collector = await self._submit(request, req_object, create_collector(req_object, stream=True), self.request_timeout)
+            return req_object, collector
+
+        running = set()
+        try:
+            for request in itertools.chain(requests, [None]):
+                if request is not None:
+                    running.add(asyncio.ensure_future(fetch(request)))
+                    if len(running) < max_in_flight:
+                        continue
+                while running and (request is None or len(running) >= max_in_flight):
+                    done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        req_object, collector = task.result()
+                        item = _tick_window(req_object, collector.to_frame(), last_end, outdir)
+                        if item is not None:
+                            yield item
+        finally:
+            for task in running:
+                task.cancel()
+
+    async def _execute(self, requests, meta, merge, chunk_plan, *, merge_single=False, **options):
+        if len(requests) == 1 and not merge_single:
+            return await self.send_request(requests[0], meta, **options)
+
+        results = await self.send_requests(requests, max_in_flight=chunk_plan.max_in_flight or DEFAULT_MAX_IN_FLIGHT, **options)
+        return merge(results, meta=meta)
+
+
+AsyncBloombergBridge.bdit = AsyncBloombergBridge.request_intraday_tick
@@ -1,31 +1,88 @@
+import functools
+import itertools
+import re
+import threading
+import time
+from os import path
+
 import pandas as pd
-from blpapi import Event, Session
+from blpapi import CorrelationId, Event, Session
 
+from . import metrics
+from .archive import write_frame
 from .parsing import parse_message
+from .planning import (
+    NO_CHUNKING,
+    ChunkPlan,
+    merge_historical_frames,
+    merge_historical_results,
+    merge_intraday_bar_results,
+    merge_reference_results,
+    merge_sweep_results,
+    overrides_key,
+    split_time_range
+)
 from .result import BloombergRequestResult
+from .streaming import create_collector
+from .subscriptions import SUBSCRIPTION_EVENTS, SubscriptionManager
 from .util import (
     as_list,
     date_bloomberg_string,
     dedupe,
     to_timestamp,
-    is_string,
     merge_dicts
 )
 
 
-def create_bloomberg_connection():
-    return BloombergBridge()
+DEFAULT_MAX_IN_FLIGHT = 16
+DEFAULT_TICK_WINDOW = pd.Timedelta(hours=1)
+
+# Session level messages after which the session is of no further use
+SESSION_DOWN_MESSAGES = frozenset(['SessionTerminated', 'SessionStartupFailure'])
+
+
+class SessionTerminatedError(RuntimeError):
+    """ The session went down while requests were outstanding """
+
+
+class RequestTimeoutError(TimeoutError):
+    """ A request did not complete within its timeout """
+
+
+def create_bloomberg_connection(session=None, cache=None):
+    return BloombergBridge(session, cache=cache)
 
 
 def update_meta(meta, **additional):
     return merge_dicts(meta or {}, additional)
 
 
+def is_session_down(msg):
+    return str(msg.messageType()) in SESSION_DOWN_MESSAGES
+
+
+def correlation_key(msg):
+    """ The correlation id value of a message, or None for session level messages """
+    corr_ids = msg.correlationIds()
+    if len(corr_ids) > 1:
+        raise RuntimeError('Response has more than one correlation id: ' + str(msg))
+    return corr_ids[0].value() if corr_ids else None
+
+
 class BloombergBridge(object):
-    def __init__(self):
-        self.session = Session()
-        self.refdata_service = None
-        self.instrument_service = None
+    def __init__(self, session=None, chunk_plan=None, cache=None, scheduler=None, request_timeout=None):
+        self.session = Session() if session is None else session
+        self.chunk_plan = chunk_plan or NO_CHUNKING
+        self.cache = cache
+        self.scheduler = scheduler
+        self.request_timeout = request_timeout
+        self.alive = False
+        self.subscriptions = None
+        self._services = {}
+        self._correlation_ids = itertools.count(1)
+        self._routing = threading.Condition()
+        self._reading = False
+        self._owners = {}
         self._init_session()
 
     def __enter__(self):
@@ -37,19 +94,56 @@ class BloombergBridge(object):
     def _init_session(self):
         if not self.session.start():
             raise RuntimeError('Failed to start session.')
-
-        if not self.session.openService('//blp/refdata'):
-            raise RuntimeError('Failed to open //blp/refdata')
-
-        if not self.session.openService('//blp/instruments'):
-            raise RuntimeError('Failed to open //blp/instruments')
-
-        self.refdata_service = self.session.getService('//blp/refdata')
-        self.instrument_service = self.session.getService('//blp/instruments')
+        self.alive = True
+
+    def _service(self, name):
+        """ The service, opened the first time it is used """
+        service = self._services.get(name)
+        if service is None:
+            if not self.session.openService(name):
+                raise RuntimeError('Failed to open ' + name)
+            service = self._services[name] = self.session.getService(name)
+        return service
+
+    @property
+    def refdata_service(self):
+        return self._service('//blp/refdata')
+
+    @property
+    def instrument_service(self):
+        return self._service('//blp/instruments')
+
+    def is_healthy(self):
+        """
+        Whether the session is still up, judging by the session status
+        events received so far. Pending events are routed as usual.
+        """
+        with self._routing:
+            while self.alive and not self._reading:
+                ev = self.session.tryNextEvent()
+                if ev is None:
+                    break
+                self._route(ev)
+            self._routing.notify_all()
+        return self.alive
 
     def stop(self):
+        if self.subscriptions is not None:
+            self.subscriptions.stop()
+        self.alive = False
         self.session.stop()
 
+    def subscribe(self, symbols, fields, **options):
+        """
+        Subscribe the securities to real time updates of the fields, see
+        SubscriptionManager for the options. All subscriptions of a bridge
+        share the fields and options of the first call.
+        """
+        if self.subscriptions is None:
+            self.subscriptions = SubscriptionManager(self, fields, **options)
+        self.subscriptions.subscribe(symbols)
+        return self.subscriptions
+
     def request_historical_data(self,
                                 symbols,
                                 fields,
@@ -59,82 +153,184 @@ class BloombergBridge(object):
                                 periodicity_adjustment='ACTUAL',
                                 periodicity_selection='DAILY',
                                 overrides=None,
-                                meta=None):
+                                meta=None,
+                                chunk_plan=None,
+                                stream=False,
+                                keep_raw=False,
+                                native_dates=False):
 
         if end_date is None:
             end_date = pd.Timestamp.now()
 
-        modifiers = {
-            'periodicityAdjustment': periodicity_adjustment,
-            'periodicitySelection': periodicity_selection,
-            'returnEids': 'true',
-            'startDate': date_bloomberg_string(start_date),
-            'endDate': date_bloomberg_string(end_date),
-        }
-
-        request = self.create_request('HistoricalDataRequest',
-                                      as_list(symbols),
-                                      as_list(fields),
-                                      modifiers=modifiers,
-                                      overrides=overrides)
-
-        return self.send_request(request, meta)
+        chunk_plan = chunk_plan or self.chunk_plan
+        requests = []
+        for symbol_chunk, field_chunk, chunk_start, chunk_end in chunk_plan.historical_chunks(
+                symbols, fields, start_date, end_date, periodicity_selection):
+            modifiers = {
+                'periodicityAdjustment': periodicity_adjustment,
+                'periodicitySelection': periodicity_selection,
+                'returnEids': 'true',
+                'startDate': date_bloomberg_string(chunk_start),
+                'endDate': date_bloomberg_string(chunk_end),
+            }
+
+            requests.append(self.create_request('HistoricalDataRequest',
+                                                symbol_chunk,
+                                                field_chunk,
+                                                modifiers=modifiers,
+                                                overrides=overrides))
+
+        merge = merge_historical_frames if stream else merge_historical_results
+        return self._execute(requests, meta, merge, chunk_plan, stream=stream, keep_raw=keep_raw, native_dates=native_dates)
 
     def request_intraday_bar(self,
-                             symbol,
+                             symbols,
                              interval,
                              start,
                              end,
                              event_type='TRADE',
-                             meta=None):
-
-        request = self.refdata_service.createRequest("IntradayBarRequest")
-        request.set("security", symbol)
-        request.set("eventType", event_type)
-        request.set("interval", interval)  # bar interval in minutes
-        request.set("startDateTime", to_timestamp(start))
-        request.set("endDateTime", to_timestamp(end))
-        return self.send_request(request, meta)
+                             meta=None,
+                             *,
+                             stream=False,
+                             keep_raw=False,
+                             native_dates=False,
+                             max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        """
+        Bars of one security, or of a list of securities: one request each,
+        up to max_in_flight of them at once, merged into a single result
+        whose intraday_bar frame has the bars of all of them by symbol and time
+        """
+        requests = []
+        for symbol in dedupe(as_list(symbols)):
+            request = self.refdata_service.createRequest("IntradayBarRequest")
+            request.set("security", symbol)
+            request.set("eventType", event_type)
+            request.set("interval", interval)  # bar interval in minutes
+            request.set("startDateTime", to_timestamp(start))
+            request.set("endDateTime", to_timestamp(end))
+            requests.append(request)
+
+        return self._execute(requests, meta, merge_intraday_bar_results, ChunkPlan(max_in_flight=max_in_flight),
+                             stream=stream, keep_raw=keep_raw, native_dates=native_dates)
+
+    def request_intraday_tick(self,
+                              symbols,
+                              start,
+                              end,
+                              event_types='TRADE',
+                              *,
+                              window=DEFAULT_TICK_WINDOW,
+                              include_condition_codes=False,
+                              max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                              outdir=None):
+        """
+        Yields the ticks of the securities between start and end as frames,
+        one per security and time window of at most `window`. The windows
+        of all securities are requested concurrently, up to max_in_flight at
+        once, and the frames are yielded as the windows complete, so memory
+        use does not depend on the length of the range.
+
+        With outdir, each frame is written there as a binary archive (see
+        bbgbridge.archive) and its path is yielded instead.
+        """
+        requests = self._intraday_tick_requests(symbols, start, end, event_types, window, include_condition_codes)
+        last_end = to_timestamp(end)
+        pipeline = self._pipeline(requests, max_in_flight, lambda req_object: create_collector(req_object, stream=True))
+        for _, req_object, collector in pipeline:
+            item = _tick_window(req_object, collector.to_frame(), last_end, outdir)
+            if item is not None:
+                yield item
+
+    def _intraday_tick_requests(self, symbols, start, end, event_types, window, include_condition_codes):
+        """ The request of each security and window, created only as the pipeline takes them """
+        for symbol in dedupe(as_list(symbols)):
+            for window_start, window_end in split_time_range(start, end, window):
+                request = self.refdata_service.createRequest('IntradayTickRequest')
+                request.set('security', symbol)
+                for event_type in as_list(event_types):
+                    request.append('eventTypes', event_type)
+                request.set('startDateTime', window_start)
+                request.set('endDateTime', window_end)
+                if include_condition_codes:
+                    request.set('includeConditionCodes', True)
+                yield request
 
     def request_reference_data(self,
                                symbols,
                                fields,
                                *,
                                overrides=None,
-                               meta=None):
+                               meta=None,
+                               chunk_plan=None,
+                               native_dates=False):
 
-        request = self.create_request('ReferenceDataRequest',
-                                      as_list(symbols),
-                                      as_list(fields),
-                                      overrides=overrides)
+        chunk_plan = chunk_plan or self.chunk_plan
+        requests = [self.create_request('ReferenceDataRequest',
+                                        symbol_chunk,
+                                        field_chunk,
+                                        overrides=overrides)
+                    for symbol_chunk, field_chunk in chunk_plan.reference_chunks(symbols, fields)]
 
-        return self.send_request(request, meta)
+        return self._execute(requests, meta, merge_reference_results, chunk_plan, native_dates=native_dates)
+
+    def request_reference_sweep(self,
+                                symbols,
+                                fields,
+                                override_sets,
+                                *,
+                                overrides=None,
+                                meta=None,
+                                chunk_plan=None):
+        """
+        Reference data of the securities under each of the override_sets
+        (dicts of overrides, on top of overrides), all requested
+        concurrently. The frame of the result has the data of every set,
+        indexed by the override values and symbol. Identical override sets
+        are only requested once.
+        """
+        chunk_plan = chunk_plan or self.chunk_plan
+        override_sets = list(dedupe((merge_dicts(overrides or {}, x) for x in override_sets), key=overrides_key))
+        if not override_sets:
+            raise ValueError('At least one set of overrides is needed')
+
+        # The chunks are the same for every set of overrides
+        chunks = chunk_plan.reference_chunks(symbols, fields)
+        requests = [self.create_request('ReferenceDataRequest', symbol_chunk, field_chunk, overrides=x)
+                    for x in override_sets for symbol_chunk, field_chunk in chunks]
+
+        return self._execute(requests, meta, functools.partial(merge_sweep_results, override_sets), chunk_plan, merge_single=True)
 
     def request_bulk_data(self,
                           symbols,
-                          field,
+                          fields,
                           *,
                           overrides=None,
-                          meta=None):
-
-        if not is_string(field):
-            raise ValueError('Field must be a single string')
-
-        request = self.create_request('ReferenceDataRequest',
-                                      as_list(symbols),
-                                      [field],
-                                      overrides=overrides)
-
-        return self.send_request(request, meta)
+                          meta=None,
+                          chunk_plan=None,
+                          native_dates=False):
+        """
+        Reference data request for one or more bulk fields, to be read with
+        the 'bulk_data' converter (or bulk_data_chunks, one security at a time)
+        """
+        chunk_plan = chunk_plan or self.chunk_plan
+        requests = [self.create_request('ReferenceDataRequest',
+                                        symbol_chunk,
+                                        field_chunk,
+                                        overrides=overrides)
+                    for symbol_chunk, field_chunk in chunk_plan.reference_chunks(symbols, as_list(fields))]
+
+        return self._execute(requests, meta, merge_reference_results, chunk_plan, native_dates=native_dates)
 
     def request_instrument_list(self,
                                 symbol,
                                 key_filter=None,
-                                meta=None):
-
+                                meta=None,
+                                *,
+                                max_results=100000):
+        """ A single instrument lookup; see bbgbridge.instruments.InstrumentIndex for repeated ones """
         request = self.instrument_service.createRequest('instrumentListRequest')
         request.set('query', symbol)
-        request.set('maxResults', 100000)
+        request.set('maxResults', max_results)
 
         if key_filter:
             request.set('yellowKeyFilter', key_filter)
@@ -174,31 +370,213 @@ class BloombergBridge(object):
 
         return request
 
-    def send_request(self, request, meta=None, converter=None):
-        # print('Sending Request: ' + str(request))
-        request_id = self.session.sendRequest(request)
-
-        # Convert request to object form (for easy serialization)
-        req_object = parse_message(request)
-
-        # Convert and accumulate received events
-        ret_object = []
-
-        while True:
-            ev = self.session.nextEvent(timeout=500)  # For Ctrl+C handling:
-            for msg in ev:
-                # print(msg)
-                corr_ids = msg.correlationIds()
-                if len(corr_ids) > 1:
-                    raise RuntimeError('Response has more than one correlation id: ' + str(msg))
-                if request_id == corr_ids[0]:
-                    ret_object.append(parse_message(msg))
-
-            # Response completely received, so we could exit
-            if ev.eventType() == Event.RESPONSE:
-                break
-
-        return BloombergRequestResult(ret_object, req_object, meta=meta, converter=converter)
+    def _execute(self, requests, meta, merge, chunk_plan, *, merge_single=False, **options):
+        """ Send the requests of a chunk plan, merging their results if there is more than one (or merge_single is set) """
+        if len(requests) == 1 and not merge_single:
+            return self.send_request(requests[0], meta, **options)
+
+        results = self.send_requests(requests, max_in_flight=chunk_plan.max_in_flight or DEFAULT_MAX_IN_FLIGHT, **options)
+        return merge(results, meta=meta)
+
+    def send_request(self, request, meta=None, converter=None, *, stream=False, keep_raw=False, native_dates=False, timeout=None):
+        return self.send_requests([request], [meta], converter, stream=stream, keep_raw=keep_raw, native_dates=native_dates,
+                                  timeout=timeout)[0]
+
+    def send_requests(self, requests, metas=None, converter=None, *, max_in_flight=DEFAULT_MAX_IN_FLIGHT, stream=False, keep_raw=False,
+                      native_dates=False, timeout=None):
+        """
+        Send many requests on the same session, keeping up to max_in_flight
+        of them outstanding at once. Results are returned in request order.
+
+        With stream set, historical and intraday bar data is read into the
+        columns of the result's frame as the messages arrive, and is only also
+        kept as parsed messages if keep_raw is set. Streamed requests bypass
+        the cache.
+
+        With native_dates set, the dates of the parsed messages are left as
+        the date and datetime values blpapi returns, rather than converted to
+        Timestamps one by one. The frame converters then convert each date
+        column at once, or keep the values with the *_native_dates
+        converters. These requests bypass the cache too.
+
+        A request not complete timeout seconds (by default request_timeout)
+        after it was sent is cancelled, with the other outstanding ones, and
+        RequestTimeoutError raised.
+        """
+        requests = list(requests)
+        if metas is None:
+            metas = [None] * len(requests)
+        if len(metas) != len(requests):
+            raise ValueError('Expected {} metas but got {}'.format(len(requests), len(metas)))
+
+        results = [None] * len(requests)
+        use_cache = self.cache is not None and not stream and not native_dates
+        if use_cache:
+            for index, request in enumerate(requests):
+                req_object = parse_message(request)
+                ret_object = self.cache.get(req_object)
+                if ret_object is not None:
+                    results[index] = BloombergRequestResult(ret_object, req_object, meta=metas[index], converter=converter)
+
+        to_send = [index for index, res in enumerate(results) if res is None]
+        pipeline = self._pipeline([requests[index] for index in to_send], max_in_flight,
+                                  lambda req_object: create_collector(req_object, stream, keep_raw, native_dates), timeout)
+        for i, req_object, collector in pipeline:
+            if use_cache:
+                self.cache.put(req_object, collector.messages)
+            index = to_send[i]
+            results[index] = BloombergRequestResult(collector.messages, req_object, meta=metas[index], converter=converter,
+                                                    frame=collector.to_frame())
+        return results
+
+    def _pipeline(self, requests, max_in_flight, collector_factory=create_collector, timeout=None):
+        """
+        Yields (index, request object, message collector) for each request as
+        its final RESPONSE event arrives, which is not necessarily in request order
+        """
+        if max_in_flight < 1:
+            raise ValueError('max_in_flight must be at least 1, but was: {}'.format(max_in_flight))
+        if timeout is None:
+            timeout = self.request_timeout
+
+        pending = iter(enumerate(requests))
+        in_flight, correlation_ids, deadlines = {}, {}, {}
+        inbox = []
+        recorder, records = metrics.active, {}
+
+        try:
+            while True:
+                for index, request in itertools.islice(pending, max_in_flight - len(in_flight)):
+                    # Convert request to object form (for easy serialization)
+                    req_object = parse_message(request)
+                    collector = collector_factory(req_object)
+                    if self.scheduler is not None:
+                        self.scheduler.admit(req_object)
+                    correlation_id = CorrelationId(next(self._correlation_ids))
+                    key = correlation_id.value()
+                    if recorder is not None:
+                        records[key] = recorder.start(req_object)
+                    with self._routing:
+                        self._owners[key] = inbox
+                    self.session.sendRequest(request, correlationId=correlation_id)
+                    in_flight[key], correlation_ids[key] = (index, req_object, collector), correlation_id
+                    if timeout is not None:
+                        deadlines[key] = time.monotonic() + timeout
+
+                if not in_flight:
+                    return
+
+                wait = 0.5  # For Ctrl+C handling
+                if deadlines:
+                    wait = max(0.0, min(wait, min(deadlines.values()) - time.monotonic()))
+
+                completed = []
+                for event_type, msg in self._receive(inbox, wait):
+                    key = correlation_key(msg)
+                    if key is None:
+                        raise SessionTerminatedError('Session down with {} requests outstanding: {}'.format(len(in_flight), msg))
+                    if key in in_flight:
+                        if recorder is None:
+                            in_flight[key][2].add(msg)
+                        else:
+                            parse_start = time.perf_counter()
+                            parsed = in_flight[key][2].add(msg)
+                            records[key].on_message(event_type, time.perf_counter() - parse_start, metrics.count_values(parsed))
+                        # Response completely received for this correlation id
+                        if event_type == Event.RESPONSE and key not in completed:
+                            completed.append(key)
+
+                for key in completed:
+                    if recorder is not None:
+                        recorder.finish(records.pop(key), in_flight[key][2].to_frame())
+                    with self._routing:
+                        del self._owners[key]
+                    del correlation_ids[key]
+                    deadlines.pop(key, None)
+                    yield in_flight.pop(key)
+
+                now = time.monotonic()
+                expired = [in_flight[key][1] for key, deadline in deadlines.items() if deadline <= now]
+                if expired:
+                    raise RequestTimeoutError('{} requests did not complete within {}s, e.g. {}'.format(
+                        len(expired), timeout, str(expired[0])[:500]))
+        finally:
+            with self._routing:
+                for key in in_flight:
+                    self._owners.pop(key, None)
+            if self.alive and correlation_ids:
+                self.session.cancel(list(correlation_ids.values()))
+
+    def _receive(self, inbox, timeout):
+        """
+        The (event type, message) pairs routed to inbox within timeout
+        seconds. One caller at a time reads the events of the session and
+        routes each message to the inbox of the request it belongs to, so
+        concurrent callers get theirs as soon as they arrive.
+        """
+        deadline = time.monotonic() + timeout
+        with self._routing:
+            while not inbox and self._reading and time.monotonic() < deadline:
+                self._routing.wait(deadline - time.monotonic())
+            if inbox or self._reading:
+                return _take(inbox)
+            self._reading = True
+
+        ev = None
+        try:
+            ev = self.session.nextEvent(timeout=max(1, int((deadline - time.monotonic()) * 1000)))
+        finally:
+            with self._routing:
+                self._reading = False
+                if ev is not None:
+                    self._route(ev)
+                self._routing.notify_all()
+        with self._routing:
+            return _take(inbox)
+
+    def _route(self, ev):
+        """ Hand the messages of ev to their owners, with self._routing held """
+        event_type = ev.eventType()
+        if event_type in SUBSCRIPTION_EVENTS:
+            if self.subscriptions is not None:
+                self.subscriptions.handle_event(ev)
+            return
+
+        for msg in ev:
+            key = correlation_key(msg)
+            if key is not None:
+                inbox = self._owners.get(key)
+                if inbox is not None:  # otherwise a cancelled request
+                    inbox.append((event_type, msg))
+            elif is_session_down(msg):
+                self.alive = False
+                for inbox in {id(x): x for x in self._owners.values()}.values():
+                    inbox.append((event_type, msg))
+
+
+def _tick_window(req_object, frame, last_end, outdir):
+    """ What request_intraday_tick yields for the frame of a window: the frame, the file it was written to, or None if empty """
+    if frame.empty:
+        return None
+
+    # Windows share their bounds, so keep ticks at a bound in the window starting there
+    body = req_object['IntradayTickRequest']
+    window_start, window_end = to_timestamp(body['startDateTime']), to_timestamp(body['endDateTime'])
+    in_window = (frame['time'] >= window_start) & ((frame['time'] < window_end) | (window_end >= last_end))
+    frame = frame[in_window].reset_index(drop=True)
+
+    if outdir is None:
+        return frame
+    outfile = path.join(path.expanduser(outdir), '{}_{:%Y%m%dT%H%M%S}.bbgb'.format(
+        re.sub(r'[^\w.-]+', '_', body['security']), window_start))
+    write_frame(outfile, frame, {'request': req_object})
+    return outfile
+
+
+def _take(inbox):
+    items = list(inbox)
+    del inbox[:]
+    return items
 
 
 # Excel-like Bloomberg function aliases
@@ -206,3 +584,4 @@ BloombergBridge.bdh = BloombergBridge.request_historical_data
 BloombergBridge.bdp = BloombergBridge.request_reference_data
 BloombergBridge.bds = BloombergBridge.request_bulk_data
 BloombergBridge.bdib = BloombergBridge.request_intraday_bar
+BloombergBridge.bdit = BloombergBridge.request_intraday_tick
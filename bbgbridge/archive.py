@@ -0,0 +1,120 @@
+"""
+Compact binary archive format for frames: a JSON header (for results, with
+their meta, converter and request), followed by the columns of the frame as
+raw arrays, which are memory mapped on load.
+
+Layout: MAGIC, the header length as 8 byte little endian integer, the UTF-8
+JSON header, then each column at the offset the header gives for it, aligned
+to ALIGNMENT bytes. String columns are stored as int32 codes into a list of
+categories kept in the header; columns of other Python objects are kept in
+the header as JSON.
+"""
+import json
+import struct
+from collections import OrderedDict
+from os import path
+
+import numpy as np
+import pandas as pd
+
+from bbgbridge.util import CustomJSONEncoder, is_string
+
+MAGIC = b'BBGBRIDGE\x01'
+ALIGNMENT = 64
+
+
+def _padding(offset):
+    return -offset % ALIGNMENT
+
+
+def _encode_column(name, series):
+    """ The header entry and the raw array (or None) of a column """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return OrderedDict([('name', name), ('kind', 'categorical'), ('categories', list(series.cat.categories)),
+                            ('dtype', str(series.cat.codes.dtype))]), series.cat.codes.values
+    if isinstance(series.dtype, pd.DatetimeTZDtype):
+        return OrderedDict([('name', name), ('kind', 'datetime'), ('tz', str(series.dt.tz)), ('dtype', 'datetime64[ns]')]), \
+            series.dt.tz_convert(None).values.astype('datetime64[ns]')
+    if series.dtype.kind in 'biufmM':
+        return OrderedDict([('name', name), ('kind', 'array'), ('dtype', series.dtype.str)]), series.values
+
+    values = series.tolist()
+    if all(is_string(x) or x is None or (isinstance(x, float) and np.isnan(x)) for x in values):
+        codes, categories = pd.factorize(series)
+        return OrderedDict([('name', name), ('kind', 'strings'), ('categories', list(categories)),
+                            ('dtype', 'int32')]), codes.astype(np.int32)
+    return OrderedDict([('name', name), ('kind', 'json'), ('values', values)]), None
+
+
+def _decode_column(column, data):
+    kind = column['kind']
+    if kind == 'json':
+        return column['values']
+    if kind == 'strings':
+        return pd.Categorical.from_codes(data, column['categories']).astype(object)
+    if kind == 'categorical':
+        return pd.Categorical.from_codes(data, column['categories'])
+    if kind == 'datetime':
+        return pd.DatetimeIndex(data).tz_localize('UTC').tz_convert(column['tz'])
+    return data
+
+
+def write_frame(outfile, frame, header=None):
+    """ Write frame, after the JSON serializable header dict """
+    columns, arrays = [], []
+    for name in frame.columns:
+        column, data = _encode_column(str(name), frame[name])
+        columns.append(column)
+        arrays.append(None if data is None else np.ascontiguousarray(data))
+
+    header = OrderedDict(header or {}, length=len(frame), columns=columns)
+
+    # Offsets depend on the header length, which depends on the offsets, so
+    # reserve the space a header with the largest possible offsets would take
+    for column, data in zip(columns, arrays):
+        if data is not None:
+            column['offset'], column['nbytes'] = 2 ** 62, data.nbytes
+    header_size = len(json.dumps(header, cls=CustomJSONEncoder).encode('utf-8'))
+    offset = len(MAGIC) + 8 + header_size
+    offset += _padding(offset)
+    for column, data in zip(columns, arrays):
+        if data is not None:
+            column['offset'] = offset
+            offset += data.nbytes + _padding(data.nbytes)
+
+    header_bytes = json.dumps(header, cls=CustomJSONEncoder).encode('utf-8').ljust(header_size)
+    with open(path.expanduser(outfile), 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<q', header_size))
+        f.write(header_bytes)
+        for column, data in zip(columns, arrays):
+            if data is not None:
+                f.seek(column['offset'])
+                f.write(data.tobytes())
+        f.truncate(offset)
+
+
+def read_header(infile):
+    with open(path.expanduser(infile), 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('Not a bbgbridge binary file: {}'.format(infile))
+        header_size, = struct.unpack('<q', f.read(8))
+        return json.loads(f.read(header_size).decode('utf-8'), object_pairs_hook=OrderedDict)
+
+
+def read_frame(infile):
+    """
+    The header and the frame of the file, with the columns memory mapped
+    (copy on write) rather than read
+    """
+    infile = path.expanduser(infile)
+    header = read_header(infile)
+    buffer = np.memmap(infile, dtype=np.uint8, mode='c')
+    data = OrderedDict()
+    for column in header['columns']:
+        values = None
+        if 'offset' in column:
+            # Plain arrays, not memmaps, over the same memory
+            values = buffer[column['offset']:column['offset'] + column['nbytes']].view(np.dtype(column['dtype']), np.ndarray)
+        data[column['name']] = _decode_column(column, values)
+    return header, pd.DataFrame(data, index=pd.RangeIndex(header['length']), copy=False)
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from os import path
+
+import pandas as pd
+
+from bbgbridge.util import CustomJSONEncoder, date_bloomberg_string
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+DEFAULT_TTLS = {
+    'ReferenceDataRequest': 15 * MINUTE,
+    'HistoricalDataRequest': HOUR,
+    'IntradayBarRequest': HOUR,
+    'instrumentListRequest': DAY,
+}
+
+# Eviction stops once the cache is below this fraction of max_bytes, so a
+# full cache is not scanned again on the next put
+EVICT_TO = 0.9
+
+
+def normalize_request(req_object):
+    """
+    The parsed request with securities and fields deduped and sorted,
+    and overrides sorted, so equivalent requests normalize the same
+    """
+    normalized = OrderedDict()
+    for request_type, body in req_object.items():
+        body = OrderedDict(body)
+        for key in ('securities', 'fields'):
+            if key in body:
+                body[key] = sorted(set(body[key]))
+        if 'overrides' in body:
+            body['overrides'] = sorted(body['overrides'], key=lambda x: json.dumps(x, cls=CustomJSONEncoder, sort_keys=True))
+        normalized[request_type] = body
+    return normalized
+
+
+def request_key(req_object):
+    normalized = json.dumps(normalize_request(req_object), cls=CustomJSONEncoder, sort_keys=True)
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+
+def is_final_history(req_object):
+    """ Historical data that ends before today will not change anymore """
+    body = req_object.get('HistoricalDataRequest')
+    return body is not None and body.get('endDate', '99999999') < date_bloomberg_string(pd.Timestamp.now())
+
+
+class ResultCache(object):
+    """
+    Disk cache of request results, keyed by the normalized parsed request.
+
+    Entries expire after a time to live that depends on the request type
+    (see DEFAULT_TTLS), except for historical data ending before today,
+    which uses final_history_ttl. None means never expire. When the cache
+    grows beyond max_bytes, the least recently used entries are removed.
+    The size of the cache is kept as a running estimate, corrected each
+    time the directory is scanned for eviction.
+    """
+
+    def __init__(self,
+                 directory='~/.bbgbridge/cache',
+                 *,
+                 max_bytes=1 << 30,
+                 ttls=None,
+                 default_ttl=HOUR,
+                 final_history_ttl=30 * DAY):
+        self.directory = path.expanduser(directory)
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.default_ttl = default_ttl
+        self.final_history_ttl = final_history_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._size = self.size_bytes()
+
+    def ttl_for(self, req_object):
+        if is_final_history(req_object):
+            return self.final_history_ttl
+        (request_type, _), = req_object.items()
+        return self.ttls.get(request_type, self.default_ttl)
+
+    def _path(self, req_object):
+        return path.join(self.directory, request_key(req_object) + '.pickle')
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, req_object):
+        """ The cached result (list of parsed messages) of the request, or None """
+        entry_path = self._path(req_object)
+        try:
+            with open(entry_path, 'rb') as f:
+                expires, ret_object = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self._count('misses')
+            return None
+
+        if expires is not None and expires < time.time():
+            self._remove(entry_path)
+            self._count('misses')
+            return None
+
+        try:
+            os.utime(entry_path)  # Mark as recently used
+        except OSError:
+            pass  # Evicted or replaced meanwhile, the loaded result is still good
+        self._count('hits')
+        return ret_object
+
+    def put(self, req_object, ret_object):
+        if any(isinstance(msg, dict) and 'responseError' in msg for msg in ret_object):
+            return  # Failed requests are not worth remembering
+
+        ttl = self.ttl_for(req_object)
+        expires = None if ttl is None else time.time() + ttl
+        entry_path = self._path(req_object)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((expires, ret_object), f, protocol=pickle.HIGHEST_PROTOCOL)
+            written = f.tell()
+        try:
+            replaced = os.stat(entry_path).st_size
+        except OSError:
+            replaced = 0
+        os.replace(tmp_path, entry_path)
+
+        with self._lock:
+            self._size += written - replaced
+            full = self._size > self.max_bytes
+        if full:
+            self._evict()
+
+    def _remove(self, entry_path):
+        try:
+            os.remove(entry_path)
+        except OSError:
+            pass  # Already removed by someone else
+
+    def _entries(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.pickle'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                yield entry.path, stat.st_mtime, stat.st_size
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda x: x[1])
+        total = sum(size for _, _, size in entries)
+        for entry_path, _, size in entries:
+            if total <= self.max_bytes * EVICT_TO:
+                break
+            self._remove(entry_path)
+            self._count('evictions')
+            total -= size
+        with self._lock:
+            self._size = total
+
+    def clear(self):
+        for entry_path, _, _ in list(self._entries()):
+            self._remove(entry_path)
+        with self._lock:
+            self._size = 0
+
+    def size_bytes(self):
+        return sum(size for _, _, size in self._entries())
+
+    def stats(self):
+        with self._lock:
+            return OrderedDict([
+                ('hits', self.hits),
+                ('misses', self.misses),
+                ('evictions', self.evictions),
+            ])
+
+    def __repr__(self):
+        return 'ResultCache({}, {})'.format(self.directory, dict(self.stats()))
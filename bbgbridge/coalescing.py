@@ -0,0 +1,118 @@
+"""
+Front end for BloombergBridge that lets many threads share reference data
+requests: concurrent calls are merged into one request, and calls covered by
+a request already in flight wait for its result instead of sending another
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from bbgbridge.planning import overrides_key, subset_reference_result
+from bbgbridge.util import as_list, dedupe
+
+
+class _Batch(object):
+    def __init__(self, overrides):
+        self.key = overrides_key(overrides)
+        self.overrides = overrides
+        self.symbols = OrderedDict()
+        self.fields = OrderedDict()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def add(self, symbols, fields):
+        self.symbols.update((s, True) for s in symbols)
+        self.fields.update((f, True) for f in fields)
+
+    def covers(self, symbols, fields):
+        return all(s in self.symbols for s in symbols) and all(f in self.fields for f in fields)
+
+
+def _raise_error(error):
+    """ Raise a copy of the error of a batch, so its waiters do not share one exception and traceback """
+    try:
+        copied = copy.copy(error)
+    except Exception:
+        copied = RuntimeError('The coalesced request failed: {!r}'.format(error))
+    raise copied from error
+
+
+class CoalescingBridge(object):
+    """
+    Thread safe front end for the reference data requests of a bridge.
+
+    The first call of a batch waits `window` seconds for other calls with
+    the same overrides, or until the batch has max_symbols securities (by
+    default the symbols_per_request of the bridge's chunk plan), then sends
+    one request for the union of their securities and fields, and every
+    call gets only the securities and fields it asked for. A call whose
+    securities and fields are all part of a request already in flight waits
+    for that one instead. Batches with different overrides are sent
+    concurrently.
+    """
+
+    def __init__(self, bridge, window=0.005, max_symbols=None):
+        self.bridge = bridge
+        self.window = window
+        self.max_symbols = max_symbols or bridge.chunk_plan.symbols_per_request
+        self.calls = 0
+        self.requests_sent = 0
+        self._open = {}
+        self._in_flight = []
+        self._lock = threading.Lock()
+        self._filled = threading.Condition(self._lock)
+
+    def request_reference_data(self, symbols, fields, *, overrides=None, meta=None):
+        symbols, fields = list(dedupe(as_list(symbols))), list(dedupe(as_list(fields)))
+        key = overrides_key(overrides)
+        with self._lock:
+            self.calls += 1
+            batch = next((x for x in self._in_flight if x.key == key and x.covers(symbols, fields)), None)
+            leader = False
+            if batch is None:
+                batch = self._open.get(key)
+                if batch is None:
+                    batch = self._open[key] = _Batch(overrides)
+                    leader = True
+                batch.add(symbols, fields)
+                if self.max_symbols and len(batch.symbols) >= self.max_symbols:
+                    del self._open[key]  # Later calls start the next batch
+                    self._filled.notify_all()
+
+        if leader:
+            self._send(batch)
+        batch.done.wait()
+
+        if batch.error is not None:
+            _raise_error(batch.error)
+        return subset_reference_result(batch.result, symbols, fields, meta=meta)
+
+    def _send(self, batch):
+        deadline = time.monotonic() + self.window
+        with self._lock:
+            while self._open.get(batch.key) is batch and time.monotonic() < deadline:
+                self._filled.wait(deadline - time.monotonic())
+            if self._open.get(batch.key) is batch:
+                del self._open[batch.key]
+            self._in_flight.append(batch)
+            self.requests_sent += 1
+
+        try:
+            batch.result = self.bridge.request_reference_data(list(batch.symbols), list(batch.fields),
+                                                              overrides=batch.overrides)
+        except Exception as e:
+            batch.error = e
+        finally:
+            with self._lock:
+                self._in_flight.remove(batch)
+            batch.done.set()
+
+    def __repr__(self):
+        return 'CoalescingBridge(window={}, max_symbols={}, calls={}, requests_sent={})'.format(
+            self.window, self.max_symbols, self.calls, self.requests_sent)
+
+
+# Excel-like Bloomberg function alias
+CoalescingBridge.bdp = CoalescingBridge.request_reference_data
@@ -1,7 +1,13 @@
 import collections
+import itertools
+import time
+
+import numpy as np
 import pandas as pd
+from pandas.api.types import infer_dtype, union_categoricals
 
-from bbgbridge.util import merge_dicts, is_string
+from bbgbridge import metrics
+from bbgbridge.util import as_list, dedupe, merge_dicts, is_string, to_timestamp
 
 
 def _possible_security_error(security_error):
@@ -32,17 +38,6 @@ def _refdata_generator(result):
     )
 
 
-def _bulkresult_generator(result):
-    for z in result:
-        for y in z:
-            symbol_dict = {'symbol': y['securityData']['security']}
-            field_data = y['securityData']['fieldData']['fieldData']
-            for k, v in field_data:
-                if not is_string(v) and isinstance(v, collections.Iterable):
-                    for bv in v:
-                        yield merge_dicts(symbol_dict, bv[k])
-
-
 def _intraday_bar_generator(result, symbol, raise_on_missing):
     bar_data = result.get('barData')
     if bar_data:
@@ -52,28 +47,276 @@ def _intraday_bar_generator(result, symbol, raise_on_missing):
         raise RuntimeError('Bad data point detected: ' + str(result))
 
 
+class ColumnarFrameBuilder(object):
+    """
+    Collects the field data dicts of rows as they are, with the symbol of
+    each run of rows, and builds a typed DataFrame in one go: pandas decodes
+    the rows and infers the dtype of each column in compiled code (float64
+    for numbers with gaps), the date/time columns and any other column of
+    date values are converted to datetime64 in one pass, and the symbol
+    column is categorical. With native_dates those columns keep the values
+    as they are instead. Columns are in the order a DataFrame of row dicts
+    would have. With columns, the other keys of the rows are skipped.
+    """
+
+    datetime_columns = frozenset(['date', 'time'])
+
+    def __init__(self, native_dates=False, columns=None):
+        self.native_dates = native_dates
+        self.keep = None if columns is None else frozenset(columns)
+        self.rows = []
+        self.symbols = []
+        self.symbol_codes = collections.OrderedDict()
+        self.symbol_position = None
+        self.length = 0
+
+    def add_rows(self, rows, symbol):
+        """ Add the field data dicts of rows, all for the same symbol """
+        start = len(self.rows)
+        self.rows.extend(rows)
+        self.length = len(self.rows)
+        if self.length > start:
+            if self.symbol_position is None:
+                # a frame of row dicts with the symbol added last has it after the keys of the first row
+                first = self.rows[0]
+                self.symbol_position = len(first) if self.keep is None else sum(k in self.keep for k in first)
+            code = self.symbol_codes.setdefault(symbol, len(self.symbol_codes))
+            self.symbols.append((code, self.length - start))
+
+    def _column_order(self):
+        if self.keep is None:
+            return None
+        # dict.fromkeys over all the keys runs in compiled code
+        return [k for k in dict.fromkeys(itertools.chain.from_iterable(self.rows)) if k in self.keep]
+
+    def to_frame(self):
+        if not self.rows:
+            return pd.DataFrame(index=pd.RangeIndex(0))
+
+        frame = pd.DataFrame(self.rows, columns=self._column_order())
+        for name in frame.columns:
+            column = frame[name]
+            if self.native_dates:
+                if column.dtype.kind == 'M':
+                    # pandas converts datetime values itself, put back the values as they were
+                    frame[name] = pd.Series([row.get(name, np.nan) for row in self.rows], dtype=object)
+            elif column.dtype.kind != 'M' and (name in self.datetime_columns or
+                                               (column.dtype == object and _holds_dates(column))):
+                frame[name] = pd.to_datetime(column)
+
+        codes = np.repeat([c for c, _ in self.symbols], [count for _, count in self.symbols]).astype(np.int32)
+        frame.insert(min(self.symbol_position, len(frame.columns)), 'symbol',
+                     pd.Categorical.from_codes(codes, categories=list(self.symbol_codes)))
+        return frame
+
+
+def _holds_dates(column):
+    """ Whether the values of an object column are all dates (or datetimes), checked in compiled code """
+    return infer_dtype(column, skipna=True) in ('date', 'datetime')
+
+
+def _convert_date_columns(frame, native_dates=False):
+    """ Convert the object columns holding only date values to datetime64, in one pass each """
+    if native_dates:
+        return frame
+    for name in frame.columns:
+        if frame[name].dtype == object and len(frame[name].dropna()) and _holds_dates(frame[name]):
+            frame[name] = pd.to_datetime(frame[name])
+    return frame
+
+
+class Projection(object):
+    """
+    The part of a result to convert: only the data columns in columns, the
+    securities in symbols and the rows dated from start to end (inclusive).
+    None keeps everything. The date, time, symbol, field and error columns
+    are always kept.
+    """
+
+    key_columns = frozenset(['date', 'time', 'symbol', 'field', 'error_category', 'error_message'])
+
+    def __init__(self, columns=None, symbols=None, start=None, end=None):
+        self.columns = None if columns is None else tuple(as_list(columns))
+        self.symbols = None if symbols is None else frozenset(as_list(symbols))
+        self.start = None if start is None else to_timestamp(start)
+        self.end = None if end is None else to_timestamp(end)
+
+    def key(self):
+        return self.columns, self.symbols, self.start, self.end
+
+    def builder_columns(self):
+        return None if self.columns is None else self.key_columns.union(self.columns)
+
+    def keeps(self, symbol):
+        return self.symbols is None or symbol in self.symbols
+
+    def rows(self, rows, time_key):
+        """ The rows whose time_key value is in the date range """
+        if self.start is None and self.end is None:
+            return rows
+        return (row for row in rows if time_key in row and self._in_range(to_timestamp(row[time_key])))
+
+    def _in_range(self, timestamp):
+        return (self.start is None or timestamp >= self.start) and (self.end is None or timestamp <= self.end)
+
+    def apply(self, frame):
+        """ The projection of a frame that is already converted """
+        mask = np.ones(len(frame), dtype=bool)
+        if self.symbols is not None and 'symbol' in frame.columns:
+            mask &= frame['symbol'].isin(self.symbols).values
+        for name in ('date', 'time'):
+            if name not in frame.columns or (self.start is None and self.end is None):
+                continue
+            times = pd.to_datetime(frame[name])
+            if self.start is not None:
+                mask &= (times >= self.start).values
+            if self.end is not None:
+                mask &= (times <= self.end).values
+        columns = [c for c in frame.columns if self.columns is None or c in self.key_columns or c in self.columns]
+        if mask.all():
+            return frame[columns]
+        return frame.loc[mask, columns].reset_index(drop=True)
+
+
+NO_PROJECTION = Projection()
+
+
 # ============ Bloomberg result parsing functions ============
 
 
-def price_to_frame(bbg_result, raise_on_missing=True):
-    return pd.DataFrame(list(x for y in bbg_result.result for x in _price_generator(y, raise_on_missing)))
+def price_to_frame(bbg_result, raise_on_missing=True, native_dates=False, projection=NO_PROJECTION):
+    builder = ColumnarFrameBuilder(native_dates, projection.builder_columns())
+    for result in bbg_result.result:
+        security_data = result.get('securityData')
+        if security_data:
+            if projection.keeps(security_data['security']):
+                builder.add_rows(projection.rows((x['fieldData'] for x in security_data['fieldData']), 'date'),
+                                 security_data['security'])
+        elif raise_on_missing:
+            raise RuntimeError('Bad data point detected: ' + str(result))
+    return builder.to_frame()
 
 
-def refdata_to_frame(bbg_result):
-    refdata = pd.DataFrame(list(_refdata_generator(bbg_result.result)))
-    desired_columns = bbg_result.request['ReferenceDataRequest']['fields']
-    available_columns = [c for c in desired_columns if c in refdata.columns]
-    extra_columns = [c for c in refdata.columns if c not in desired_columns]
-    return refdata[extra_columns + available_columns]
+def _refdata_rows(result, projection):
+    for z in result:
+        for y in z:
+            security_data = y['securityData']
+            if not projection.keeps(security_data['security']):
+                continue
+            row = collections.OrderedDict(
+                (k, v) for k, v in security_data['fieldData']['fieldData'].items()
+                if projection.columns is None or k in projection.columns)
+            row['symbol'] = security_data['security']
+            row.update(_possible_security_error(security_data.get('securityError')))
+            yield row
 
 
-def intraday_bar_to_frame(bbg_result, raise_on_missing=True):
-    symbol = bbg_result.request['IntradayBarRequest']['security']
-    return pd.DataFrame(list(x for y in bbg_result.result for x in _intraday_bar_generator(y, symbol, raise_on_missing)))
+def _refdata_frame(messages, desired_columns, native_dates, projection):
+    rows = list(_refdata_rows(messages, projection))
+    seen = collections.OrderedDict((k, True) for row in rows for k in row)
+    available_columns = [c for c in desired_columns if c in seen]
+    extra_columns = [c for c in seen if c not in desired_columns]
+    # Selecting the columns while building avoids copying the frame to reorder them
+    return _convert_date_columns(pd.DataFrame(rows, columns=extra_columns + available_columns), native_dates)
 
 
-def bulk_data_to_frame(bbg_result):
-    return pd.DataFrame(list(_bulkresult_generator(x) for x in bbg_result.result))
+def refdata_to_frame(bbg_result, native_dates=False, projection=NO_PROJECTION):
+    """
+    The reference data of the result. For the result of an override sweep,
+    whose request lists the overrideSets and how many messages each has, the
+    data of every override set, indexed by the override values and symbol.
+    """
+    body = bbg_result.request['ReferenceDataRequest']
+    if 'overrideSets' not in body:
+        return _refdata_frame(bbg_result.result, body['fields'], native_dates, projection)
+
+    levels = list(dedupe(k for x in body['overrideSets'] for k in x['overrides']))
+    frames, start = [], 0
+    for override_set in body['overrideSets']:
+        frame = _refdata_frame(bbg_result.result[start:start + override_set['messages']], body['fields'], native_dates, projection)
+        start += override_set['messages']
+        for level in levels:
+            frame[level] = override_set['overrides'].get(level)
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True, sort=False).set_index(levels + ['symbol'])
+
+
+def intraday_bar_to_frame(bbg_result, raise_on_missing=True, native_dates=False, projection=NO_PROJECTION):
+    symbol = bbg_result.request['IntradayBarRequest'].get('security')
+    builder = ColumnarFrameBuilder(native_dates, projection.builder_columns())
+    for result in bbg_result.result:
+        bar_data = result.get('barData')
+        if bar_data:
+            # barData of merged results of several securities says which one it is for
+            bar_symbol = bar_data.get('security', symbol)
+            if projection.keeps(bar_symbol):
+                builder.add_rows(projection.rows((x['barTickData'] for x in bar_data['barTickData']), 'time'), bar_symbol)
+        elif raise_on_missing:
+            raise RuntimeError('Bad data point detected: ' + str(result))
+    return builder.to_frame()
+
+
+def _bulk_fields(bbg_result, items):
+    """ The bulk fields of the items, requested ones first """
+    fields = collections.OrderedDict.fromkeys((bbg_result.request or {}).get('ReferenceDataRequest', {}).get('fields', []))
+    for y in items:
+        for field, value in y['securityData'].get('fieldData', {}).get('fieldData', {}).items():
+            if isinstance(value, list):
+                fields[field] = True
+    return fields
+
+
+def _bulk_frame(items, fields, native_dates, projection=NO_PROJECTION):
+    """
+    One row per bulk row of the items, with the field it belongs to, its
+    security and its sub-elements as columns
+    """
+    builders = collections.OrderedDict((field, ColumnarFrameBuilder(native_dates, projection.builder_columns())) for field in fields)
+    for y in items:
+        security_data = y['securityData']
+        if not projection.keeps(security_data['security']):
+            continue
+        for field, rows in security_data.get('fieldData', {}).get('fieldData', {}).items():
+            if isinstance(rows, list):
+                # each row is {field: sub-elements}
+                builders[field].add_rows((v for row in rows for v in row.values()), security_data['security'])
+
+    frames = []
+    for field, builder in builders.items():
+        if builder.length:
+            frame = builder.to_frame()
+            frame.insert(0, 'field', pd.Categorical.from_codes(np.zeros(len(frame), dtype=np.int32), categories=[field]))
+            frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=['field', 'symbol'])
+
+    frame = frames[0]
+    if len(frames) > 1:
+        frame = pd.concat(frames, ignore_index=True, sort=False)
+        for name in ('field', 'symbol'):
+            frame[name] = union_categoricals([x[name] for x in frames])
+    return frame[['field', 'symbol'] + [c for c in frame.columns if c not in ('field', 'symbol')]]
+
+
+def bulk_data_to_frame(bbg_result, native_dates=False, projection=NO_PROJECTION):
+    """
+    The bulk fields of a reference data result (e.g. INDX_MEMBERS,
+    DVD_HIST_ALL), one row per bulk row, with categorical field and symbol
+    columns and a typed column per sub-element. Fields whose sub-elements
+    differ leave the columns of the others empty.
+    """
+    items = [y for z in bbg_result.result for y in z]
+    return _bulk_frame(items, _bulk_fields(bbg_result, items), native_dates, projection)
+
+
+def bulk_data_chunks(bbg_result, securities_per_chunk=1, native_dates=False):
+    """ Yields the frame bulk_data_to_frame would make, in parts of securities_per_chunk securities """
+    items = [y for z in bbg_result.result for y in z]
+    fields = _bulk_fields(bbg_result, items)
+    for i in range(0, len(items), securities_per_chunk):
+        frame = _bulk_frame(items[i:i + securities_per_chunk], fields, native_dates)
+        if len(frame):
+            yield frame
 
 
 def symbol_lookup_dataframe(res):
@@ -83,20 +326,35 @@ def symbol_lookup_dataframe(res):
          for x in y['InstrumentListResponse']['results']])
 
 
+# All of them take a projection keyword
 frame_converters = {
     'price': price_to_frame,
-    'price_ignore_missing': lambda x: price_to_frame(x, raise_on_missing=False),
+    'price_ignore_missing': lambda x, **kw: price_to_frame(x, raise_on_missing=False, **kw),
     'intraday_bar': intraday_bar_to_frame,
-    'intraday_bar_ignore_missing': lambda x: intraday_bar_to_frame(x, raise_on_missing=False),
+    'intraday_bar_ignore_missing': lambda x, **kw: intraday_bar_to_frame(x, raise_on_missing=False, **kw),
+    'price_native_dates': lambda x, **kw: price_to_frame(x, native_dates=True, **kw),
+    'intraday_bar_native_dates': lambda x, **kw: intraday_bar_to_frame(x, native_dates=True, **kw),
     'refdata': refdata_to_frame,
-    'bulk_data': bulk_data_to_frame
+    'refdata_native_dates': lambda x, **kw: refdata_to_frame(x, native_dates=True, **kw),
+    'bulk_data': bulk_data_to_frame,
+    'bulk_data_native_dates': lambda x, **kw: bulk_data_to_frame(x, native_dates=True, **kw),
 }
 
 
-def convert_to_frame(bbg_result, converter):
+def _convert(bbg_result, converter, converter_func, projection):
+    if projection is None:
+        return converter_func(bbg_result)
+    if converter in frame_converters:
+        return converter_func(bbg_result, projection=projection)
+    return projection.apply(converter_func(bbg_result))
+
+
+def convert_to_frame(bbg_result, converter, projection=None):
     """
     Read a bloomberg result object and converts it to a dataframe.
-    The converter can one of predefined strings, or a function
+    The converter can one of predefined strings, or a function. The
+    predefined ones only convert the part of the result in projection,
+    the frames of functions are projected once converted.
     """
     if converter is None:
         raise ValueError("I need to know the converter in order to convert to DataFrame")
@@ -104,4 +362,12 @@ def convert_to_frame(bbg_result, converter):
     converter_func = frame_converters.get(converter, converter)
     if is_string(converter_func):
         raise ValueError('converter must be one of {}, or a function, but was: {}'.format(sorted(frame_converters.keys()), converter_func))
-    return converter_func(bbg_result)
+    recorder = metrics.active
+    if recorder is None:
+        return _convert(bbg_result, converter, converter_func, projection)
+
+    start = time.perf_counter()
+    frame = _convert(bbg_result, converter, converter_func, projection)
+    (request_type, _), = (bbg_result.request or {'unknown': None}).items()
+    recorder.record_conversion(request_type, getattr(converter, '__name__', converter), time.perf_counter() - start, len(frame))
+    return frame
@@ -0,0 +1,483 @@
+"""
+In-memory stand-ins for the parts of blpapi used by BloombergBridge, so the
+bridge can be exercised without a Bloomberg terminal.
+
+Responses are described in the same nested form that parse_message produces
+(and that BloombergRequestResult.to_json writes), so recorded results can be
+played back as-is.
+"""
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import date, datetime
+
+from blpapi import CorrelationId, DataType, Event
+
+from bbgbridge.parsing import parse_message
+from bbgbridge.util import to_timestamp
+
+
+def _plain_datatype(value):
+    if isinstance(value, bool):
+        return DataType.BOOL
+    if isinstance(value, int):
+        return DataType.INT32
+    if isinstance(value, float):
+        return DataType.FLOAT64
+    if isinstance(value, datetime):
+        return DataType.DATETIME
+    if isinstance(value, date):
+        return DataType.DATE
+    return DataType.STRING
+
+
+def _unwrap(name, value):
+    """ Parsed sequences look like {name: children}, so strip the name if present """
+    if isinstance(value, dict) and len(value) == 1:
+        (key, children), = value.items()
+        if isinstance(children, dict):
+            return key, children
+    return name, value
+
+
+class _FakeDefinition(object):
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+
+class FakeElement(object):
+    def __init__(self, name, value, datatype, is_array=False):
+        self._name = name
+        self._value = value
+        self._datatype = datatype
+        self._is_array = is_array
+
+    @classmethod
+    def from_value(cls, name, value):
+        if isinstance(value, list):
+            items = [x for x in value if x is not None]
+            if items and isinstance(items[0], dict):
+                return cls(name, [cls.sequence(*_unwrap(name, x)) for x in value], DataType.SEQUENCE, is_array=True)
+            return cls(name, list(value), _plain_datatype(items[0]) if items else DataType.STRING, is_array=True)
+        if isinstance(value, dict):
+            return cls.sequence(*_unwrap(name, value))
+        return cls(name, value, _plain_datatype(value))
+
+    @classmethod
+    def sequence(cls, name, children):
+        return cls(name, [cls.from_value(k, v) for k, v in children.items()], DataType.SEQUENCE)
+
+    @classmethod
+    def choice(cls, name, chosen):
+        return cls(name, chosen, DataType.CHOICE)
+
+    def name(self):
+        return self._name
+
+    def elementDefinition(self):
+        return _FakeDefinition(self._name)
+
+    def datatype(self):
+        return self._datatype
+
+    def isArray(self):
+        return self._is_array
+
+    def isNull(self):
+        return self._value is None
+
+    def numValues(self):
+        return len(self._value) if self._is_array else int(self._value is not None)
+
+    def numElements(self):
+        return 0 if self._is_array or self._datatype != DataType.SEQUENCE else len(self._value)
+
+    def values(self):
+        return iter(self._value) if self._is_array else iter([self._value])
+
+    def getValue(self, index=0):
+        return self._value[index] if self._is_array else self._value
+
+    def elements(self):
+        return iter(self._value)
+
+    def hasElement(self, name):
+        return any(x.name() == name for x in self._value)
+
+    def getElement(self, name):
+        for child in self._value:
+            if child.name() == name:
+                return child
+        raise KeyError(name)
+
+    def getChoice(self):
+        return self._value
+
+
+class FakeMessage(object):
+    def __init__(self, payload, correlation_id=None, message_type='Response'):
+        self._payload = payload
+        self._correlation_id = correlation_id
+        self._message_type = message_type
+        self._element = None
+
+    def messageType(self):
+        return self._message_type
+
+    def correlationIds(self):
+        return [] if self._correlation_id is None else [self._correlation_id]
+
+    def asElement(self):
+        if self._element is None:
+            self._element = self._build_element()
+        return self._element
+
+    def _build_element(self):
+        if isinstance(self._payload, list):
+            name, _ = _unwrap(self._message_type, self._payload[0]) if self._payload else (self._message_type, None)
+            return FakeElement.choice(self._message_type, FakeElement.from_value(name, self._payload))
+        name, children = _unwrap(self._message_type, self._payload)
+        if name == self._message_type:
+            return FakeElement.sequence(name, children)
+        return FakeElement.choice(self._message_type, FakeElement.sequence(name, children))
+
+    def __repr__(self):
+        return 'FakeMessage({}, {})'.format(self._message_type, self._payload)
+
+
+class FakeEvent(object):
+    def __init__(self, event_type, messages=()):
+        self._event_type = event_type
+        self._messages = list(messages)
+
+    def eventType(self):
+        return self._event_type
+
+    def __iter__(self):
+        return iter(self._messages)
+
+
+class _FakeSequenceBuilder(object):
+    def __init__(self):
+        self.children = OrderedDict()
+
+    def setElement(self, name, value):
+        self.children[name] = value
+
+
+class _FakeArrayBuilder(object):
+    def __init__(self, name, items):
+        self._name = name
+        self._items = items
+
+    def appendElement(self):
+        builder = _FakeSequenceBuilder()
+        self._items.append({self._name: builder.children})
+        return builder
+
+
+class FakeRequest(object):
+    def __init__(self, request_type):
+        self.request_type = request_type
+        self._elements = OrderedDict()
+
+    def set(self, name, value):
+        self._elements[name] = value
+
+    def append(self, name, value):
+        self._elements.setdefault(name, []).append(value)
+
+    def getElement(self, name):
+        return _FakeArrayBuilder(name, self._elements.setdefault(name, []))
+
+    def asElement(self):
+        return FakeElement.sequence(self.request_type, self._elements)
+
+    def __str__(self):
+        return '{} = {}'.format(self.request_type, dict(self._elements))
+
+
+class FakeService(object):
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+    def createRequest(self, request_type):
+        return FakeRequest(request_type)
+
+
+def response_type(request_type):
+    """ HistoricalDataRequest -> HistoricalDataResponse """
+    name = request_type[:1].upper() + request_type[1:]
+    return name[:-len('Request')] + 'Response' if name.endswith('Request') else name
+
+
+class FakeSession(object):
+    """
+    Plays back responses for requests sent through it.
+
+    responder is called with the parsed request (as produced by parse_message)
+    and returns the list of parsed messages to send back. Each outstanding
+    request gets one message per nextEvent call in round robin order, so
+    responses to concurrent requests arrive interleaved: every message but
+    the last comes as a PARTIAL_RESPONSE event and the last as a RESPONSE.
+
+    latency is the number of seconds before the first message of a request
+    is available, and message_latency the number of seconds between its
+    messages.
+
+    terminate() simulates the session going down: the next event is a
+    SESSION_STATUS event with a SessionTerminated message. cancel() drops
+    the remaining messages of requests.
+
+    Subscriptions are confirmed with a SubscriptionStarted message, and
+    replay() plays back market data for them.
+    """
+
+    def __init__(self, responder, *, latency=0, message_latency=0):
+        self.responder = responder
+        self.latency = latency
+        self.message_latency = message_latency
+        self.sent_requests = []
+        self.max_outstanding = 0
+        self.cancelled = []
+        self.started = False
+        self.opened_services = []
+        self.subscriptions = OrderedDict()
+        self._outstanding = deque()
+        self._events = deque()
+        self._correlation_ids = itertools.count(1)
+        self._condition = threading.Condition()
+
+    def start(self):
+        self.started = True
+        return True
+
+    def stop(self):
+        self.started = False
+        return True
+
+    def openService(self, name):
+        self.opened_services.append(name)
+        return True
+
+    def terminate(self):
+        with self._condition:
+            self.started = False
+            self._events.append(FakeEvent(Event.SESSION_STATUS, [FakeMessage({}, message_type='SessionTerminated')]))
+            self._condition.notify_all()
+
+    def getService(self, name):
+        return FakeService(name)
+
+    def subscribe(self, subscription_list, identity=None, requestLabel=''):
+        with self._condition:
+            for i in range(subscription_list.size()):
+                correlation_id = subscription_list.correlationIdAt(i)
+                self.subscriptions[subscription_list.topicStringAt(i)] = correlation_id
+                self._events.append(FakeEvent(Event.SUBSCRIPTION_STATUS, [
+                    FakeMessage({}, correlation_id, 'SubscriptionStarted')]))
+            self._condition.notify_all()
+
+    def unsubscribe(self, subscription_list):
+        with self._condition:
+            for i in range(subscription_list.size()):
+                self.subscriptions.pop(subscription_list.topicStringAt(i), None)
+
+    def replay(self, ticks):
+        """
+        Queue a SUBSCRIPTION_DATA event for each (security or topic, field
+        values) of ticks, skipping those that are not subscribed
+        """
+        with self._condition:
+            for symbol, values in ticks:
+                for topic, correlation_id in self.subscriptions.items():
+                    if topic == symbol or topic.endswith('/' + symbol):
+                        self._events.append(FakeEvent(Event.SUBSCRIPTION_DATA, [
+                            FakeMessage(OrderedDict(values), correlation_id, 'MarketDataEvents')]))
+            self._condition.notify_all()
+
+    def sendRequest(self, request, identity=None, correlationId=None, eventQueue=None, requestLabel=''):
+        if correlationId is None:
+            correlationId = CorrelationId(next(self._correlation_ids))
+        req_object = parse_message(request)
+        self.sent_requests.append(req_object)
+        (request_type, _), = req_object.items()
+        messages = deque(
+            FakeMessage(payload, correlationId, response_type(request_type))
+            for payload in self.responder(req_object))
+        if not messages:
+            raise ValueError('Responder returned no messages for request: ' + str(req_object))
+        with self._condition:
+            self._outstanding.append((time.monotonic() + self.latency, messages))
+            self.max_outstanding = max(self.max_outstanding, len(self._outstanding))
+            self._condition.notify_all()
+        return correlationId
+
+    def cancel(self, correlation_ids):
+        keys = {x.value() for x in (correlation_ids if isinstance(correlation_ids, list) else [correlation_ids])}
+        with self._condition:
+            self.cancelled.extend(sorted(keys))
+            self._outstanding = deque(x for x in self._outstanding if x[1][0].correlationIds()[0].value() not in keys)
+
+    def nextEvent(self, timeout=0):
+        deadline = time.monotonic() + timeout / 1000.0
+        with self._condition:
+            while True:
+                ev = self._next_event()
+                if ev is not None:
+                    return ev
+                now = time.monotonic()
+                if now >= deadline:
+                    return FakeEvent(Event.TIMEOUT)
+                ready_at = min((x for x, _ in self._outstanding), default=deadline)
+                self._condition.wait(min(deadline, ready_at) - now)
+
+    def tryNextEvent(self):
+        with self._condition:
+            return self._next_event()
+
+    def _next_event(self):
+        if self._events:
+            return self._events.popleft()
+        now = time.monotonic()
+        for _ in range(len(self._outstanding)):
+            ready_at, messages = self._outstanding.popleft()
+            if ready_at > now:
+                self._outstanding.append((ready_at, messages))
+                continue
+            msg = messages.popleft()
+            if messages:
+                self._outstanding.append((now + self.message_latency, messages))
+                return FakeEvent(Event.PARTIAL_RESPONSE, [msg])
+            return FakeEvent(Event.RESPONSE, [msg])
+        return None
+
+
+def responses_by_security(responses):
+    """
+    Simple responder, taking a dict of security -> list of parsed messages and
+    answering each request with the messages of its securities, in order
+    """
+    def responder(req_object):
+        (_, body), = req_object.items()
+        securities = body.get('securities') or [body.get('security')]
+        return [msg for security in securities for msg in responses[security]]
+    return responder
+
+
+def security_items(messages):
+    """ The securityData of recorded messages, which are lists of them for reference data """
+    for msg in messages:
+        for item in msg if isinstance(msg, list) else [msg]:
+            if 'securityData' in item:
+                yield item['securityData']
+
+
+def scale_messages(messages, securities=1, rows=1):
+    """
+    Synthetic messages made from recorded ones: the securities copied
+    securities times (the copies named '<security> <i>'), with the rows of
+    historical data repeated rows times
+    """
+    scaled = []
+    for i in range(securities):
+        for msg in messages:
+            items = []
+            for item in msg if isinstance(msg, list) else [msg]:
+                security_data = item.get('securityData')
+                if security_data is None:
+                    items.append(item)
+                    continue
+                security_data = OrderedDict(security_data)
+                if i:
+                    security_data['security'] = '{} {}'.format(security_data['security'], i)
+                if isinstance(security_data.get('fieldData'), list):
+                    security_data['fieldData'] = security_data['fieldData'] * rows
+                items.append({'securityData': security_data})
+            scaled.append(items if isinstance(msg, list) else items[0])
+    return scaled
+
+
+def _historical_response(security_data, body, chunk_size):
+    fields = set(body['fields'])
+    start = to_timestamp(body.get('startDate', '19000101'))
+    end = to_timestamp(body['endDate']) if body.get('endDate') else None
+    rows = []
+    for x in security_data.get('fieldData', []):
+        row = x['fieldData']
+        date = to_timestamp(row['date'])
+        if date >= start and (end is None or date <= end):
+            rows.append({'fieldData': OrderedDict((k, v) for k, v in row.items() if k == 'date' or k in fields)})
+
+    messages = []
+    for i in range(0, max(len(rows), 1), chunk_size or max(len(rows), 1)):
+        chunk = OrderedDict(security_data)
+        chunk['fieldData'] = rows[i:i + chunk_size] if chunk_size else rows
+        messages.append({'securityData': chunk})
+    return messages
+
+
+def _reference_item(security_data, body):
+    fields = set(body['fields'])
+    security_data = OrderedDict(security_data)
+    field_data = security_data.get('fieldData', {}).get('fieldData', {})
+    security_data['fieldData'] = {'fieldData': OrderedDict((k, v) for k, v in field_data.items() if k in fields)}
+    return {'securityData': security_data}
+
+
+def recorded_responder(messages, chunk_size=None):
+    """
+    Responder playing back recorded results (the result of a
+    BloombergRequestResult, e.g. a tests/data fixture, possibly scaled up
+    with scale_messages) to historical and reference data requests, with
+    the securities, fields and dates requested. Securities that were not
+    recorded get a securityError.
+
+    chunk_size splits the response into messages of at most chunk_size rows
+    of historical data or securities of reference data, each coming as its
+    own PARTIAL_RESPONSE event.
+    """
+    recorded = OrderedDict((x['security'], x) for x in security_items(messages))
+
+    def security_error(security, i):
+        return OrderedDict([
+            ('security', security),
+            ('eidData', []),
+            ('securityError', {'securityError': OrderedDict([
+                ('source', 'fake'), ('code', 15), ('category', 'BAD_SEC'),
+                ('message', 'Unknown/Invalid security [nid:fake]'), ('subcategory', 'INVALID_SECURITY')])}),
+            ('sequenceNumber', i),
+            ('fieldExceptions', []),
+            ('fieldData', [])])
+
+    def responder(req_object):
+        (request_type, body), = req_object.items()
+        securities = list(body['securities'])
+        if request_type == 'HistoricalDataRequest':
+            response = []
+            for i, security in enumerate(securities):
+                if security in recorded:
+                    response.extend(_historical_response(recorded[security], body, chunk_size))
+                else:
+                    response.append({'securityData': security_error(security, i)})
+            return response
+        if request_type == 'ReferenceDataRequest':
+            items = []
+            for i, security in enumerate(securities):
+                if security in recorded:
+                    items.append(_reference_item(recorded[security], body))
+                else:
+                    error = security_error(security, i)
+                    error['fieldData'] = {'fieldData': OrderedDict()}
+                    items.append({'securityData': error})
+            size = chunk_size or len(items)
+            return [items[i:i + size] for i in range(0, len(items), size)]
+        raise ValueError('Recorded responses only answer historical and reference data requests, not: ' + request_type)
+    return responder
@@ -0,0 +1,215 @@
+"""
+Local index of the instruments found by //blp/instruments lookups, so that
+repeated and overlapping ticker resolutions are answered from memory
+"""
+import bisect
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from os import path
+
+import pandas as pd
+
+from bbgbridge.api import DEFAULT_MAX_IN_FLIGHT
+from bbgbridge.cache import DAY
+from bbgbridge.util import as_list, dedupe
+
+# The yellowKeyFilter values, by the yellow key that ends the securities they keep
+YELLOW_KEY_FILTERS = {
+    'YK_FILTER_CMDT': 'cmdty',
+    'YK_FILTER_EQTY': 'equity',
+    'YK_FILTER_MUNI': 'muni',
+    'YK_FILTER_PRFD': 'pfd',
+    'YK_FILTER_CLNT': 'client',
+    'YK_FILTER_MMKT': 'm-mkt',
+    'YK_FILTER_GOVT': 'govt',
+    'YK_FILTER_CORP': 'corp',
+    'YK_FILTER_INDX': 'index',
+    'YK_FILTER_CURR': 'curncy',
+    'YK_FILTER_MTGE': 'mtge',
+}
+
+
+def yellow_key(security):
+    """ 'IBM US<equity>' -> 'equity' """
+    start = security.rfind('<')
+    return security[start + 1:-1].lower() if start >= 0 and security.endswith('>') else None
+
+
+def instrument_results(bbg_result):
+    """ The (security, description) pairs of an instrument list result """
+    for msg in bbg_result.result:
+        for x in msg.get('InstrumentListResponse', {}).get('results', []):
+            yield x['results']['security'], x['results'].get('description')
+
+
+class _Lookup(object):
+    """ The securities an instrument list query returned, and whether that was all of them """
+
+    __slots__ = ('fetched', 'securities', 'complete')
+
+    def __init__(self, fetched, securities, complete):
+        self.fetched = fetched
+        self.securities = securities
+        self.complete = complete
+
+
+class InstrumentIndex(object):
+    """
+    The instruments returned by the instrument list lookups made through it,
+    kept sorted by security for prefix search in memory.
+
+    resolve() answers a query locally if the same query (with the same or
+    no yellow key filter) was looked up within ttl seconds, or if a lookup
+    of a prefix of it returned fewer than max_results instruments, which
+    were then all of them. The other queries are looked up together,
+    max_in_flight at once. refresh() repeats the lookups that are older than
+    ttl. With index_file, the index is kept on disk between runs.
+
+    Local search matches on the start of the security, while Bloomberg
+    also matches descriptions, so queries answered from a prefix lookup
+    can miss instruments found only by their description.
+    """
+
+    def __init__(self, bridge, *, max_results=1000, ttl=DAY, max_in_flight=DEFAULT_MAX_IN_FLIGHT, index_file=None):
+        self.bridge = bridge
+        self.max_results = max_results
+        self.ttl = ttl
+        self.max_in_flight = max_in_flight
+        self.index_file = None if index_file is None else path.expanduser(index_file)
+        self.lookups_sent = 0
+        self._descriptions = {}
+        self._keys = []
+        self._lookups = {}
+        self._lock = threading.RLock()
+        if self.index_file is not None:
+            self._load()
+
+    def __len__(self):
+        return len(self._descriptions)
+
+    def _load(self):
+        try:
+            with open(self.index_file, 'rb') as f:
+                self._descriptions, lookups = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return
+        self._lookups = {k: _Lookup(*v) for k, v in lookups.items()}
+        self._keys = sorted((security.upper(), security) for security in self._descriptions)
+
+    def _save(self):
+        directory = path.dirname(self.index_file) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            lookups = {k: (x.fetched, x.securities, x.complete) for k, x in self._lookups.items()}
+            pickle.dump((self._descriptions, lookups), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.index_file)
+
+    def add(self, instruments):
+        """ Add (security, description) pairs, e.g. instrument_results of a lookup made elsewhere """
+        with self._lock:
+            new = False
+            for security, description in instruments:
+                new = new or security not in self._descriptions
+                self._descriptions[security] = description
+            if new:
+                self._keys = sorted((security.upper(), security) for security in self._descriptions)
+
+    def search(self, prefix, key_filter=None, limit=None):
+        """ The (security, description) pairs in the index whose security starts with prefix, ignoring case """
+        wanted = YELLOW_KEY_FILTERS.get(key_filter, key_filter and key_filter.lower())
+        prefix = prefix.upper()
+        found = []
+        with self._lock:
+            for i in range(bisect.bisect_left(self._keys, (prefix,)), len(self._keys)):
+                key, security = self._keys[i]
+                if not key.startswith(prefix):
+                    break
+                if wanted is None or yellow_key(security) == wanted:
+                    found.append((security, self._descriptions[security]))
+                    if limit is not None and len(found) >= limit:
+                        break
+        return found
+
+    def _local(self, query, key_filter, now):
+        """ The answer to query from the index, or None if it has to be looked up """
+        query_key = query.upper()
+        lookup = self._lookups.get((query_key, key_filter))
+        if lookup is not None and now - lookup.fetched < self.ttl:
+            return [(x, self._descriptions[x]) for x in lookup.securities]
+
+        for i in range(len(query_key), 0, -1):
+            for lookup_filter in dedupe([key_filter, None]):
+                lookup = self._lookups.get((query_key[:i], lookup_filter))
+                if lookup is not None and lookup.complete and now - lookup.fetched < self.ttl:
+                    return self.search(query, key_filter)
+        return None
+
+    def resolve(self, queries, key_filter=None, limit=None):
+        """
+        The (security, description) pairs found for each query, as a dict
+        by query, at most limit of them each. Queries that cannot be
+        answered from the index are looked up.
+        """
+        queries = list(dedupe(as_list(queries)))
+        now = time.time()
+        with self._lock:
+            found = OrderedDict((query, self._local(query, key_filter, now)) for query in queries)
+        misses = [query for query, x in found.items() if x is None]
+        if misses:
+            found.update(self._fetch(misses, key_filter))
+        return OrderedDict((query, x[:limit]) for query, x in found.items())
+
+    def lookup(self, query, key_filter=None, limit=None):
+        """ resolve() for a single query, as a frame like symbol_lookup_dataframe """
+        return pd.DataFrame(self.resolve(query, key_filter, limit)[query], columns=['security', 'description'])
+
+    def _fetch(self, queries, key_filter):
+        requests = []
+        for query in queries:
+            request = self.bridge.instrument_service.createRequest('instrumentListRequest')
+            request.set('query', query)
+            request.set('maxResults', self.max_results)
+            if key_filter:
+                request.set('yellowKeyFilter', key_filter)
+            requests.append(request)
+
+        results = self.bridge.send_requests(requests, max_in_flight=self.max_in_flight)
+        fetched = time.time()
+        found = OrderedDict()
+        with self._lock:
+            self.lookups_sent += len(requests)
+            for query, res in zip(queries, results):
+                instruments = list(instrument_results(res))
+                self.add(instruments)
+                securities = tuple(security for security, _ in instruments)
+                self._lookups[query.upper(), key_filter] = _Lookup(fetched, securities, len(securities) < self.max_results)
+                found[query] = instruments
+            if self.index_file is not None:
+                self._save()
+        return found
+
+    def refresh(self, max_age=None):
+        """ Repeat the lookups made more than max_age (by default ttl) seconds ago, returning how many """
+        max_age = self.ttl if max_age is None else max_age
+        now = time.time()
+        with self._lock:
+            stale = [key for key, x in self._lookups.items() if now - x.fetched >= max_age]
+        by_filter = OrderedDict()
+        for query, key_filter in stale:
+            by_filter.setdefault(key_filter, []).append(query)
+        for key_filter, queries in by_filter.items():
+            self._fetch(queries, key_filter)
+        return len(stale)
+
+    def to_frame(self):
+        with self._lock:
+            return pd.DataFrame([(security, self._descriptions[security]) for _, security in self._keys],
+                                columns=['security', 'description'])
+
+    def __repr__(self):
+        return 'InstrumentIndex({} instruments, {} lookups)'.format(len(self._descriptions), len(self._lookups))
@@ -0,0 +1,149 @@
+"""
+Loading of archives of results written by to_json_file: the files are
+decoded and converted to frames in a process pool, and the frames are
+concatenated with the same dtypes whichever files they come from
+"""
+import glob
+import os
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from os import path
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from bbgbridge.result import BloombergRequestResult
+from bbgbridge.util import is_string
+
+DEFAULT_BATCH_SIZE = 100
+
+
+def json_result_files(source):
+    """ The .json files of a directory, the files matching a glob pattern, or the given list of files, sorted """
+    if not is_string(source):
+        return list(source)
+    source = path.expanduser(source)
+    if path.isdir(source):
+        source = path.join(source, '*.json')
+    return sorted(glob.glob(source))
+
+
+def _load_frame(data_file, converter, projection):
+    """ The frame of one file; runs in the worker processes """
+    try:
+        return BloombergRequestResult.from_json_file(data_file).to_dataframe(converter, **projection)
+    except Exception as e:
+        raise RuntimeError('Could not load {}: {}'.format(data_file, e)) from e
+
+
+def iter_json_frames(source, converter=None, *, processes=None, max_pending=None,
+                     columns=None, symbols=None, start=None, end=None):
+    """
+    Yield the (file, frame) of each file of source (see json_result_files)
+    in order, converted with converter or the converter saved in the file,
+    and projected like to_dataframe(columns=..., symbols=..., start=..., end=...).
+
+    The files are loaded by a pool of processes (by default one per CPU),
+    or in this process if processes is 1. At most max_pending files (by
+    default twice the number of processes) are loaded ahead of the frame
+    being yielded, so memory use does not grow with the number of files.
+    A converter function has to be picklable, i.e. defined at module level.
+    """
+    files = json_result_files(source)
+    projection = dict(columns=columns, symbols=symbols, start=start, end=end)
+    if processes == 1:
+        for data_file in files:
+            yield data_file, _load_frame(data_file, converter, projection)
+        return
+
+    processes = processes or os.cpu_count() or 1
+    max_pending = max_pending or 2 * processes
+    pending = deque()
+    with ProcessPoolExecutor(processes) as executor:
+        try:
+            for data_file in files:
+                pending.append((data_file, executor.submit(_load_frame, data_file, converter, projection)))
+                if len(pending) >= max_pending:
+                    data_file, future = pending.popleft()
+                    yield data_file, future.result()
+            while pending:
+                data_file, future = pending.popleft()
+                yield data_file, future.result()
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+def _missing_column(dtype, length):
+    """ A column of length missing values that keeps dtype where it has a missing value """
+    if isinstance(dtype, pd.CategoricalDtype):
+        return pd.Categorical([np.nan] * length, dtype=dtype)
+    if dtype.kind == 'M':
+        return np.full(length, np.datetime64('NaT'), dtype=dtype)
+    return np.full(length, np.nan)
+
+
+def concat_frames(frames):
+    """
+    pd.concat of frames (with a new index) whose columns have the same dtype
+    in every frame: categorical columns get the union of the categories of
+    all frames, and columns missing from some frames are filled with NaN or
+    NaT without losing their categorical or datetime dtype. Empty frames
+    are left out, since their object columns would turn the others to object.
+    """
+    frames = list(frames)
+    frames = [x for x in frames if len(x)] or frames[:1]
+    if not frames:
+        return pd.DataFrame()
+
+    by_column = OrderedDict()
+    for frame in frames:
+        for name in frame.columns:
+            by_column.setdefault(name, []).append(frame[name])
+
+    dtypes = OrderedDict()
+    for name, series in by_column.items():
+        if any(isinstance(x.dtype, pd.CategoricalDtype) for x in series):
+            categoricals = [x.values if isinstance(x.dtype, pd.CategoricalDtype) else pd.Categorical(x.dropna().unique())
+                            for x in series]
+            dtypes[name] = pd.CategoricalDtype(union_categoricals(categoricals).categories)
+        else:
+            dtypes[name] = series[0].dtype
+
+    aligned = []
+    for frame in frames:
+        frame = frame.copy(deep=False)
+        for name, dtype in dtypes.items():
+            if name not in frame.columns:
+                frame[name] = _missing_column(dtype, len(frame))
+            elif isinstance(dtype, pd.CategoricalDtype) and frame[name].dtype != dtype:
+                frame[name] = frame[name].astype(dtype)
+        aligned.append(frame[list(dtypes)])
+    return pd.concat(aligned, ignore_index=True)
+
+
+def iter_json_batches(source, converter=None, *, batch_size=DEFAULT_BATCH_SIZE, processes=None, max_pending=None,
+                      columns=None, symbols=None, start=None, end=None):
+    """
+    Yield the frames of batch_size files at a time, concatenated with
+    concat_frames, for archives too large to load at once. Categories are
+    unioned within a batch only.
+    """
+    batch = []
+    for _, frame in iter_json_frames(source, converter, processes=processes, max_pending=max_pending,
+                                     columns=columns, symbols=symbols, start=start, end=end):
+        batch.append(frame)
+        if len(batch) >= batch_size:
+            yield concat_frames(batch)
+            batch = []
+    if batch:
+        yield concat_frames(batch)
+
+
+def read_json_results(source, converter=None, *, processes=None, max_pending=None,
+                      columns=None, symbols=None, start=None, end=None):
+    """ The frames of all the files of source as one frame, see iter_json_frames and concat_frames """
+    return concat_frames(frame for _, frame in iter_json_frames(
+        source, converter, processes=processes, max_pending=max_pending,
+        columns=columns, symbols=symbols, start=start, end=end))
@@ -0,0 +1,168 @@
+"""
+Optional instrumentation of requests and frame conversions. Nothing is
+recorded until enable() is called; the bridges and convert_to_frame then
+report to the returned RequestMetrics, which can be read as per request
+records or as a Prometheus text format snapshot.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+
+from blpapi import Event
+
+DEFAULT_MAX_RECORDS = 10000
+
+# The RequestMetrics requests report to, None while disabled
+active = None
+
+
+def enable(max_records=DEFAULT_MAX_RECORDS):
+    """ Start recording, returning the RequestMetrics records go to """
+    global active
+    active = RequestMetrics(max_records)
+    return active
+
+
+def disable():
+    global active
+    active = None
+
+
+def count_values(obj):
+    """ The number of leaf values of parsed messages """
+    if isinstance(obj, dict):
+        return sum(count_values(x) for x in obj.values())
+    if isinstance(obj, list):
+        return sum(count_values(x) for x in obj)
+    return 1
+
+
+def _labels(labels):
+    return ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+
+
+class RequestRecord(object):
+    """ Timings and counts of one request, times in seconds from time.perf_counter """
+
+    __slots__ = ('request_type', 'sent', 'first_message', 'completed', 'partial_responses', 'messages', 'elements',
+                 'parse_time')
+
+    def __init__(self, request_type):
+        self.request_type = request_type
+        self.sent = time.perf_counter()
+        self.first_message = None
+        self.completed = None
+        self.partial_responses = 0
+        self.messages = 0
+        self.elements = 0
+        self.parse_time = 0.0
+
+    def on_message(self, event_type, parse_time, elements=0):
+        if self.first_message is None:
+            self.first_message = time.perf_counter()
+        if event_type == Event.PARTIAL_RESPONSE:
+            self.partial_responses += 1
+        self.messages += 1
+        self.elements += elements
+        self.parse_time += parse_time
+
+    @property
+    def time_to_first_message(self):
+        return None if self.first_message is None else self.first_message - self.sent
+
+    @property
+    def latency(self):
+        return None if self.completed is None else self.completed - self.sent
+
+    def to_dict(self):
+        return OrderedDict([
+            ('request_type', self.request_type),
+            ('time_to_first_message', self.time_to_first_message),
+            ('latency', self.latency),
+            ('partial_responses', self.partial_responses),
+            ('messages', self.messages),
+            ('elements', self.elements),
+            ('parse_time', self.parse_time),
+        ])
+
+
+class _Summary(object):
+    __slots__ = ('count', 'sum')
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+
+
+class RequestMetrics(object):
+    """
+    Totals by request type (and by converter for conversions), plus the
+    last max_records request records
+    """
+
+    def __init__(self, max_records=DEFAULT_MAX_RECORDS):
+        self._records = deque(maxlen=max_records)
+        self._summaries = OrderedDict()
+        self._counters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, req_object):
+        (request_type, _), = req_object.items()
+        return RequestRecord(request_type)
+
+    def finish(self, record, frame=None):
+        """ Record a request whose messages have all arrived, with the frame they were streamed into if any """
+        record.completed = time.perf_counter()
+        if frame is not None:
+            record.elements += frame.size
+        labels = (('request_type', record.request_type),)
+        with self._lock:
+            self._records.append(record)
+            self._observe('bbgbridge_request_latency_seconds', labels, record.latency)
+            if record.first_message is not None:
+                self._observe('bbgbridge_request_first_message_seconds', labels, record.time_to_first_message)
+            self._observe('bbgbridge_request_parse_seconds', labels, record.parse_time)
+            self._count('bbgbridge_partial_responses_total', labels, record.partial_responses)
+            self._count('bbgbridge_messages_total', labels, record.messages)
+            self._count('bbgbridge_elements_total', labels, record.elements)
+
+    def record_conversion(self, request_type, converter, seconds, rows):
+        labels = (('request_type', request_type), ('converter', converter))
+        with self._lock:
+            self._observe('bbgbridge_conversion_seconds', labels, seconds)
+            self._count('bbgbridge_conversion_rows_total', labels, rows)
+
+    def _observe(self, name, labels, value):
+        self._summaries.setdefault((name, labels), _Summary()).observe(value)
+
+    def _count(self, name, labels, value):
+        self._counters[name, labels] = self._counters.get((name, labels), 0) + value
+
+    def records(self):
+        """ The recorded requests as dicts, oldest first """
+        with self._lock:
+            return [x.to_dict() for x in self._records]
+
+    def snapshot(self):
+        """ The totals in the Prometheus text exposition format """
+        lines = []
+        with self._lock:
+            summaries = sorted(self._summaries.items(), key=lambda x: x[0][0])
+            counters = sorted(self._counters.items(), key=lambda x: x[0][0])
+            for (name, labels), summary in summaries:
+                if not lines or not lines[-1].startswith(name + '_'):
+                    lines.append('# TYPE {} summary'.format(name))
+                lines.append('{}_count{{{}}} {}'.format(name, _labels(labels), summary.count))
+                lines.append('{}_sum{{{}}} {!r}'.format(name, _labels(labels), summary.sum))
+            for (name, labels), value in counters:
+                if not lines or not lines[-1].startswith(name + '{'):
+                    lines.append('# TYPE {} counter'.format(name))
+                lines.append('{}{{{}}} {}'.format(name, _labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+    def __repr__(self):
+        return 'RequestMetrics({} records)'.format(len(self._records))
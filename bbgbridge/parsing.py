@@ -76,3 +76,120 @@ def try_convert_datetime(value):
         return to_timestamp(value)
     else:
         return value
+
+
+# How a plan decodes its elements
+_SEQUENCE, _CHOICE, _ENUMERATION, _VALUE, _DATETIME, _ARRAY, _DATETIME_ARRAY, _CONTAINER_ARRAY, _UNSUPPORTED_ARRAY = range(9)
+
+
+class _ElementPlan(object):
+    """
+    How to decode the elements at one place of a schema, resolved once from
+    the first element seen there: their name, how to decode them, and the
+    plans of their children by name (of a choice, by plan_key, since the
+    same choice may hold a single element or an array of them).
+
+    A null element or an empty array does not show what the elements with
+    values at the same place hold, so a plan made from one is not settled,
+    and is replaced by a plan made from the first element with values.
+    """
+    __slots__ = ('name', 'kind', 'settled', 'children', 'item')
+
+    def __init__(self, element, convert_datetime):
+        self.name = str(element.elementDefinition().name())
+        data_type = element.datatype()
+        dates = convert_datetime and data_type in (DataType.DATE, DataType.DATETIME)
+        if element.isArray():
+            self.settled = element.numValues() > 0
+            if data_type in bb_plain_types:
+                self.kind = _DATETIME_ARRAY if dates else _ARRAY
+            elif data_type in bb_container_types:
+                self.kind = _CONTAINER_ARRAY
+            else:
+                self.kind = _UNSUPPORTED_ARRAY
+        else:
+            self.settled = not element.isNull()
+            if data_type == DataType.SEQUENCE:
+                self.kind = _SEQUENCE
+            elif data_type == DataType.CHOICE:
+                self.kind = _CHOICE
+            elif data_type == DataType.ENUMERATION:
+                self.kind = _ENUMERATION
+            else:
+                self.kind = _DATETIME if dates else _VALUE
+        self.children = {}
+        self.item = None
+
+
+def plan_key(element):
+    return element.name(), element.isArray(), element.datatype()
+
+
+class CompiledParser(object):
+    """
+    Produces the same output as parse_message, but caches a decoding plan per
+    schema definition, so the names, types and datetime conversions of
+    repeated messages of the same type are only looked up once. Past the
+    message and its choice, the only lookup left per element is its name,
+    since the field data of a reference data response holds a different set
+    of fields for every security.
+
+    With convert_datetime off, date and datetime values are left as they are,
+    for the frame converters to convert whole columns at once.
+    """
+
+    def __init__(self, convert_datetime=True):
+        self.convert_datetime = convert_datetime
+        self._plans = {}
+
+    def parse_message(self, msg):
+        element = msg.asElement()
+        key = (element.elementDefinition().name(), element.isArray(), element.datatype())
+        return self._decode(self._plan(self._plans, key, element), element)
+
+    def _plan(self, plans, key, element):
+        plan = plans.get(key)
+        if plan is None or not plan.settled and element.numValues():
+            plan = plans[key] = _ElementPlan(element, self.convert_datetime)
+        return plan
+
+    def _decode(self, plan, element):
+        kind = plan.kind
+        if kind == _SEQUENCE:
+            plans = plan.children
+            children = OrderedDict()
+            for child in element.elements():
+                child_plan = self._plan(plans, child.name(), child)
+                children[child_plan.name] = self._decode(child_plan, child)
+            return {plan.name: children}
+        elif kind == _VALUE:
+            return None if element.isNull() else element.getValue()
+        elif kind == _DATETIME:
+            return None if element.isNull() else try_convert_datetime(element.getValue())
+        elif kind == _ARRAY:
+            return list(element.values())
+        elif kind == _DATETIME_ARRAY:
+            return [try_convert_datetime(x) for x in element.values()]
+        elif kind == _CONTAINER_ARRAY:
+            result = []
+            for x in element.values():
+                item = plan.item
+                if item is None or not item.settled and x.numValues():
+                    item = plan.item = _ElementPlan(x, self.convert_datetime)
+                result.append(self._decode(item, x))
+            return result
+        elif kind == _CHOICE:
+            choice = element.getChoice()
+            return self._decode(self._plan(plan.children, plan_key(choice), choice), choice)
+        elif kind == _ENUMERATION:
+            return str(element.getValue())
+        else:
+            return parse_array(element)  # Unsupported, fail the same way
+
+
+def native_element_value(element):
+    return None if element.isNull() else element.getValue()
+
+
+compiled_parser = CompiledParser()
+native_parser = CompiledParser(convert_datetime=False)
@@ -0,0 +1,303 @@
+"""
+Splitting of large requests into smaller chunks, and merging of the results
+of those chunks back into the shape the unchunked request would have had
+"""
+import json
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from bbgbridge.converters import refdata_to_frame
+from bbgbridge.result import BloombergRequestResult
+from bbgbridge.util import CustomJSONEncoder, as_list, dedupe, merge_dicts, to_timestamp
+
+
+def chunked(items, size=None):
+    items = list(items)
+    if not size:
+        return [items]
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def split_date_range(start_date, end_date, days=None):
+    """
+    Split the inclusive range [start_date, end_date] into consecutive
+    inclusive ranges spanning at most `days` calendar days each
+    """
+    if not days:
+        return [(start_date, end_date)]
+
+    start, end = to_timestamp(start_date).normalize(), to_timestamp(end_date).normalize()
+    ranges = []
+    while start <= end:
+        window_end = min(start + pd.Timedelta(days=days - 1), end)
+        ranges.append((start, window_end))
+        start = window_end + pd.Timedelta(days=1)
+    return ranges
+
+
+def split_time_range(start, end, window):
+    """
+    Split [start, end] into consecutive windows of at most `window` (a
+    Timedelta or something Timedelta accepts), each starting where the
+    previous one ends
+    """
+    start, end, window = to_timestamp(start), to_timestamp(end), pd.Timedelta(window)
+    if window <= pd.Timedelta(0):
+        raise ValueError('window must be positive, but was: {}'.format(window))
+
+    ranges = []
+    while start < end:
+        window_end = min(start + window, end)
+        ranges.append((start, window_end))
+        start = window_end
+    return ranges or [(start, end)]
+
+
+class ChunkPlan(object):
+    """
+    How to split requests: at most symbols_per_request securities and
+    fields_per_request fields in one request, and for daily historical data
+    at most days_per_request days. None means no limit. max_in_flight caps
+    how many of the chunks are outstanding at once.
+    """
+
+    def __init__(self, symbols_per_request=None, fields_per_request=None, days_per_request=None, max_in_flight=None):
+        self.symbols_per_request = symbols_per_request
+        self.fields_per_request = fields_per_request
+        self.days_per_request = days_per_request
+        self.max_in_flight = max_in_flight
+
+    def reference_chunks(self, symbols, fields):
+        return [(symbol_chunk, field_chunk)
+                for symbol_chunk in chunked(dedupe(as_list(symbols)), self.symbols_per_request)
+                for field_chunk in chunked(dedupe(as_list(fields)), self.fields_per_request)]
+
+    def historical_chunks(self, symbols, fields, start_date, end_date, periodicity_selection='DAILY'):
+        if self.days_per_request and periodicity_selection != 'DAILY':
+            raise ValueError('Date ranges can only be split for DAILY periodicity, but was: {}'.format(periodicity_selection))
+
+        return [(symbol_chunk, field_chunk, start, end)
+                for symbol_chunk, field_chunk in self.reference_chunks(symbols, fields)
+                for start, end in split_date_range(start_date, end_date, self.days_per_request)]
+
+    def __repr__(self):
+        return 'ChunkPlan(symbols_per_request={}, fields_per_request={}, days_per_request={}, max_in_flight={})'.format(
+            self.symbols_per_request, self.fields_per_request, self.days_per_request, self.max_in_flight)
+
+
+NO_CHUNKING = ChunkPlan()
+
+
+def overrides_key(overrides):
+    """ The same string for equal overrides dicts, whatever their order """
+    return json.dumps(sorted((overrides or {}).items()), cls=CustomJSONEncoder)
+
+
+def _merged_request(results, **replacements):
+    (request_type, body), = results[0].request.items()
+    return OrderedDict([(request_type, OrderedDict(body, **replacements))])
+
+
+def _all_values(results, key):
+    values = (body.get(key) for res in results for body in res.request.values())
+    return list(dedupe(x for v in values if v is not None for x in as_list(v)))
+
+
+def _ordered_fields(row, fields):
+    ordered = OrderedDict((k, row[k]) for k in ['date'] + fields if k in row)
+    ordered.update(row)
+    return ordered
+
+
+def _merge_security_data(merged, security_data):
+    """ Merge security_data into merged, except for the field data itself """
+    security = security_data['security']
+    target = merged.get(security)
+    if target is None:
+        target = merged[security] = OrderedDict(security_data)
+        target['fieldExceptions'] = list(security_data.get('fieldExceptions', []))
+    else:
+        target['fieldExceptions'] += security_data.get('fieldExceptions', [])
+        if security_data.get('securityError') and not target.get('securityError'):
+            target['securityError'] = security_data['securityError']
+    return target
+
+
+def _by_symbol_order(merged, symbols):
+    position = {s: i for i, s in enumerate(symbols)}
+    ordered = sorted(merged.values(), key=lambda x: position.get(x['security'], len(position)))
+    for i, security_data in enumerate(ordered):
+        security_data['sequenceNumber'] = i
+    return ordered
+
+
+def merge_historical_results(results, meta=None):
+    """
+    Merge the results of chunked HistoricalDataRequests: one message per
+    security, with the rows of all chunks joined on date
+    """
+    symbols, fields = _all_values(results, 'securities'), _all_values(results, 'fields')
+    request = _merged_request(results,
+                              securities=symbols,
+                              fields=fields,
+                              startDate=min(_all_values(results, 'startDate')),
+                              endDate=max(_all_values(results, 'endDate')))
+
+    merged, rows, other_messages = OrderedDict(), {}, []
+    for msg in (msg for res in results for msg in res.result):
+        security_data = msg.get('securityData')
+        if security_data is None:
+            other_messages.append(msg)
+            continue
+
+        target = _merge_security_data(merged, security_data)
+        security_rows = rows.setdefault(target['security'], OrderedDict())
+        for x in security_data.get('fieldData', []):
+            security_rows.setdefault(x['fieldData'].get('date'), OrderedDict()).update(x['fieldData'])
+
+    for security, security_data in merged.items():
+        security_data['fieldData'] = [{'fieldData': _ordered_fields(row, fields)}
+                                      for _, row in sorted(rows[security].items(), key=lambda x: x[0])]
+
+    ret_object = [{'securityData': x} for x in _by_symbol_order(merged, symbols)] + other_messages
+    return BloombergRequestResult(ret_object, request, meta=meta)
+
+
+def merge_reference_results(results, meta=None):
+    """
+    Merge the results of chunked ReferenceDataRequests into a single
+    message, with the fields of all chunks joined per security
+    """
+    symbols, fields = _all_values(results, 'securities'), _all_values(results, 'fields')
+    request = _merged_request(results, securities=symbols, fields=fields)
+
+    merged, field_data = OrderedDict(), {}
+    for y in (y for res in results for z in res.result for y in z):
+        security_data = y['securityData']
+        target = _merge_security_data(merged, security_data)
+        field_data.setdefault(target['security'], OrderedDict()).update(
+            security_data.get('fieldData', {}).get('fieldData', {}))
+
+    for security, security_data in merged.items():
+        security_data['fieldData'] = {'fieldData': _ordered_fields(field_data[security], fields)}
+
+    ret_object = [[{'securityData': x} for x in _by_symbol_order(merged, symbols)]]
+    return BloombergRequestResult(ret_object, request, meta=meta)
+
+
+def merge_historical_frames(results, meta=None):
+    """
+    Merge the results of chunked, streamed HistoricalDataRequests: the
+    messages as merge_historical_results does, and the frames joined on
+    symbol and date
+    """
+    merged = merge_historical_results(results, meta=meta)
+    frame = pd.concat([res.frame for res in results], ignore_index=True, sort=False)
+    if frame.empty:
+        merged.frame = frame
+        return merged
+
+    symbols, fields = _all_values(results, 'securities'), _all_values(results, 'fields')
+    frame_symbols = frame['symbol'].astype(object)
+    frame['symbol'] = pd.Categorical(frame_symbols, categories=list(dedupe(symbols + list(frame_symbols.unique()))))
+    frame = frame.groupby(['symbol', 'date'], sort=True, observed=True).first().reset_index()
+    data_columns = [c for c in fields if c in frame.columns] + [c for c in frame.columns if c not in fields and c not in ('date', 'symbol')]
+    merged.frame = frame[_row_dict_order(frame, data_columns)]
+    return merged
+
+
+def _row_dict_order(frame, data_columns):
+    """
+    The columns of a merged historical frame in the order the unchunked
+    ColumnarFrameBuilder gives them: date and the fields with a value in
+    the first row, then symbol, then the other fields by the first row
+    that has a value for them
+    """
+    present = frame[data_columns].notna().to_numpy()
+    first_row = np.where(present.any(axis=0), present.argmax(axis=0), len(frame))
+    columns = ['date'] + [data_columns[i] for i in sorted(range(len(data_columns)), key=lambda i: (first_row[i], i))]
+    columns.insert(1 + int(present[0].sum()), 'symbol')
+    return columns
+
+
+def merge_intraday_bar_results(results, meta=None):
+    """
+    Merge the results of IntradayBarRequests for different securities into
+    one, with each barData tagged with its security, and the frames of
+    streamed requests concatenated
+    """
+    request = _merged_request(results, securities=_all_values(results, 'security'))
+    del request['IntradayBarRequest']['security']
+
+    ret_object = []
+    for res in results:
+        symbol = res.request['IntradayBarRequest']['security']
+        for msg in res.result:
+            if 'barData' in msg:
+                msg = {'barData': OrderedDict(msg['barData'], security=symbol)}
+            ret_object.append(msg)
+
+    frame = None
+    frames = [res.frame for res in results if res.frame is not None]
+    if frames:
+        frame = pd.concat(frames, ignore_index=True, sort=False)
+        if 'symbol' in frame:
+            frame['symbol'] = pd.Categorical(frame['symbol'].astype(object), categories=request['IntradayBarRequest']['securities'])
+    return BloombergRequestResult(ret_object, request, meta=meta, frame=frame)
+
+
+def subset_reference_result(result, symbols, fields, meta=None):
+    """
+    The part of the result of a ReferenceDataRequest about the given
+    securities and fields, as if they were the ones requested
+    """
+    symbols, fields = list(symbols), list(fields)
+    request = _merged_request([result], securities=symbols, fields=fields)
+    position, wanted_fields = {s: i for i, s in enumerate(symbols)}, set(fields)
+
+    ret_object = []
+    for msg in result.result:
+        if isinstance(msg, dict):  # e.g. responseError
+            ret_object.append(msg)
+            continue
+
+        subset = []
+        for y in msg:
+            security_data = y['securityData']
+            if security_data['security'] not in position:
+                continue
+            security_data = OrderedDict(security_data)
+            security_data['fieldExceptions'] = [x for x in security_data.get('fieldExceptions', [])
+                                                if x['fieldExceptions'].get('fieldId') in wanted_fields]
+            field_data = security_data.get('fieldData', {}).get('fieldData', {})
+            security_data['fieldData'] = {'fieldData': _ordered_fields(
+                OrderedDict((k, v) for k, v in field_data.items() if k in wanted_fields), fields)}
+            subset.append(security_data)
+        ret_object.append([{'securityData': x} for x in sorted(subset, key=lambda x: position[x['security']])])
+    return BloombergRequestResult(ret_object, request, meta=meta)
+
+
+def merge_sweep_results(override_sets, results, meta=None):
+    """
+    Merge the results of an override sweep, the chunks of each of the
+    override_sets in turn, into one whose frame has the reference data of
+    every override set, indexed by the override values and symbol. The
+    merged request lists the overrideSets with the number of messages of
+    each, so the refdata converter can tell them apart.
+    """
+    per_set = len(results) // len(override_sets)
+    ret_object, sets = [], []
+    for i, overrides in enumerate(override_sets):
+        merged = merge_reference_results(results[i * per_set:(i + 1) * per_set])
+        ret_object.extend(merged.result)
+        sets.append(OrderedDict([('overrides', overrides), ('messages', len(merged.result))]))
+
+    request = _merged_request(results, securities=_all_values(results, 'securities'), fields=_all_values(results, 'fields'),
+                              overrides=[], overrideSets=sets)
+    merged = BloombergRequestResult(ret_object, request, meta=merge_dicts(meta or {}, {'override_sets': override_sets}),
+                                    converter='refdata')
+    merged.frame = refdata_to_frame(merged)
+    return merged
+
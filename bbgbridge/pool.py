@@ -0,0 +1,164 @@
+"""
+Pool of started sessions, shared by the whole process, that replaces
+sessions which went down and retries the requests that were sent on them
+"""
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from blpapi import Session
+
+from bbgbridge.api import BloombergBridge, SessionTerminatedError
+
+DEFAULT_POOL_SIZE = 4
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+class SessionPool(object):
+    """
+    Keeps size bridges with started sessions, which are opened up front
+    unless prestart is False. Services are opened the first time a bridge
+    uses them.
+
+    A bridge is checked for health when it is acquired, and replaced by one
+    with a new session if it went down. The request methods (bdh, bdp, bds,
+    bdib, ...) run on a bridge of the pool; all of them are read only, so
+    when the session goes down during the request they are retried up to
+    retries times on a new session.
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, session_factory=Session, *, retries=1, prestart=True, **bridge_options):
+        if size < 1:
+            raise ValueError('size must be at least 1, but was: {}'.format(size))
+        self.size = size
+        self.session_factory = session_factory
+        self.retries = retries
+        self.bridge_options = bridge_options
+        self.reconnects = 0
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+        if prestart:
+            while self._reserve():
+                self._idle.put(self._create())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def _reserve(self):
+        """ Count a bridge about to be created, unless the pool is full """
+        with self._lock:
+            if self._created >= self.size:
+                return False
+            self._created += 1
+            return True
+
+    def _create(self):
+        """ A new bridge, for a place reserved by _reserve """
+        try:
+            return BloombergBridge(self.session_factory(), **self.bridge_options)
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _discard(self, bridge):
+        with self._lock:
+            self._created -= 1
+        try:
+            bridge.stop()
+        except Exception:
+            pass  # Already down
+
+    def acquire(self, timeout=None):
+        """
+        A healthy bridge of the pool, waiting up to timeout seconds for one
+        if all are in use, after which TimeoutError is raised
+        """
+        if self._closed:
+            raise RuntimeError('Session pool is closed')
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                bridge = self._idle.get_nowait()
+            except queue.Empty:
+                if self._reserve():
+                    bridge = self._create()
+                else:
+                    try:
+                        bridge = self._idle.get(timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        raise TimeoutError('All {} bridges of the pool stayed in use for {} seconds'.format(
+                            self.size, timeout)) from None
+
+            if bridge.is_healthy():
+                return bridge
+            self._discard(bridge)
+            self.reconnects += 1
+
+    def release(self, bridge):
+        if not bridge.alive:
+            self.reconnects += 1
+        if self._closed or not bridge.alive:
+            self._discard(bridge)
+        else:
+            self._idle.put(bridge)
+
+    @contextmanager
+    def bridge(self, timeout=None):
+        bridge = self.acquire(timeout)
+        try:
+            yield bridge
+        finally:
+            self.release(bridge)
+
+    def call(self, method, *args, **kwargs):
+        """ bridge.method(*args, **kwargs) on a bridge of the pool, retried on a new session if it goes down """
+        for attempt in range(self.retries + 1):
+            with self.bridge() as bridge:
+                try:
+                    return getattr(bridge, method)(*args, **kwargs)
+                except SessionTerminatedError:
+                    if attempt == self.retries:
+                        raise
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+    def __repr__(self):
+        return 'SessionPool(size={}, idle={}, reconnects={})'.format(self.size, self._idle.qsize(), self.reconnects)
+
+
+def _pooled(method):
+    def call(self, *args, **kwargs):
+        return self.call(method, *args, **kwargs)
+    call.__name__ = method
+    call.__doc__ = getattr(BloombergBridge, method).__doc__
+    return call
+
+
+for _method in ('request_historical_data', 'request_intraday_bar', 'request_reference_data', 'request_reference_sweep',
+                'request_bulk_data', 'request_instrument_list', 'bdh', 'bdp', 'bds', 'bdib'):
+    setattr(SessionPool, _method, _pooled(_method))
+
+
+def get_session_pool(size=DEFAULT_POOL_SIZE, session_factory=Session, **pool_options):
+    """ The process wide session pool, created with these arguments the first time it is asked for """
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None or _default_pool._closed:
+            _default_pool = SessionPool(size, session_factory, **pool_options)
+        return _default_pool
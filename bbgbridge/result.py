@@ -2,18 +2,21 @@ import json
 from collections import OrderedDict
 from os import path
 
-from bbgbridge.converters import convert_to_frame
-from bbgbridge.util import CustomJSONEncoder
+from bbgbridge.archive import read_frame, write_frame
+from bbgbridge.converters import Projection, convert_to_frame
+from bbgbridge.util import CustomJSONEncoder, is_string, read_json_file
 
 
 class BloombergRequestResult(object):
-    def __init__(self, result, request, meta=None, converter=None):
+    def __init__(self, result, request, meta=None, converter=None, frame=None):
         if meta is None:
             meta = {}
         self.result = result
         self.request = request
         self.meta = meta
         self.converter = converter
+        self.frame = frame
+        self._frames = {}
 
     @classmethod
     def from_dict(cls, data):
@@ -21,21 +24,81 @@ class BloombergRequestResult(object):
 
     @classmethod
     def from_json_file(cls, data_file):
-        with open(data_file) as f:
-            return cls.from_dict(json.load(f))
+        return cls.from_dict(read_json_file(data_file))
+
+    @classmethod
+    def from_binary_file(cls, data_file):
+        """
+        Read a result written by to_binary_file. It has the frame (memory
+        mapped) but no parsed messages.
+        """
+        header, frame = read_frame(data_file)
+        return cls([], header.get('request'), header.get('meta'), header.get('converter'), frame=frame)
 
     def with_df_converter(self, converter):
-        return BloombergRequestResult(self.result, self.request, self.meta, converter=converter)
+        return BloombergRequestResult(self.result, self.request, self.meta, converter=converter, frame=self.frame)
 
     def to_json(self, indent=2, separators=(',', ': '), **kwargs):
         return json.dumps(self.to_dict(), cls=CustomJSONEncoder, indent=indent, separators=separators, **kwargs)
 
-    def to_json_file(self, outfile, indent=2, separators=(',', ': '), **kwargs):
+    def to_json_file(self, outfile, indent=2, separators=(',', ': '), *, compact=False, **kwargs):
+        """ With compact, the file is written by write_json instead, without indentation """
         with open(path.expanduser(outfile), 'w') as fp:
-            json.dump(self.to_dict(), fp, cls=CustomJSONEncoder, indent=indent, separators=separators, **kwargs)
+            if compact:
+                self.write_json(fp)
+            else:
+                json.dump(self.to_dict(), fp, cls=CustomJSONEncoder, indent=indent, separators=separators, **kwargs)
+
+    def write_json(self, fp):
+        """
+        Write the to_dict() form of this result to the text file fp as compact
+        JSON, one message of the result at a time, so that only the encoded
+        form of the current message is held in memory. from_json_file reads it.
+        """
+        encoder = CustomJSONEncoder(separators=(',', ':'))
+        fp.write('{')
+        for key, value in self.to_dict().items():
+            if key != 'result':
+                fp.write('{}:{},'.format(encoder.encode(key), encoder.encode(value)))
+        fp.write('"result":[')
+        for i, msg in enumerate(self.result):
+            if i:
+                fp.write(',')
+            fp.write(encoder.encode(msg))
+        fp.write(']}')
 
-    def to_dataframe(self, converter=None):
-        return convert_to_frame(self, converter or self.converter)
+    def to_binary_file(self, outfile, converter=None):
+        """ Write the frame of this result, as to_dataframe(converter) returns it, with the meta, converter and request """
+        converter = converter or self.converter
+        header = OrderedDict([
+            ('meta', self.meta),
+            ('converter', converter if is_string(converter) else None),
+            ('request', self.request),
+        ])
+        write_frame(outfile, self.to_dataframe(converter), header)
+
+    def to_dataframe(self, converter=None, *, columns=None, symbols=None, start=None, end=None):
+        """
+        The frame read while streaming the response if there is one, unless a
+        converter is given. columns, symbols and start/end (inclusive) limit
+        it to those data columns, securities and dates; the predefined
+        converters then skip the rest of the result instead of converting it.
+        Frames are converted once and kept, so repeated calls return the same
+        frame, which should not be modified in place.
+        """
+        projection = None
+        if columns is not None or symbols is not None or start is not None or end is not None:
+            projection = Projection(columns, symbols, start, end)
+
+        if converter is None and self.frame is not None:
+            return self.frame if projection is None else projection.apply(self.frame)
+
+        converter = converter or self.converter
+        key = (converter, None if projection is None else projection.key())
+        frame = self._frames.get(key)
+        if frame is None:
+            frame = self._frames[key] = convert_to_frame(self, converter, projection)
+        return frame
 
     def to_dict(self):
         return OrderedDict([
@@ -47,3 +110,11 @@ class BloombergRequestResult(object):
 
     def __repr__(self):
         return 'BloombergRequestResult for request: ' + str(self.request)[:500] + ' ...'
+
+
+def json_to_binary(json_file, binary_file=None, converter=None):
+    """ Convert a result written by to_json_file, by default to the same name with a .bbgb extension """
+    if binary_file is None:
+        binary_file = path.splitext(json_file)[0] + '.bbgb'
+    BloombergRequestResult.from_json_file(json_file).to_binary_file(binary_file, converter)
+    return binary_file
@@ -0,0 +1,235 @@
+"""
+Client side rate limiting of requests: a token bucket of hits per second, a
+daily budget of hits that persists across processes, and priority of
+interactive over batch requests while waiting for either
+"""
+import contextvars
+import heapq
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from os import path
+
+import numpy as np
+import pandas as pd
+
+from bbgbridge.util import as_list, date_bloomberg_string, to_timestamp
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+INTERACTIVE = 0
+BATCH = 10
+
+_priority = contextvars.ContextVar('bbgbridge_priority', default=BATCH)
+
+PERIODS_PER_YEAR = {
+    'DAILY': 261,
+    'WEEKLY': 52,
+    'MONTHLY': 12,
+    'QUARTERLY': 4,
+    'SEMI_ANNUALLY': 2,
+    'YEARLY': 1,
+}
+
+
+class BudgetExceededError(RuntimeError):
+    """ Sending the request would exceed the daily budget """
+
+
+def estimate_hits(req_object):
+    """
+    Rough number of data points a request uses up: securities x fields,
+    times the number of periods for historical data
+    """
+    (request_type, body), = req_object.items()
+    securities = len(as_list(body.get('securities') or body.get('security') or [None]))
+    fields = len(as_list(body.get('fields') or [None]))
+    hits = securities * fields
+
+    if request_type == 'HistoricalDataRequest':
+        start = to_timestamp(body.get('startDate', '19000101'))
+        end = to_timestamp(body.get('endDate') or pd.Timestamp.now())
+        periodicity = body.get('periodicitySelection', 'DAILY')
+        if periodicity == 'DAILY':
+            periods = np.busday_count(start.date(), (end + pd.Timedelta(days=1)).date())
+        else:
+            periods = (end - start).days / 365.25 * PERIODS_PER_YEAR.get(periodicity, PERIODS_PER_YEAR['DAILY'])
+        hits *= max(1, int(np.ceil(periods)))
+    return hits
+
+
+@contextmanager
+def _file_lock(lock_file):
+    """ Hold an exclusive lock on lock_file, shared with other processes """
+    with open(lock_file, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def priority(value):
+    """ Requests sent within the block (in this thread or task) are scheduled with this priority, lower first """
+    token = _priority.set(value)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+class TokenBucket(object):
+    """ rate tokens per second, up to capacity of them saved up for bursts """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, tokens, now):
+        """ Seconds until tokens can be taken; a request larger than capacity only needs a full bucket """
+        self.refill(now)
+        missing = min(tokens, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def take(self, tokens):
+        self.tokens -= tokens  # may go negative for requests larger than the capacity
+
+
+class DailyBudget(object):
+    """
+    At most limit hits per day, counted in a file shared by all processes
+    using it. Charges hold a lock on a .lock file next to it, so concurrent
+    processes cannot lose each other's hits.
+    """
+
+    def __init__(self, limit, budget_file='~/.bbgbridge/budget.json'):
+        self.limit = limit
+        self.budget_file = path.expanduser(budget_file)
+        self.lock_file = self.budget_file + '.lock'
+        os.makedirs(path.dirname(self.budget_file) or '.', exist_ok=True)
+
+    def _today(self):
+        return date_bloomberg_string(pd.Timestamp.now())
+
+    def used(self):
+        try:
+            with open(self.budget_file) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        return data.get('hits', 0) if data.get('date') == self._today() else 0
+
+    def charge(self, hits):
+        with _file_lock(self.lock_file):
+            used = self.used()
+            if used + hits > self.limit:
+                raise BudgetExceededError('Request of {} hits would exceed the daily budget of {} ({} used)'.format(
+                    hits, self.limit, used))
+            fd, tmp_path = tempfile.mkstemp(dir=path.dirname(self.budget_file) or '.', suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'date': self._today(), 'hits': used + hits}, f)
+            os.replace(tmp_path, self.budget_file)
+
+    def remaining(self):
+        return max(0, self.limit - self.used())
+
+
+class RequestScheduler(object):
+    """
+    Decides when requests may be sent. Give it to a bridge (scheduler=...)
+    and every request it sends waits in admit() until the token bucket of
+    hits_per_second (with bursts of up to burst hits) allows it, waiting
+    requests going out by priority (see priority()) and then in order.
+    With daily_limit, requests that would exceed the daily budget raise
+    BudgetExceededError instead of being sent.
+    """
+
+    def __init__(self, hits_per_second=None, *, burst=None, daily_limit=None, budget_file='~/.bbgbridge/budget.json',
+                 estimate=estimate_hits):
+        self.bucket = None if hits_per_second is None else TokenBucket(hits_per_second, burst)
+        self.budget = None if daily_limit is None else DailyBudget(daily_limit, budget_file)
+        self.estimate = estimate
+        self.admitted = 0
+        self.hits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._waiting = []
+        self._tickets = itertools.count()
+        self._condition = threading.Condition()
+
+    def admit(self, req_object, priority=None):
+        """ Block until the request may be sent """
+        hits = self.estimate(req_object)
+        ticket = (current_priority() if priority is None else priority, next(self._tickets))
+        start = time.monotonic()
+        with self._condition:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    wait = None
+                    if self._waiting[0] == ticket:
+                        wait = self.bucket.wait_time(hits, time.monotonic()) if self.bucket is not None else 0.0
+                        if wait <= 0:
+                            break
+                    self._condition.wait(wait)
+
+                if self.budget is not None:
+                    self.budget.charge(hits)
+                if self.bucket is not None:
+                    self.bucket.take(hits)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
+
+            waited = time.monotonic() - start
+            self.admitted += 1
+            self.hits += hits
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+    def queue_depth(self):
+        with self._condition:
+            return len(self._waiting)
+
+    def stats(self):
+        with self._condition:
+            return OrderedDict([
+                ('queue_depth', len(self._waiting)),
+                ('admitted', self.admitted),
+                ('hits', self.hits),
+                ('mean_wait', self.total_wait / self.admitted if self.admitted else 0.0),
+                ('max_wait', self.max_wait),
+                ('budget_remaining', None if self.budget is None else self.budget.remaining()),
+            ])
+
+    def __repr__(self):
+        return 'RequestScheduler({})'.format(dict(self.stats()))
@@ -0,0 +1,232 @@
+"""
+Local store of historical data, so that repeated bdh calls only request the
+date ranges that have not been downloaded before
+"""
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from os import path
+
+import pandas as pd
+
+from bbgbridge.api import DEFAULT_MAX_IN_FLIGHT
+from bbgbridge.result import BloombergRequestResult
+from bbgbridge.util import CustomJSONEncoder, as_list, date_bloomberg_string, dedupe, to_timestamp
+
+ONE_DAY = pd.Timedelta(days=1)
+
+
+def add_range(ranges, start, end):
+    """ The sorted, non overlapping inclusive date ranges with [start, end] added """
+    merged = []
+    for range_start, range_end in sorted(list(ranges) + [(start, end)]):
+        if merged and range_start <= merged[-1][1] + ONE_DAY:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], range_end))
+        else:
+            merged.append((range_start, range_end))
+    return merged
+
+
+def missing_ranges(ranges, start, end):
+    """ The parts of the inclusive range [start, end] not covered by the sorted ranges """
+    missing = []
+    for range_start, range_end in ranges:
+        if range_end < start:
+            continue
+        if range_start > end:
+            break
+        if range_start > start:
+            missing.append((start, range_start - ONE_DAY))
+        start = range_end + ONE_DAY
+    if start <= end:
+        missing.append((start, end))
+    return missing
+
+
+def partition_key(symbol, field, periodicity_selection, periodicity_adjustment, overrides):
+    key = json.dumps([symbol, field, periodicity_selection, periodicity_adjustment, sorted((overrides or {}).items())],
+                     cls=CustomJSONEncoder)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class _Partition(object):
+    """ The values of one field of one security, by date, and the date ranges known to be complete """
+
+    def __init__(self, ranges=None, values=None):
+        self.ranges = ranges or []
+        self.values = values or {}
+
+
+class HistoryStore(object):
+    """
+    Disk store of daily (or other periodicity) historical data, partitioned
+    by security, field, periodicity and overrides, remembering which date
+    ranges of each partition have been downloaded.
+
+    request_historical_data (or bdh) works like the one of BloombergBridge,
+    but only requests the date ranges missing from the store and returns the
+    stored and the new data together, ready for the 'price' converter. Dates
+    from today on are never marked as downloaded, since their data can still
+    change.
+    """
+
+    def __init__(self, bridge, directory='~/.bbgbridge/history'):
+        self.bridge = bridge
+        self.directory = path.expanduser(directory)
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return path.join(self.directory, key + '.pickle')
+
+    def _load(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                ranges, values = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return _Partition()
+        return _Partition(ranges, values)
+
+    def _save(self, key, partition):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((partition.ranges, partition.values), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(key))
+
+    def covered_ranges(self, symbol, field, *, periodicity_adjustment='ACTUAL', periodicity_selection='DAILY', overrides=None):
+        key = partition_key(symbol, field, periodicity_selection, periodicity_adjustment, overrides)
+        return list(self._load(key).ranges)
+
+    def request_historical_data(self,
+                                symbols,
+                                fields,
+                                start_date='1900-01-01',
+                                end_date=None,
+                                *,
+                                periodicity_adjustment='ACTUAL',
+                                periodicity_selection='DAILY',
+                                overrides=None,
+                                meta=None):
+
+        if end_date is None:
+            end_date = pd.Timestamp.now()
+
+        symbols, fields = list(dedupe(as_list(symbols))), list(dedupe(as_list(fields)))
+        start, end = to_timestamp(start_date).normalize(), to_timestamp(end_date).normalize()
+        last_final_date = pd.Timestamp.now().normalize() - ONE_DAY
+
+        with self._lock:
+            keys = OrderedDict(((symbol, field), partition_key(symbol, field, periodicity_selection, periodicity_adjustment, overrides))
+                               for symbol in symbols for field in fields)
+            partitions = {x: self._load(key) for x, key in keys.items()}
+
+            gaps = OrderedDict()
+            for (symbol, field), partition in partitions.items():
+                for gap in missing_ranges(partition.ranges, start, end):
+                    gap_symbols, gap_fields = gaps.setdefault(gap, (set(), set()))
+                    gap_symbols.add(symbol)
+                    gap_fields.add(field)
+            gaps = OrderedDict((gap, ([s for s in symbols if s in gap_symbols], [f for f in fields if f in gap_fields]))
+                               for gap, (gap_symbols, gap_fields) in gaps.items())
+
+            security_errors, field_exceptions = OrderedDict(), OrderedDict()
+            results = self._fetch(gaps, periodicity_adjustment, periodicity_selection, overrides)
+            for (gap_start, gap_end), gap_symbols, gap_fields, res in results:
+                failed = set()
+                for msg in res.result:
+                    security_data = msg.get('securityData')
+                    if security_data is None:
+                        continue
+                    symbol = security_data['security']
+                    if security_data.get('securityError'):
+                        security_errors.setdefault(symbol, security_data['securityError'])
+                        failed.update((symbol, field) for field in gap_fields)
+                    for x in security_data.get('fieldExceptions', []):
+                        field_exceptions.setdefault(symbol, []).append(x)
+                        failed.add((symbol, x['fieldExceptions'].get('fieldId')))
+                    for x in security_data.get('fieldData', []):
+                        row = x['fieldData']
+                        for field in gap_fields:
+                            if field in row and (symbol, field) in partitions:
+                                partitions[symbol, field].values[to_timestamp(row['date']).normalize()] = row[field]
+
+                covered_end = min(gap_end, last_final_date)
+                for x in ((s, f) for s in gap_symbols for f in gap_fields):
+                    if x in partitions and x not in failed and gap_start <= covered_end:
+                        partitions[x].ranges = add_range(partitions[x].ranges, gap_start, covered_end)
+
+            for x in dict.fromkeys((s, f) for _, gap_symbols, gap_fields, _ in results
+                                   for s in gap_symbols for f in gap_fields if (s, f) in partitions):
+                self._save(keys[x], partitions[x])
+
+        ret_object = []
+        for i, symbol in enumerate(symbols):
+            rows = {}
+            for field in fields:
+                for date, value in partitions[symbol, field].values.items():
+                    if start <= date <= end:
+                        rows.setdefault(date, OrderedDict([('date', date)]))[field] = value
+            security_data = OrderedDict([
+                ('security', symbol),
+                ('eidData', []),
+                ('sequenceNumber', i),
+                ('fieldExceptions', field_exceptions.get(symbol, [])),
+                ('fieldData', [{'fieldData': rows[date]} for date in sorted(rows)])])
+            if symbol in security_errors:
+                security_data['securityError'] = security_errors[symbol]
+            ret_object.append({'securityData': security_data})
+
+        request = OrderedDict([('HistoricalDataRequest', OrderedDict([
+            ('securities', symbols),
+            ('fields', fields),
+            ('periodicityAdjustment', periodicity_adjustment),
+            ('periodicitySelection', periodicity_selection),
+            ('startDate', date_bloomberg_string(start)),
+            ('endDate', date_bloomberg_string(end)),
+            ('overrides', [{'overrides': OrderedDict([('fieldId', k), ('value', v)])} for k, v in (overrides or {}).items()]),
+        ]))])
+        return BloombergRequestResult(ret_object, request, meta=meta, converter='price')
+
+    def _fetch(self, gaps, periodicity_adjustment, periodicity_selection, overrides):
+        """ Request the gaps through the bridge, yielding (gap, symbols, fields, result) for each request """
+        chunk_plan = self.bridge.chunk_plan
+        requests, chunks = [], []
+        for gap, (gap_symbols, gap_fields) in gaps.items():
+            for symbol_chunk, field_chunk, chunk_start, chunk_end in chunk_plan.historical_chunks(
+                    gap_symbols, gap_fields, gap[0], gap[1], periodicity_selection):
+                modifiers = {
+                    'periodicityAdjustment': periodicity_adjustment,
+                    'periodicitySelection': periodicity_selection,
+                    'returnEids': 'true',
+                    'startDate': date_bloomberg_string(chunk_start),
+                    'endDate': date_bloomberg_string(chunk_end),
+                }
+                requests.append(self.bridge.create_request('HistoricalDataRequest',
+                                                           symbol_chunk,
+                                                           field_chunk,
+                                                           modifiers=modifiers,
+                                                           overrides=overrides))
+                chunks.append(((to_timestamp(chunk_start).normalize(), to_timestamp(chunk_end).normalize()), symbol_chunk, field_chunk))
+
+        if not requests:
+            return []
+
+        results = self.bridge.send_requests(requests, max_in_flight=chunk_plan.max_in_flight or DEFAULT_MAX_IN_FLIGHT)
+        return [chunk + (res,) for chunk, res in zip(chunks, results)]
+
+    def clear(self):
+        with self._lock:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.pickle'):
+                    os.remove(entry.path)
+
+    def __repr__(self):
+        return 'HistoryStore({})'.format(self.directory)
+
+
+# Excel-like Bloomberg function alias
+HistoryStore.bdh = HistoryStore.request_historical_data
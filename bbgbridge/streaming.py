@@ -0,0 +1,123 @@
+"""
+Collection of the messages of a response as they arrive, either parsed into
+nested dicts (the default) or streamed straight into the columns of a frame
+"""
+from collections import OrderedDict
+
+from blpapi import DataType
+
+from bbgbridge.converters import ColumnarFrameBuilder
+from bbgbridge.parsing import compiled_parser, native_element_value, native_parser, parse_element
+
+
+class ParsedMessages(object):
+    """ Keeps the parsed form of every message, as parser parses it. add returns the parsed message """
+
+    def __init__(self, parser=compiled_parser):
+        self.parser = parser
+        self.messages = []
+
+    def add(self, msg):
+        parsed = self.parser.parse_message(msg)
+        self.messages.append(parsed)
+        return parsed
+
+    def to_frame(self):
+        return None
+
+
+def _row(element):
+    return OrderedDict((str(child.name()), native_element_value(child)) for child in element.elements())
+
+
+class _StreamingCollector(object):
+    """
+    Appends the rows of data_name elements to a ColumnarFrameBuilder as the
+    messages arrive, with dates left as they are for the builder to convert
+    whole columns at once. Other messages are kept parsed. Unless keep_raw is set,
+    the data elements themselves are not kept, only their other children.
+    add returns the form of the message that is kept, and the frame is only
+    built once.
+    """
+
+    data_name = None
+    rows_name = None
+
+    def __init__(self, req_object, keep_raw=False):
+        self.req_object = req_object
+        self.keep_raw = keep_raw
+        self.messages = []
+        self.builder = ColumnarFrameBuilder()
+        self._frame = None
+
+    def symbol(self, element):
+        raise NotImplementedError
+
+    def add(self, msg):
+        element = msg.asElement()
+        if element.datatype() == DataType.CHOICE:
+            element = element.getChoice()
+
+        if self.keep_raw or str(element.name()) != self.data_name:
+            self.messages.append(compiled_parser.parse_message(msg))
+        if str(element.name()) != self.data_name:
+            return self.messages[-1]
+
+        rows = element.getElement(self.rows_name) if element.hasElement(self.rows_name) else None
+        if rows is not None:
+            self.builder.add_rows((_row(x) for x in rows.values()), self.symbol(element))
+
+        if not self.keep_raw:
+            skeleton = OrderedDict((str(child.name()), parse_element(child))
+                                   for child in element.elements() if str(child.name()) != self.rows_name)
+            skeleton[self.rows_name] = []
+            self.messages.append({self.data_name: skeleton})
+        return self.messages[-1]
+
+    def to_frame(self):
+        if self._frame is None:
+            self._frame = self.builder.to_frame()
+        return self._frame
+
+
+class HistoricalDataCollector(_StreamingCollector):
+    data_name = 'securityData'
+    rows_name = 'fieldData'
+
+    def symbol(self, element):
+        return element.getElement('security').getValue()
+
+
+class IntradayBarCollector(_StreamingCollector):
+    data_name = 'barData'
+    rows_name = 'barTickData'
+
+    def symbol(self, element):
+        return self.req_object['IntradayBarRequest']['security']
+
+
+class IntradayTickCollector(_StreamingCollector):
+    data_name = 'tickData'
+    rows_name = 'tickData'
+
+    def symbol(self, element):
+        return self.req_object['IntradayTickRequest']['security']
+
+
+streaming_collectors = {
+    'HistoricalDataRequest': HistoricalDataCollector,
+    'IntradayBarRequest': IntradayBarCollector,
+    'IntradayTickRequest': IntradayTickCollector,
+}
+
+
+def create_collector(req_object, stream=False, keep_raw=False, native_dates=False):
+    """ native_dates leaves the dates of parsed (not streamed) messages as blpapi returns them """
+    if not stream:
+        return ParsedMessages(native_parser if native_dates else compiled_parser)
+
+    (request_type, _), = req_object.items()
+    collector = streaming_collectors.get(request_type)
+    if collector is None:
+        raise ValueError('Streaming is only supported for {}, but was: {}'.format(sorted(streaming_collectors), request_type))
+    return collector(req_object, keep_raw)
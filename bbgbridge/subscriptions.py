@@ -0,0 +1,221 @@
+"""
+Real time //blp/mktdata subscriptions, with the ticks of each security kept
+in a preallocated ring buffer so memory stays bounded
+"""
+import threading
+import time
+from collections import OrderedDict
+from numbers import Real
+
+import numpy as np
+import pandas as pd
+from blpapi import CorrelationId, Event, SubscriptionList
+
+from bbgbridge.parsing import compiled_parser
+from bbgbridge.util import as_list, dedupe
+
+SUBSCRIPTION_EVENTS = frozenset([Event.SUBSCRIPTION_DATA, Event.SUBSCRIPTION_STATUS])
+
+
+class TickRingBuffer(object):
+    """
+    The last capacity ticks of the numeric fields of one security: receive
+    times as datetime64[ns] and values as float64, NaN where a tick did not
+    have the field. Older ticks are overwritten.
+    """
+
+    def __init__(self, fields, capacity):
+        self.fields = list(fields)
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype='datetime64[ns]')
+        self.values = np.full((capacity, len(self.fields)), np.nan)
+        self.count = 0
+        self._columns = {f: i for i, f in enumerate(self.fields)}
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def _slot(self, values, receive_time):
+        slot = self.count % self.capacity
+        self.times[slot] = receive_time
+        self.values[slot] = np.nan
+        self._fill(slot, values)
+
+    def _fill(self, slot, values):
+        for field, value in values.items():
+            column = self._columns.get(field)
+            if column is not None and isinstance(value, Real):
+                self.values[slot, column] = value
+
+    def append(self, values, receive_time):
+        self._slot(values, receive_time)
+        self.count += 1
+
+    def update_last(self, values, receive_time):
+        """ Merge values into the last tick instead of adding a new one (for throttling) """
+        slot = (self.count - 1) % self.capacity
+        self.times[slot] = receive_time
+        self._fill(slot, values)
+
+    def last_time(self):
+        return self.times[(self.count - 1) % self.capacity] if self.count else None
+
+    def to_frame(self):
+        """ The ticks in the buffer, oldest first """
+        order = np.arange(self.count - len(self), self.count) % self.capacity
+        frame = pd.DataFrame(self.values[order], columns=self.fields)
+        frame.insert(0, 'time', self.times[order])
+        return frame
+
+
+class _Subscription(object):
+    def __init__(self, symbol, correlation_id, ticks):
+        self.symbol = symbol
+        self.correlation_id = correlation_id
+        self.ticks = ticks
+        self.status = 'Pending'
+        self.last = OrderedDict()
+        self.updates = 0
+
+
+class SubscriptionManager(object):
+    """
+    Subscribes securities to the fields of //blp/mktdata on the session of
+    a bridge. SUBSCRIPTION_DATA messages are parsed with the compiled
+    parser, their numeric subscribed fields go to the security's
+    TickRingBuffer and all their fields update its last values.
+
+    interval asks Bloomberg to conflate the updates of each security to one
+    every interval seconds. throttle conflates on the client: a tick that
+    arrives less than throttle seconds after the last stored tick of the
+    security is merged into that one instead of being added.
+
+    Events are processed by process_events, by a background thread after
+    start(), and by any request the bridge runs meanwhile. All of them read
+    the events of the session through the bridge, which hands each message
+    to whoever it belongs to, so requests can run while subscriptions are
+    processed in the background.
+    """
+
+    def __init__(self, bridge, fields, *, capacity=1024, interval=None, throttle=None, service='//blp/mktdata'):
+        self.bridge = bridge
+        self.fields = list(dedupe(as_list(fields)))
+        self.capacity = capacity
+        self.interval = interval
+        self.throttle = None if throttle is None else np.timedelta64(int(throttle * 1e9), 'ns')
+        self.service = service
+        self._by_symbol = OrderedDict()
+        self._by_key = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def _topic(self, symbol):
+        return symbol if symbol.startswith('/') else '{}/ticker/{}'.format(self.service, symbol)
+
+    def _options(self):
+        return [] if self.interval is None else ['interval={}'.format(self.interval)]
+
+    def subscribe(self, symbols):
+        self.bridge._service(self.service)
+        subscriptions = SubscriptionList()
+        with self._lock:
+            for symbol in dedupe(as_list(symbols)):
+                if symbol in self._by_symbol:
+                    continue
+                correlation_id = CorrelationId(next(self.bridge._correlation_ids))
+                subscription = _Subscription(symbol, correlation_id, TickRingBuffer(self.fields, self.capacity))
+                self._by_symbol[symbol] = subscription
+                self._by_key[correlation_id.value()] = subscription
+                subscriptions.add(self._topic(symbol), self.fields, self._options(), correlation_id)
+        if subscriptions.size():
+            self.bridge.session.subscribe(subscriptions)
+
+    def unsubscribe(self, symbols=None):
+        subscriptions = SubscriptionList()
+        with self._lock:
+            for symbol in list(self._by_symbol) if symbols is None else dedupe(as_list(symbols)):
+                subscription = self._by_symbol.pop(symbol, None)
+                if subscription is not None:
+                    del self._by_key[subscription.correlation_id.value()]
+                    subscriptions.add(self._topic(symbol), self.fields, self._options(), subscription.correlation_id)
+        if subscriptions.size():
+            self.bridge.session.unsubscribe(subscriptions)
+
+    def handle_event(self, ev):
+        receive_time = np.datetime64(time.time_ns(), 'ns')
+        data = ev.eventType() == Event.SUBSCRIPTION_DATA
+        for msg in ev:
+            for correlation_id in msg.correlationIds():
+                with self._lock:
+                    subscription = self._by_key.get(correlation_id.value())
+                    if subscription is None:
+                        continue
+                    if data:
+                        self._on_data(subscription, msg, receive_time)
+                    else:
+                        subscription.status = str(msg.messageType())
+
+    def _on_data(self, subscription, msg, receive_time):
+        (_, values), = compiled_parser.parse_message(msg).items()
+        subscription.last.update(values)
+        subscription.updates += 1
+        ticks = subscription.ticks
+        if self.throttle is not None and ticks.count and receive_time - ticks.last_time() < self.throttle:
+            ticks.update_last(values, receive_time)
+        else:
+            ticks.append(values, receive_time)
+
+    def process_events(self, timeout=500):
+        """
+        Process the events arriving within timeout milliseconds. The messages
+        of requests the bridge has in flight are passed on to them.
+        """
+        deadline = time.monotonic() + timeout / 1000.0
+        inbox = []  # owns no requests, so stays empty
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            self.bridge._receive(inbox, remaining)
+
+    def start(self):
+        """ Process events in a background thread until stop() """
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='bbgbridge-subscriptions', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self.process_events()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def status(self, symbol):
+        return self._by_symbol[symbol].status
+
+    def last(self, symbol):
+        """ The last value of every field received for the security """
+        with self._lock:
+            return OrderedDict(self._by_symbol[symbol].last)
+
+    def snapshot(self, symbols=None):
+        """ The last values of the securities, one row per security """
+        with self._lock:
+            subscriptions = [self._by_symbol[s] for s in (self._by_symbol if symbols is None else as_list(symbols))]
+            rows = [OrderedDict([('symbol', x.symbol), ('status', x.status), ('updates', x.updates)]) for x in subscriptions]
+            for row, x in zip(rows, subscriptions):
+                row.update(x.last)
+        return pd.DataFrame(rows, columns=None if rows else ['symbol', 'status', 'updates'])
+
+    def ticks(self, symbol):
+        """ The ticks kept for the security, oldest first """
+        with self._lock:
+            return self._by_symbol[symbol].ticks.to_frame()
+
+    def __repr__(self):
+        return 'SubscriptionManager({} securities, fields={})'.format(len(self._by_symbol), self.fields)
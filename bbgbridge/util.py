@@ -1,7 +1,14 @@
 import json
+from collections import OrderedDict
+
 import numpy as np
 import pandas as pd
 
+try:
+    import orjson
+except ImportError:  # The standard library decoder is used instead
+    orjson = None
+
 
 def is_string(arg):
     return isinstance(arg, str)
@@ -54,6 +61,20 @@ def merge_dicts(*dict_args):
     return result
 
 
+def read_json_file(data_file):
+    """ json.load of a file, with orjson when it is installed, which decodes several times faster """
+    if orjson is None:
+        with open(data_file) as f:
+            return json.load(f)
+    with open(data_file, 'rb') as f:
+        data = f.read()
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        # orjson rejects the NaN and Infinity that json.dump writes for such floats
+        return json.loads(data)
+
+
 def numpy_obj_to_python(obj):
     if isinstance(obj, np.ndarray) and obj.ndim == 0:
         return obj.item()
@@ -61,6 +82,12 @@ def numpy_obj_to_python(obj):
         return obj
 
 
+def _python_values(values):
+    """ The values of a frame, series or index as objects, with None for missing ones """
+    values = values.astype(object)
+    return values.where(values.notna(), None)
+
+
 class CustomJSONEncoder(json.JSONEncoder):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -70,20 +97,31 @@ class CustomJSONEncoder(json.JSONEncoder):
             return obj.isoformat()
         if isinstance(obj, pd.DataFrame) or isinstance(obj, pd.Series):
             return self.pandas_obj_to_json(obj)
-        if isinstance(obj, np.ndarray) and obj.ndim <= 1:
-            return obj.tolist() if obj.ndim == 1 else obj.item()
-        if isinstance(obj, np.bool_):
-            return obj.item()
-        if isinstance(obj, np.signedinteger):
+        if isinstance(obj, np.ndarray):
+            return obj.tolist() if obj.ndim else obj.item()
+        if isinstance(obj, np.datetime64):
+            return to_timestamp(obj).isoformat()
+        if isinstance(obj, np.generic):
             return obj.item()
         return json.JSONEncoder.default(self, obj)
 
     @staticmethod
     def pandas_obj_to_json(obj):
+        """
+        The orient='split' layout of a frame or series as Python lists, which
+        the encoder then writes directly
+        """
         if isinstance(obj, pd.DataFrame):
-            new_obj = obj.applymap(numpy_obj_to_python)
+            return OrderedDict([
+                ('columns', obj.columns.tolist()),
+                ('index', _python_values(obj.index).tolist()),
+                ('data', _python_values(obj).values.tolist()),
+            ])
         elif isinstance(obj, pd.Series):
-            new_obj = obj.apply(numpy_obj_to_python)
+            return OrderedDict([
+                ('name', obj.name),
+                ('index', _python_values(obj.index).tolist()),
+                ('data', _python_values(obj).tolist()),
+            ])
         else:
             raise ValueError('Something very bad has happened, programming error?!')
-        return json.loads(new_obj.to_json(orient='split', date_format='iso'))
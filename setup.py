@@ -6,8 +6,8 @@ exec(open('bbgbridge/version.py').read())
 
 
 def check_python_version():
-    if sys.version_info[:2] < (3, 4):
-        print('Python 3.4 or newer is required. Python version detected: {}'.format(sys.version_info))
+    if sys.version_info[:2] < (3, 7):
+        print('Python 3.7 or newer is required. Python version detected: {}'.format(sys.version_info))
         sys.exit(-1)
 
 
@@ -22,12 +22,14 @@ def main():
           classifiers=[
               'Development Status :: 4 - Beta',
               'Programming Language :: Python :: 3',
-              'Programming Language :: Python :: 3.4',
-              'Programming Language :: Python :: 3.5',
+              'Programming Language :: Python :: 3.7',
+              'Programming Language :: Python :: 3.8',
+              'Programming Language :: Python :: 3.9',
               'Intended Audience :: Financial and Insurance Industry'
           ],
           license='LPGL',
           packages=find_packages(include=['bbgbridge']),
+          python_requires='>=3.7',
           install_requires=['pandas'],
           platforms='any')
 
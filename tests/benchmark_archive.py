@@ -0,0 +1,37 @@
+"""
+Compare file size and load time of the JSON and binary formats, on the
+sample price fixtures scaled up to many securities and rows.
+
+    python -m tests.benchmark_archive
+"""
+import os
+import shutil
+import tempfile
+import timeit
+from os import path
+
+from bbgbridge.result import BloombergRequestResult
+from tests.benchmark_converters import scaled_sample
+
+
+def main(number=5):
+    directory = tempfile.mkdtemp()
+    try:
+        for name in ('sample_futures_price.json', 'sample_generic_price.json'):
+            bbg_result = scaled_sample(name)
+            json_file, binary_file = path.join(directory, 'result.json'), path.join(directory, 'result.bbgb')
+            bbg_result.to_json_file(json_file)
+            bbg_result.to_binary_file(binary_file, 'price')
+            print(name)
+            for label, data_file, load in (
+                    ('json', json_file, lambda: BloombergRequestResult.from_json_file(json_file).to_dataframe('price')),
+                    ('binary', binary_file, lambda: BloombergRequestResult.from_binary_file(binary_file).to_dataframe())):
+                seconds = min(timeit.repeat(load, number=1, repeat=number))
+                print('  {:<7} {:8.1f} MB {:8.1f} ms to load as frame'.format(
+                    label, os.stat(data_file).st_size / 1e6, seconds * 1000))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
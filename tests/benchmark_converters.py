@@ -0,0 +1,34 @@
+"""
+Compare the columnar price_to_frame with the row dict path it replaced, on
+the sample price fixtures scaled up to many securities and rows.
+
+    python -m tests.benchmark_converters
+"""
+import timeit
+
+from bbgbridge.converters import price_to_frame
+from bbgbridge.fake import scale_messages
+from bbgbridge.result import BloombergRequestResult
+from tests.test_converters import load_sample, price_rows_to_frame
+
+
+def scaled_sample(name, securities=500, repeat_rows=100):
+    sample = load_sample(name)
+    return BloombergRequestResult(scale_messages(sample.result, securities, repeat_rows), sample.request)
+
+
+def main(number=5):
+    for name in ('sample_futures_price.json', 'sample_generic_price.json'):
+        bbg_result = scaled_sample(name)
+        rows = sum(len(x['securityData']['fieldData']) for x in bbg_result.result)
+        print('{} ({} rows)'.format(name, rows))
+        for label, convert in (('row dicts', price_rows_to_frame), ('columnar', price_to_frame)):
+            seconds = min(timeit.repeat(lambda: convert(bbg_result), number=1, repeat=number))
+            print('  {:<10} {:8.1f} ms'.format(label, seconds * 1000))
+        print('  memory: {:.1f} MB row dicts, {:.1f} MB columnar'.format(
+            price_rows_to_frame(bbg_result).memory_usage(deep=True).sum() / 1e6,
+            price_to_frame(bbg_result).memory_usage(deep=True).sum() / 1e6))
+
+
+if __name__ == '__main__':
+    main()
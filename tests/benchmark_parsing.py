@@ -0,0 +1,26 @@
+"""
+Compare CompiledParser with parse_message on the sample fixtures, played
+back as fake messages. The fake messages build their elements once, so
+only the parsing is timed.
+
+    python -m tests.benchmark_parsing
+"""
+import timeit
+
+from bbgbridge.parsing import CompiledParser, parse_message
+from tests.test_parsing import sample_messages
+
+
+def main(number=200):
+    messages = sample_messages()
+    parser = CompiledParser()
+    timings = {}
+    for label, parse in (('parse_message', parse_message), ('compiled', parser.parse_message)):
+        seconds = min(timeit.repeat(lambda: [parse(msg) for msg in messages], number=number, repeat=5))
+        timings[label] = seconds / number / len(messages) * 1e6
+        print('{:<14} {:8.1f} us per message'.format(label, timings[label]))
+    print('speedup        {:8.2f}x'.format(timings['parse_message'] / timings['compiled']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmarks of the whole request path without a terminal, against a
+FakeSession replaying the sample fixtures scaled to 1x, 10x and 100x
+(BASE_COPIES copies of each security at 1x):
+building requests, sending them and parsing the responses, converting them
+to frames and serializing them to JSON and binary.
+
+    python -m tests.benchmark_suite [1 10 100]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+from os import path
+
+from bbgbridge.api import BloombergBridge
+from bbgbridge.converters import convert_to_frame
+from bbgbridge.fake import FakeSession, security_items, recorded_responder, scale_messages
+from bbgbridge.result import BloombergRequestResult
+from tests.test_converters import load_sample
+
+SCALES = (1, 10, 100)
+BASE_COPIES = 10
+SAMPLES = (
+    ('sample_futures_price.json', 'HistoricalDataRequest', 'price'),
+    ('sample_generic_price.json', 'HistoricalDataRequest', 'price'),
+    ('sample_futures_refdata.json', 'ReferenceDataRequest', 'refdata'),
+    ('sample_generic_refdata.json', 'ReferenceDataRequest', 'refdata'),
+)
+
+
+def _request_contents(messages):
+    securities, fields = [], []
+    for security_data in security_items(messages):
+        securities.append(security_data['security'])
+        field_data = security_data.get('fieldData', [])
+        rows = field_data if isinstance(field_data, list) else [field_data]
+        for row in rows:
+            fields.extend(k for k in row['fieldData'] if k != 'date' and k not in fields)
+    return securities, fields
+
+
+def _timed(func, number):
+    return min(timeit.repeat(func, number=1, repeat=number)) * 1000
+
+
+def run(name, request_type, converter, scale, directory, number=3):
+    """ Milliseconds taken by each step for the sample at the scale """
+    messages = scale_messages(load_sample(name).result, securities=BASE_COPIES * scale)
+    securities, fields = _request_contents(messages)
+    bridge = BloombergBridge(FakeSession(recorded_responder(messages, chunk_size=100)))
+    modifiers = {'startDate': '19000101', 'endDate': '20991231'} if request_type == 'HistoricalDataRequest' else None
+
+    def build():
+        return bridge.create_request(request_type, securities, fields, modifiers=modifiers)
+
+    res = bridge.send_request(build(), converter=converter)
+    json_file, binary_file = path.join(directory, 'result.json'), path.join(directory, 'result.bbgb')
+    compact_file = path.join(directory, 'result.compact.json')
+    timings = [
+        ('build', _timed(build, number)),
+        ('send+parse', _timed(lambda: bridge.send_request(build(), converter=converter), number)),
+        ('convert', _timed(lambda: convert_to_frame(res, converter), number)),
+        ('to_json', _timed(lambda: res.to_json_file(json_file), number)),
+        ('to_json_compact', _timed(lambda: res.to_json_file(compact_file, compact=True), number)),
+        ('from_json', _timed(lambda: BloombergRequestResult.from_json_file(json_file), number)),
+        ('to_binary', _timed(lambda: res.to_binary_file(binary_file), number)),
+        ('from_binary', _timed(lambda: BloombergRequestResult.from_binary_file(binary_file).to_dataframe(), number)),
+    ]
+    return len(res.to_dataframe()), timings
+
+
+def main(scales=SCALES):
+    directory = tempfile.mkdtemp()
+    try:
+        for name, request_type, converter in SAMPLES:
+            print(name)
+            for scale in scales:
+                rows, timings = run(name, request_type, converter, scale, directory)
+                print('  {:>4}x {:>8} rows  '.format(scale, rows) + '  '.join(
+                    '{} {:.1f} ms'.format(label, ms) for label, ms in timings))
+        print('  (json file {:.1f} MB at the last scale)'.format(os.stat(path.join(directory, 'result.json')).st_size / 1e6))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or SCALES)
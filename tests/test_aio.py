@@ -0,0 +1,80 @@
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+from bbgbridge.aio import AsyncBloombergBridge
+from bbgbridge.api import SessionTerminatedError
+from bbgbridge.fake import FakeSession, responses_by_security
+from tests.test_api import SAMPLE_RESPONSES
+from tests.test_streaming import tick_responder
+
+
+class AsyncBloombergBridgeTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.session = FakeSession(responses_by_security(SAMPLE_RESPONSES))
+        self.bridge = AsyncBloombergBridge(self.session)
+
+    def tearDown(self):
+        self.bridge.stop()
+        self.loop.close()
+
+    def test_bdh(self):
+        res = self.loop.run_until_complete(self.bridge.bdh('SPY US Equity', 'PX_LAST', '2015-08-01', '2015-09-01'))
+        self.assertEqual(SAMPLE_RESPONSES['SPY US Equity'], res.result)
+        self.assertEqual(2, len(res.to_dataframe('price')))
+
+    def test_many_coroutines_share_one_session(self):
+        symbols = list(SAMPLE_RESPONSES) * 25
+
+        async def run():
+            return await asyncio.gather(*[self.bridge.bdp(symbol, 'PX_LAST') for symbol in symbols])
+
+        results = self.loop.run_until_complete(run())
+        self.assertEqual(symbols, [res.result[0]['securityData']['security'] for res in results])
+        self.assertEqual(len(symbols), len(self.session.sent_requests))
+        self.assertEqual(0, len(self.bridge._pending))
+
+    def test_send_requests_honors_max_in_flight(self):
+        requests = [self.bridge.create_request('ReferenceDataRequest', [s], ['PX_LAST']) for s in SAMPLE_RESPONSES]
+        results = self.loop.run_until_complete(self.bridge.send_requests(requests, max_in_flight=1))
+        self.assertEqual(1, self.session.max_outstanding)
+        self.assertEqual(list(SAMPLE_RESPONSES), [res.request['ReferenceDataRequest']['securities'][0] for res in results])
+
+    def test_dispatch_failure_fails_outstanding_requests(self):
+        with mock.patch('bbgbridge.aio.correlation_key', side_effect=ValueError('bad message')):
+            with self.assertRaisesRegex(RuntimeError, 'bad message'):
+                self.loop.run_until_complete(self.bridge.bdp('SPY US Equity', 'PX_LAST'))
+        res = self.loop.run_until_complete(self.bridge.bdp('SPY US Equity', 'PX_LAST'))
+        self.assertEqual('SPY US Equity', res.result[0]['securityData']['security'])
+
+    def test_intraday_ticks(self):
+        self.session.responder = tick_responder
+        self.session.latency = 0.05
+
+        async def run():
+            return [frame async for frame in self.bridge.bdit(['SPY US Equity', 'QQQ US Equity'], '2015-08-03 09:30',
+                                                              '2015-08-03 16:00', window='2h', max_in_flight=3)]
+
+        frames = self.loop.run_until_complete(run())
+        self.assertEqual(2 * 4, len(frames))
+        self.assertEqual(3, self.session.max_outstanding)
+        self.assertEqual(2 * 40, sum(len(x) for x in frames))
+
+    def test_subscription_events_reach_the_manager(self):
+        manager = self.bridge.subscribe('SPY US Equity', ['LAST_PRICE'])
+        self.session.replay([('SPY US Equity', {'LAST_PRICE': 187.0})])
+        manager.process_events(timeout=10)
+        deadline = time.monotonic() + 5
+        while manager.last('SPY US Equity').get('LAST_PRICE') is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(187.0, manager.last('SPY US Equity')['LAST_PRICE'])
+        res = self.loop.run_until_complete(self.bridge.bdp('QQQ US Equity', 'PX_LAST'))
+        self.assertEqual('QQQ US Equity', res.result[0]['securityData']['security'])
+
+    def test_stop_fails_outstanding_requests(self):
+        self.session.latency = 60
+        self.loop.call_later(0.05, self.bridge.stop)
+        with self.assertRaises(SessionTerminatedError):
+            self.loop.run_until_complete(self.bridge.bdp('SPY US Equity', 'PX_LAST'))
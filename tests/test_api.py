@@ -0,0 +1,98 @@
+import threading
+import time
+import unittest
+
+from collections import OrderedDict
+
+from bbgbridge.api import BloombergBridge, RequestTimeoutError
+from bbgbridge.fake import FakeSession, responses_by_security
+from bbgbridge.util import to_timestamp
+
+
+def price_message(security, *rows):
+    return {'securityData': OrderedDict([
+        ('security', security),
+        ('eidData', []),
+        ('sequenceNumber', 0),
+        ('fieldExceptions', []),
+        ('fieldData', [{'fieldData': OrderedDict([('date', d), ('PX_LAST', px)])} for d, px in rows])])}
+
+
+SAMPLE_RESPONSES = {
+    'SPY US Equity': [price_message('SPY US Equity', (to_timestamp('2015-08-25'), 187.27), (to_timestamp('2015-08-26'), 194.46))],
+    'QQQ US Equity': [price_message('QQQ US Equity', (to_timestamp('2015-08-25'), 98.40))],
+    'IWM US Equity': [price_message('IWM US Equity', (to_timestamp('2015-08-25'), 110.02))],
+    'ESZ5 Index': [price_message('ESZ5 Index', (to_timestamp('2015-08-25'), 1862.75))],
+}
+
+
+class BloombergBridgeSendRequestsTest(unittest.TestCase):
+    def setUp(self):
+        self.session = FakeSession(responses_by_security(SAMPLE_RESPONSES))
+        self.bridge = BloombergBridge(self.session)
+
+    def create_requests(self, *symbol_lists):
+        return [self.bridge.create_request('HistoricalDataRequest', symbols, ['PX_LAST']) for symbols in symbol_lists]
+
+    def test_send_request(self):
+        res = self.bridge.send_request(self.create_requests(['SPY US Equity'])[0], meta={'batch': 1})
+        self.assertEqual([SAMPLE_RESPONSES['SPY US Equity'][0]], res.result)
+        self.assertEqual(['SPY US Equity'], res.request['HistoricalDataRequest']['securities'])
+        self.assertEqual({'batch': 1}, res.meta)
+
+    def test_send_requests_interleaved_responses_are_routed_in_order(self):
+        requests = self.create_requests(['SPY US Equity', 'QQQ US Equity'], ['IWM US Equity'], ['ESZ5 Index', 'SPY US Equity'])
+        results = self.bridge.send_requests(requests, converter='price')
+        self.assertEqual(3, len(results))
+        self.assertEqual(3, self.session.max_outstanding)
+        self.assertEqual(
+            [['SPY US Equity', 'QQQ US Equity'], ['IWM US Equity'], ['ESZ5 Index', 'SPY US Equity']],
+            [[msg['securityData']['security'] for msg in res.result] for res in results])
+        self.assertEqual(['price'] * 3, [res.converter for res in results])
+
+    def test_send_requests_honors_max_in_flight(self):
+        requests = self.create_requests(*([s] for s in SAMPLE_RESPONSES))
+        results = self.bridge.send_requests(requests, max_in_flight=2)
+        self.assertEqual(2, self.session.max_outstanding)
+        self.assertEqual(list(SAMPLE_RESPONSES), [res.result[0]['securityData']['security'] for res in results])
+
+    def test_send_requests_meta_length_mismatch(self):
+        self.assertRaises(ValueError, self.bridge.send_requests, self.create_requests(['SPY US Equity']), metas=[None, None])
+
+
+class BloombergBridgeEventRoutingTest(unittest.TestCase):
+    def setUp(self):
+        self.session = FakeSession(responses_by_security(SAMPLE_RESPONSES), latency=0.05)
+        self.bridge = BloombergBridge(self.session)
+
+    def test_concurrent_callers_get_their_own_responses(self):
+        results = {}
+
+        def run(symbol):
+            request = self.bridge.create_request('HistoricalDataRequest', [symbol], ['PX_LAST'])
+            results[symbol] = self.bridge.send_request(request)
+
+        threads = [threading.Thread(target=run, args=(symbol,)) for symbol in SAMPLE_RESPONSES]
+        start = time.monotonic()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # all wait for the same latency rather than for a polling timeout each
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertEqual({s: s for s in SAMPLE_RESPONSES}, {s: res.result[0]['securityData']['security'] for s, res in results.items()})
+
+    def test_timeout_cancels_outstanding_requests(self):
+        self.session.latency = 1
+        requests = [self.bridge.create_request('HistoricalDataRequest', [s], ['PX_LAST']) for s in SAMPLE_RESPONSES]
+        start = time.monotonic()
+        with self.assertRaises(RequestTimeoutError):
+            self.bridge.send_requests(requests, timeout=0.1)
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual([1, 2, 3, 4], self.session.cancelled)
+        self.assertEqual({}, self.bridge._owners)
+
+        self.session.latency = 0
+        res = self.bridge.send_request(requests[0], timeout=0.5)
+        self.assertEqual('SPY US Equity', res.result[0]['securityData']['security'])
+
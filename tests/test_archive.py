@@ -0,0 +1,57 @@
+import shutil
+import tempfile
+import unittest
+from os import path
+
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+
+from bbgbridge.archive import read_frame, write_frame
+from bbgbridge.result import BloombergRequestResult, json_to_binary
+from tests.test_converters import DATA_DIR, load_sample
+
+
+class BinaryArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_frame_round_trip(self):
+        frame = pd.DataFrame({
+            'date': pd.to_datetime(['2015-08-25', None, '2015-08-27']),
+            'time': pd.to_datetime(['2015-08-25 09:30'] * 3).tz_localize('America/New_York'),
+            'PX_LAST': [1.5, np.nan, 3.5],
+            'volume': np.array([1, 2, 3], dtype=np.int64),
+            'symbol': pd.Categorical(['A', 'A', 'B']),
+            'name': ['x', 'y', 'x'],
+            'legs': [[1, 2], [], [3]],
+        })
+        outfile = path.join(self.directory, 'frame.bbgb')
+        write_frame(outfile, frame, {'request': {'a': 1}})
+        header, actual = read_frame(outfile)
+        self.assertEqual({'a': 1}, header['request'])
+        pdt.assert_frame_equal(frame, actual)
+        self.assertFalse(actual['volume'].values.flags.owndata)  # still mapped, not copied
+
+    def test_result_round_trip(self):
+        bbg_result = load_sample('sample_futures_price.json')
+        outfile = path.join(self.directory, 'result.bbgb')
+        bbg_result.to_binary_file(outfile, 'price')
+        actual = BloombergRequestResult.from_binary_file(outfile)
+        self.assertEqual(bbg_result.meta, actual.meta)
+        self.assertEqual('price', actual.converter)
+        pdt.assert_frame_equal(bbg_result.to_dataframe('price'), actual.to_dataframe())
+
+    def test_json_to_binary(self):
+        json_file = path.join(self.directory, 'sample_generic_price.json')
+        shutil.copy(path.join(DATA_DIR, 'sample_generic_price.json'), json_file)
+        binary_file = json_to_binary(json_file, converter='price')
+        self.assertEqual(path.join(self.directory, 'sample_generic_price.bbgb'), binary_file)
+        pdt.assert_frame_equal(load_sample('sample_generic_price.json').to_dataframe('price'),
+                               BloombergRequestResult.from_binary_file(binary_file).to_dataframe())
+
+    def test_not_a_binary_file(self):
+        self.assertRaises(ValueError, read_frame, path.join(DATA_DIR, 'sample_futures_price.json'))
@@ -1,5 +1,9 @@
 import datetime
+import json
+import shutil
+import tempfile
 import unittest
+from os import path
 
 import numpy as np
 import numpy.testing as npt
@@ -8,7 +12,7 @@ from collections import OrderedDict
 
 from bbgbridge.converters import price_to_frame
 from bbgbridge.result import BloombergRequestResult
-from bbgbridge.util import to_timestamp
+from bbgbridge.util import CustomJSONEncoder, to_timestamp
 
 
 def assert_dict_in_series(testcase, under_test, expected_dict):
@@ -49,12 +53,12 @@ class BloombergRequestResultTest(unittest.TestCase):
         self.assertEqual(len(df), 4)
         assert_dict_in_series(self, df.loc[0], {
             'symbol': 'SPY US Equity',
-            'date': to_timestamp('2015-08-25').date(),
+            'date': to_timestamp('2015-08-25'),
             'PX_LOW': 186.92
         })
         assert_dict_in_series(self, df.loc[3], {
             'symbol': 'SPY US Equity',
-            'date': to_timestamp('2015-08-28').date(),
+            'date': to_timestamp('2015-08-28'),
             'PX_LOW': 197.92
         })
 
@@ -113,3 +117,37 @@ class BloombergRequestResultTest(unittest.TestCase):
         # print('******* expected *******\n{}\n******* expected *******'.format(expected_json), file=sys.stderr)
         # print('******* actual *******\n{}\n******* actual *******'.format(actual_json), file=sys.stderr)
         self.assertEqual(expected_json, actual_json)
+
+    def test_write_compact_json(self):
+        directory = tempfile.mkdtemp()
+        try:
+            json_file = path.join(directory, 'result.json')
+            self.bbg_result.to_json_file(json_file, compact=True)
+            with open(json_file) as f:
+                self.assertNotIn('\n', f.read())
+            read_back = BloombergRequestResult.from_json_file(json_file)
+            self.assertEqual(json.loads(self.bbg_result.to_json()), read_back.to_dict())
+        finally:
+            shutil.rmtree(directory)
+
+
+class CustomJSONEncoderTest(unittest.TestCase):
+    def test_frame_as_split_lists(self):
+        frame = pd.DataFrame(OrderedDict([
+            ('date', pd.to_datetime(['2015-08-25', None])),
+            ('PX_LAST', [1.5, np.nan]),
+            ('VOLUME', np.array([1, 2], dtype=np.int64)),
+            ('symbol', pd.Categorical(['A', 'B'])),
+        ]))
+        self.assertEqual({
+            'columns': ['date', 'PX_LAST', 'VOLUME', 'symbol'],
+            'index': [0, 1],
+            'data': [['2015-08-25T00:00:00', 1.5, 1, 'A'], [None, None, 2, 'B']],
+        }, json.loads(json.dumps(frame, cls=CustomJSONEncoder)))
+
+    def test_series_and_numpy_values(self):
+        series = pd.Series([1.0, np.nan], index=['a', 'b'], name='PX_LAST')
+        self.assertEqual({'name': 'PX_LAST', 'index': ['a', 'b'], 'data': [1.0, None]},
+                         json.loads(json.dumps(series, cls=CustomJSONEncoder)))
+        values = [np.uint8(3), np.float32(0.5), np.datetime64('2015-08-25'), np.arange(4).reshape(2, 2)]
+        self.assertEqual([3, 0.5, '2015-08-25T00:00:00', [[0, 1], [2, 3]]], json.loads(json.dumps(values, cls=CustomJSONEncoder)))
@@ -0,0 +1,89 @@
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from collections import OrderedDict
+
+from bbgbridge.api import BloombergBridge
+from bbgbridge.cache import EVICT_TO, ResultCache, is_final_history, request_key
+from bbgbridge.fake import FakeSession, responses_by_security
+from tests.test_api import SAMPLE_RESPONSES
+
+
+def historical_request(securities, fields, end_date):
+    return OrderedDict([('HistoricalDataRequest', OrderedDict([
+        ('securities', securities), ('fields', fields), ('startDate', '20150101'), ('endDate', end_date)]))])
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.session = FakeSession(responses_by_security(SAMPLE_RESPONSES))
+        self.cache = ResultCache(self.directory)
+        self.bridge = BloombergBridge(self.session, cache=self.cache)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_request_key_is_normalized(self):
+        self.assertEqual(
+            request_key(historical_request(['SPY US Equity', 'QQQ US Equity'], ['PX_LAST', 'PX_OPEN'], '20150201')),
+            request_key(historical_request(['QQQ US Equity', 'SPY US Equity', 'QQQ US Equity'], ['PX_OPEN', 'PX_LAST'], '20150201')))
+        self.assertNotEqual(
+            request_key(historical_request(['SPY US Equity'], ['PX_LAST'], '20150201')),
+            request_key(historical_request(['SPY US Equity'], ['PX_LAST'], '20150202')))
+
+    def test_final_history(self):
+        self.assertTrue(is_final_history(historical_request(['SPY US Equity'], ['PX_LAST'], '20150201')))
+        self.assertFalse(is_final_history(historical_request(['SPY US Equity'], ['PX_LAST'], '99991231')))
+        self.assertEqual(self.cache.final_history_ttl, self.cache.ttl_for(historical_request(['A'], ['B'], '20150201')))
+        self.assertEqual(self.cache.ttls['HistoricalDataRequest'], self.cache.ttl_for(historical_request(['A'], ['B'], '99991231')))
+
+    def test_repeated_request_is_served_from_cache(self):
+        first = self.bridge.bdh(['SPY US Equity', 'QQQ US Equity'], 'PX_LAST', '2015-08-01', '2015-09-01')
+        second = self.bridge.bdh(['QQQ US Equity', 'SPY US Equity'], 'PX_LAST', '2015-08-01', '2015-09-01', meta={'again': True})
+        self.assertEqual(1, len(self.session.sent_requests))
+        self.assertEqual(first.result, second.result)
+        self.assertEqual(['QQQ US Equity', 'SPY US Equity'], second.request['HistoricalDataRequest']['securities'])
+        self.assertEqual({'again': True}, second.meta)
+        self.assertEqual({'hits': 1, 'misses': 1, 'evictions': 0}, dict(self.cache.stats()))
+
+    def test_native_dates_bypass_the_cache(self):
+        self.bridge.bdp('SPY US Equity', 'PX_LAST')
+        self.bridge.bdp('SPY US Equity', 'PX_LAST', native_dates=True)
+        self.assertEqual(2, len(self.session.sent_requests))
+        self.assertEqual(0, self.cache.hits)
+
+    def test_entry_removed_after_loading_is_still_a_hit(self):
+        res = self.bridge.bdp('SPY US Equity', 'PX_LAST')
+        with mock.patch('bbgbridge.cache.os.utime', side_effect=FileNotFoundError):
+            self.assertEqual(res.result, self.bridge.bdp('SPY US Equity', 'PX_LAST').result)
+        self.assertEqual(1, self.cache.hits)
+
+    def test_expired_entries_are_refetched(self):
+        self.cache.ttls['ReferenceDataRequest'] = -1
+        self.bridge.bdp('SPY US Equity', 'PX_LAST')
+        self.bridge.bdp('SPY US Equity', 'PX_LAST')
+        self.assertEqual(2, len(self.session.sent_requests))
+        self.assertEqual(0, self.cache.hits)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        self.bridge.bdp('SPY US Equity', 'PX_LAST')
+        self.cache.max_bytes = self.cache.size_bytes() * 3 // 2
+        self.bridge.bdp('QQQ US Equity', 'PX_LAST')
+        self.assertEqual(1, self.cache.evictions)
+        self.bridge.bdp('QQQ US Equity', 'PX_LAST')
+        self.assertEqual(1, self.cache.hits)
+        self.assertEqual(2, len(self.session.sent_requests))
+
+    def test_directory_is_scanned_only_when_full(self):
+        with mock.patch.object(self.cache, '_entries', wraps=self.cache._entries) as entries:
+            for i in range(20):
+                self.cache.put(historical_request(['SPY US Equity'], ['PX_LAST'], '2015{:04d}'.format(101 + i)), [{}])
+            self.assertEqual(0, entries.call_count)
+            self.cache.max_bytes = self.cache._size // 2
+            self.cache.put(historical_request(['QQQ US Equity'], ['PX_LAST'], '20150201'), [{}])
+            self.assertEqual(1, entries.call_count)
+        self.assertEqual(self.cache.size_bytes(), self.cache._size)
+        self.assertLessEqual(self.cache._size, self.cache.max_bytes * EVICT_TO)
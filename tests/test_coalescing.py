@@ -0,0 +1,83 @@
+import threading
+import time
+import unittest
+
+import pandas.testing as pdt
+
+from bbgbridge.api import BloombergBridge
+from bbgbridge.coalescing import CoalescingBridge
+from bbgbridge.fake import FakeSession
+from tests.test_planning import FIELDS, SYMBOLS, dataset_responder
+
+
+class CoalescingBridgeTest(unittest.TestCase):
+    def setUp(self):
+        self.session = FakeSession(dataset_responder)
+        self.bridge = BloombergBridge(self.session)
+        self.coalescer = CoalescingBridge(self.bridge, window=0.2)
+
+    def run_concurrently(self, calls):
+        results = [None] * len(calls)
+
+        def run(i, args, kwargs):
+            results[i] = self.coalescer.bdp(*args, **kwargs)
+
+        threads = [threading.Thread(target=run, args=(i, args, kwargs)) for i, (args, kwargs) in enumerate(calls)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_concurrent_calls_share_one_request(self):
+        calls = [((SYMBOLS[:3], FIELDS[:2]), {}), ((SYMBOLS[2:], FIELDS[1:3]), {'meta': {'id': 2}}), ((SYMBOLS[0], FIELDS[4]), {})]
+        results = self.run_concurrently(calls)
+        self.assertEqual(1, len(self.session.sent_requests))
+        body = self.session.sent_requests[0]['ReferenceDataRequest']
+        self.assertEqual(set(SYMBOLS), set(body['securities']))
+        self.assertEqual({FIELDS[0], FIELDS[1], FIELDS[2], FIELDS[4]}, set(body['fields']))
+        self.assertEqual({'id': 2}, results[1].meta)
+
+        for ((symbols, fields), _), res in zip(calls, results):
+            expected = self.bridge.bdp(symbols, fields).to_dataframe('refdata')
+            pdt.assert_frame_equal(expected, res.to_dataframe('refdata'))
+
+    def test_different_overrides_are_not_merged(self):
+        calls = [((SYMBOLS, FIELDS[0]), {}), ((SYMBOLS, FIELDS[0]), {'overrides': {'EQY_FUND_CRNCY': 'USD'}})]
+        self.run_concurrently(calls)
+        self.assertEqual(2, len(self.session.sent_requests))
+        self.assertEqual(2, self.coalescer.requests_sent)
+        self.assertEqual(2, self.coalescer.calls)
+
+    def test_batches_are_sent_concurrently(self):
+        self.session.latency = 0.2
+        self.coalescer.window = 0.01
+        self.run_concurrently([((SYMBOLS, FIELDS[0]), {}), ((SYMBOLS, FIELDS[0]), {'overrides': {'EQY_FUND_CRNCY': 'USD'}})])
+        self.assertEqual(2, self.session.max_outstanding)
+
+    def test_full_batch_is_sent_before_the_window_ends(self):
+        self.coalescer = CoalescingBridge(self.bridge, window=30, max_symbols=2)
+        start = time.monotonic()
+        results = self.run_concurrently([((SYMBOLS[0], FIELDS[0]), {}), ((SYMBOLS[1], FIELDS[0]), {})])
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertEqual(1, len(self.session.sent_requests))
+        self.assertEqual([[SYMBOLS[0]], [SYMBOLS[1]]], [list(res.to_dataframe('refdata')['symbol']) for res in results])
+
+    def test_errors_are_raised_in_every_caller(self):
+        self.session.responder = None  # not callable
+        errors = []
+
+        def run():
+            try:
+                self.coalescer.bdp(SYMBOLS, FIELDS)
+            except TypeError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(3, len(errors))
+        self.assertEqual(3, len({id(e) for e in errors}))
+        self.assertEqual(1, len({id(e.__cause__) for e in errors}))
@@ -0,0 +1,171 @@
+import datetime
+import unittest
+from collections import OrderedDict
+from os import path
+
+import numpy as np
+import pandas as pd
+import pandas.testing as pdt
+
+from bbgbridge.converters import (ColumnarFrameBuilder, Projection, _price_generator, bulk_data_chunks, bulk_data_to_frame,
+                                  price_to_frame, refdata_to_frame)
+from bbgbridge.result import BloombergRequestResult
+
+DATA_DIR = path.join(path.dirname(__file__), 'data')
+
+
+def load_sample(name):
+    return BloombergRequestResult.from_json_file(path.join(DATA_DIR, name))
+
+
+def price_rows_to_frame(bbg_result):
+    """ The row dict path price_to_frame used to take """
+    return pd.DataFrame(list(x for y in bbg_result.result for x in _price_generator(y, True)))
+
+
+class PriceToFrameTest(unittest.TestCase):
+    def test_matches_row_dicts(self):
+        for name in ('sample_futures_price.json', 'sample_generic_price.json'):
+            bbg_result = load_sample(name)
+            expected = price_rows_to_frame(bbg_result)
+            expected['date'] = pd.to_datetime(expected['date'])
+            expected['symbol'] = expected['symbol'].astype('category')
+            pdt.assert_frame_equal(expected, price_to_frame(bbg_result))
+
+    def test_column_types(self):
+        df = price_to_frame(load_sample('sample_futures_price.json'))
+        self.assertEqual(np.dtype('datetime64[ns]'), df['date'].dtype)
+        self.assertEqual(np.float64, df['PX_OPEN'].dtype)
+        self.assertTrue(np.isnan(df['PX_OPEN'][0]))
+        self.assertEqual('category', df['symbol'].dtype.name)
+
+    def test_missing_security_data(self):
+        bbg_result = BloombergRequestResult([{'responseError': {}}], {})
+        self.assertRaises(RuntimeError, price_to_frame, bbg_result)
+        self.assertEqual(0, len(price_to_frame(bbg_result, raise_on_missing=False)))
+
+
+class DateConversionTest(unittest.TestCase):
+    def setUp(self):
+        rows = [OrderedDict([('date', datetime.date(2015, 8, 25 + i)), ('PX_LAST', 100.0 + i)]) for i in range(3)]
+        self.bbg_result = BloombergRequestResult(
+            [{'securityData': OrderedDict([('security', 'SPY US Equity'), ('fieldData', [{'fieldData': x} for x in rows])])}], {})
+
+    def test_dates_are_converted_once_per_column(self):
+        df = price_to_frame(self.bbg_result)
+        self.assertEqual(np.dtype('datetime64[ns]'), df['date'].dtype)
+        self.assertEqual(pd.Timestamp('2015-08-27'), df['date'][2])
+
+    def test_native_dates(self):
+        df = self.bbg_result.to_dataframe('price_native_dates')
+        self.assertEqual([datetime.date(2015, 8, 25 + i) for i in range(3)], list(df['date']))
+
+    def test_native_datetimes_are_kept(self):
+        builder = ColumnarFrameBuilder(native_dates=True)
+        builder.add_rows([{'time': datetime.datetime(2015, 8, 25, 9, 30), 'value': 1.5}], 'SPY US Equity')
+        df = builder.to_frame()
+        self.assertEqual(['time', 'value', 'symbol'], list(df.columns))
+        self.assertIs(datetime.datetime, type(df['time'][0]))
+
+    def test_refdata_date_fields(self):
+        bbg_result = BloombergRequestResult(
+            [[{'securityData': OrderedDict([
+                ('security', 'ESZ5 Index'),
+                ('fieldData', {'fieldData': OrderedDict([('LAST_TRADEABLE_DT', datetime.date(2015, 12, 18)), ('NAME', 'S&P500 EMINI')])})])}]],
+            {'ReferenceDataRequest': {'fields': ['LAST_TRADEABLE_DT', 'NAME']}})
+        self.assertEqual(np.dtype('datetime64[ns]'), refdata_to_frame(bbg_result)['LAST_TRADEABLE_DT'].dtype)
+        self.assertEqual(datetime.date(2015, 12, 18), refdata_to_frame(bbg_result, native_dates=True)['LAST_TRADEABLE_DT'][0])
+
+
+def bulk_message(security, **fields):
+    return {'securityData': OrderedDict([
+        ('security', security),
+        ('fieldData', {'fieldData': OrderedDict(
+            (field, [{field: OrderedDict(row)} for row in rows] if isinstance(rows, list) else rows)
+            for field, rows in fields.items())})])}
+
+
+class BulkDataToFrameTest(unittest.TestCase):
+    def setUp(self):
+        self.bbg_result = BloombergRequestResult([
+            [bulk_message('SPX Index',
+                          INDX_MEMBERS=[[('Member Ticker and Exchange Code', 'AAPL UW')], [('Member Ticker and Exchange Code', 'MSFT UW')]],
+                          DVD_HIST_ALL=[[('Ex-Date', datetime.date(2015, 8, 3)), ('Dividend Amount', 1.1)]]),
+             bulk_message('INDU Index',
+                          INDX_MEMBERS=[[('Member Ticker and Exchange Code', 'IBM UN')]],
+                          DVD_HIST_ALL=[],
+                          NAME='DOW JONES INDUS. AVG')]],
+            {'ReferenceDataRequest': {'securities': ['SPX Index', 'INDU Index'], 'fields': ['INDX_MEMBERS', 'DVD_HIST_ALL', 'NAME']}})
+
+    def test_single_field(self):
+        bbg_result = BloombergRequestResult(
+            [[bulk_message('INDU Index', INDX_MEMBERS=[[('Member Ticker and Exchange Code', 'IBM UN'), ('Weight', 3)]])]],
+            {'ReferenceDataRequest': {'fields': ['INDX_MEMBERS']}})
+        df = bbg_result.to_dataframe('bulk_data')
+        self.assertEqual(['field', 'symbol', 'Member Ticker and Exchange Code', 'Weight'], list(df.columns))
+        self.assertEqual(np.dtype('int64'), df['Weight'].dtype)
+
+    def test_many_fields(self):
+        df = bulk_data_to_frame(self.bbg_result)
+        self.assertEqual(['field', 'symbol', 'Member Ticker and Exchange Code', 'Ex-Date', 'Dividend Amount'], list(df.columns))
+        self.assertEqual(['INDX_MEMBERS'] * 3 + ['DVD_HIST_ALL'], list(df['field']))
+        self.assertEqual(['SPX Index', 'SPX Index', 'INDU Index', 'SPX Index'], list(df['symbol']))
+        self.assertEqual(['INDX_MEMBERS', 'DVD_HIST_ALL'], list(df['field'].cat.categories))
+        self.assertEqual(pd.Timestamp('2015-08-03'), df['Ex-Date'][3])
+        self.assertTrue(np.isnan(df['Dividend Amount'][0]))
+
+    def test_chunks_per_security(self):
+        chunks = list(bulk_data_chunks(self.bbg_result))
+        self.assertEqual([['SPX Index'], ['INDU Index']], [list(x['symbol'].unique()) for x in chunks])
+        self.assertEqual(4, sum(len(x) for x in chunks))
+
+
+class ProjectionTest(unittest.TestCase):
+    def setUp(self):
+        self.prices = BloombergRequestResult([
+            {'securityData': OrderedDict([('security', symbol), ('fieldData', [
+                {'fieldData': OrderedDict([('date', datetime.date(2015, 8, 25 + i)), ('PX_LAST', 100.0 + i), ('VOLUME', 10 + i)])}
+                for i in range(4)])])}
+            for symbol in ('SPY US Equity', 'QQQ US Equity')], {}, converter='price')
+
+    def test_price_columns_symbols_and_dates(self):
+        df = price_to_frame(self.prices, projection=Projection(['PX_LAST'], ['QQQ US Equity'], '2015-08-26', '2015-08-27'))
+        self.assertEqual(['date', 'PX_LAST', 'symbol'], list(df.columns))
+        self.assertEqual([pd.Timestamp('2015-08-26'), pd.Timestamp('2015-08-27')], list(df['date']))
+        self.assertEqual(['QQQ US Equity'] * 2, list(df['symbol']))
+
+    def test_pushed_down_matches_projected_frame(self):
+        projection = Projection(['VOLUME'], ['SPY US Equity'], start='2015-08-27')
+        expected = projection.apply(price_to_frame(self.prices))
+        actual = price_to_frame(self.prices, projection=projection)
+        self.assertEqual(list(expected.columns), list(actual.columns))
+        self.assertEqual(list(expected['VOLUME']), list(actual['VOLUME']))
+        self.assertEqual(list(expected['date']), list(actual['date']))
+
+    def test_refdata_keeps_requested_order(self):
+        bbg_result = BloombergRequestResult(
+            [[{'securityData': OrderedDict([
+                ('security', symbol),
+                ('fieldData', {'fieldData': OrderedDict([
+                    ('NAME', symbol), ('PX_LAST', 1.5), ('LAST_TRADEABLE_DT', datetime.date(2015, 12, 18))])})])}
+              for symbol in ('ESZ5 Index', 'NQZ5 Index')]],
+            {'ReferenceDataRequest': {'fields': ['LAST_TRADEABLE_DT', 'PX_LAST', 'NAME']}})
+        df = refdata_to_frame(bbg_result, projection=Projection(['NAME', 'LAST_TRADEABLE_DT'], ['NQZ5 Index']))
+        self.assertEqual(['symbol', 'error_category', 'error_message', 'LAST_TRADEABLE_DT', 'NAME'], list(df.columns))
+        self.assertEqual(['NQZ5 Index'], list(df['NAME']))
+        self.assertEqual(np.dtype('datetime64[ns]'), df['LAST_TRADEABLE_DT'].dtype)
+        self.assertEqual(['symbol', 'error_category', 'error_message', 'LAST_TRADEABLE_DT', 'PX_LAST', 'NAME'],
+                         list(refdata_to_frame(bbg_result).columns))
+
+    def test_function_converters_are_projected_once_converted(self):
+        df = self.prices.to_dataframe(price_to_frame, columns='PX_LAST', end='2015-08-25')
+        self.assertEqual(['date', 'PX_LAST', 'symbol'], list(df.columns))
+        self.assertEqual(2, len(df))
+        self.assertEqual([0, 1], list(df.index))
+
+    def test_frames_are_memoized(self):
+        self.assertIs(self.prices.to_dataframe(), self.prices.to_dataframe())
+        projected = self.prices.to_dataframe(symbols='SPY US Equity')
+        self.assertIs(projected, self.prices.to_dataframe(symbols=['SPY US Equity']))
+        self.assertIsNot(projected, self.prices.to_dataframe())
+        self.assertEqual(4, len(projected))
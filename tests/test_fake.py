@@ -0,0 +1,58 @@
+import time
+import unittest
+
+from bbgbridge.api import BloombergBridge
+from bbgbridge.fake import FakeSession, recorded_responder, scale_messages
+from tests.test_converters import load_sample
+from tests.test_planning import FIELDS, SYMBOLS, dataset_responder
+
+
+class FakeSessionLatencyTest(unittest.TestCase):
+    def test_latency(self):
+        bridge = BloombergBridge(FakeSession(dataset_responder, latency=0.1, message_latency=0.05))
+        start = time.monotonic()
+        bridge.bdh(SYMBOLS[:3], FIELDS, '2015-08-03', '2015-08-31')
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    def test_concurrent_requests_wait_together(self):
+        bridge = BloombergBridge(FakeSession(dataset_responder, latency=0.2))
+        requests = [bridge.create_request('ReferenceDataRequest', [symbol], FIELDS) for symbol in SYMBOLS]
+        start = time.monotonic()
+        bridge.send_requests(requests)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+
+class RecordedResponderTest(unittest.TestCase):
+    def setUp(self):
+        self.price = load_sample('sample_generic_price.json')
+        self.refdata = load_sample('sample_generic_refdata.json')
+
+    def test_replays_historical_data(self):
+        bridge = BloombergBridge(FakeSession(recorded_responder(self.price.result)))
+        frame = bridge.bdh(['EVU5P 2000 Index', 'EVU5P 2005 Index'], ['PX_LAST', 'PX_SETTLE'], '2015-01-01', '2015-12-31').to_dataframe('price')
+        expected = self.price.to_dataframe('price')
+        self.assertEqual({'date', 'PX_LAST', 'PX_SETTLE', 'symbol'}, set(frame.columns))
+        self.assertEqual(len(expected), len(frame))
+        self.assertEqual(expected['PX_LAST'].sum(), frame['PX_LAST'].sum())
+
+    def test_filters_dates_and_chunks(self):
+        session = FakeSession(recorded_responder(scale_messages(self.price.result, rows=3), chunk_size=2))
+        res = BloombergBridge(session).bdh('EVU5P 2000 Index', 'PX_LAST', '2015-08-20', '2015-08-20')
+        self.assertEqual(3, len(res.to_dataframe('price')))
+        self.assertEqual(2, len(res.result))
+
+    def test_replays_reference_data(self):
+        session = FakeSession(recorded_responder(self.refdata.result, chunk_size=1))
+        frame = BloombergBridge(session).bdp(['ARVAM3UY Index', 'AUPPFMOM Index', 'XXX Index'], ['PX_LAST', 'NAME']).to_dataframe('refdata')
+        self.assertEqual(['ARVAM3UY Index', 'AUPPFMOM Index', 'XXX Index'], frame['symbol'].tolist())
+        self.assertEqual('BAD_SEC', frame['error_category'].iloc[2])
+        self.assertNotIn('LONG_COMP_NAME', frame.columns)
+
+    def test_scale_messages(self):
+        scaled = scale_messages(self.refdata.result, securities=10)
+        self.assertEqual(20, len(scaled))
+        self.assertEqual('ARVAM3UY Index 9', scaled[-2][0]['securityData']['security'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import shutil
+import tempfile
+import time
+import unittest
+from collections import OrderedDict
+from os import path
+
+from bbgbridge.api import BloombergBridge
+from bbgbridge.fake import FakeSession
+from bbgbridge.instruments import InstrumentIndex, yellow_key
+
+INSTRUMENTS = OrderedDict([
+    ('IBM US<equity>', 'International Business Machines Corp'),
+    ('IBM LN<equity>', 'International Business Machines Corp'),
+    ('IBMA US<equity>', 'IBM Amex'),
+    ('IBM 4 06/20/42<corp>', 'IBM 4 06/20/42'),
+    ('INDU<index>', 'Dow Jones Industrial Average'),
+])
+
+
+def instrument_responder(req_object):
+    body = req_object['instrumentListRequest']
+    wanted = {'YK_FILTER_EQTY': 'equity', 'YK_FILTER_CORP': 'corp'}.get(body.get('yellowKeyFilter'))
+    found = [(security, description) for security, description in INSTRUMENTS.items()
+             if security.upper().startswith(body['query'].upper()) and (wanted is None or yellow_key(security) == wanted)]
+    return [{'results': [{'results': OrderedDict([('security', s), ('description', d)])}
+                         for s, d in found[:body['maxResults']]]}]
+
+
+class InstrumentIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.session = FakeSession(instrument_responder)
+        self.index = InstrumentIndex(BloombergBridge(self.session), max_results=10)
+
+    def test_repeat_and_narrower_queries_are_local(self):
+        self.assertEqual(4, len(self.index.resolve('IBM')['IBM']))
+        self.assertEqual(1, len(self.session.sent_requests))
+
+        start = time.perf_counter()
+        found = self.index.resolve(['IBM', 'ibm us', 'IBMA'])
+        self.assertLess(time.perf_counter() - start, 0.01)
+        self.assertEqual(1, len(self.session.sent_requests))
+        self.assertEqual([('IBM US<equity>', 'International Business Machines Corp')], found['ibm us'])
+        self.assertEqual(['IBMA US<equity>'], [s for s, _ in found['IBMA']])
+
+    def test_misses_are_looked_up_together(self):
+        found = self.index.resolve(['IBM', 'INDU', 'XYZ'], key_filter='YK_FILTER_EQTY')
+        self.assertEqual(3, len(self.session.sent_requests))
+        self.assertEqual(3, self.session.max_outstanding)
+        self.assertEqual(['IBM LN<equity>', 'IBM US<equity>', 'IBMA US<equity>'], sorted(s for s, _ in found['IBM']))
+        self.assertEqual([], found['XYZ'])
+        self.assertEqual({'YK_FILTER_EQTY'}, {x['instrumentListRequest']['yellowKeyFilter'] for x in self.session.sent_requests})
+
+    def test_truncated_lookups_do_not_cover_longer_queries(self):
+        self.index.max_results = 2
+        self.assertEqual(2, len(self.index.resolve('IBM')['IBM']))
+        self.index.resolve('IBM')
+        self.assertEqual(1, len(self.session.sent_requests))
+        self.index.resolve('IBM L')
+        self.assertEqual(2, len(self.session.sent_requests))
+
+    def test_search_and_filters(self):
+        self.index.resolve('I')
+        self.assertEqual(['IBM 4 06/20/42<corp>'], [s for s, _ in self.index.search('ibm', 'YK_FILTER_CORP')])
+        self.assertEqual(2, len(self.index.search('IBM', limit=2)))
+        self.assertEqual(5, len(self.index.to_frame()))
+        self.assertEqual(1, len(self.session.sent_requests))
+
+    def test_refresh_and_persistence(self):
+        directory = tempfile.mkdtemp()
+        try:
+            index_file = path.join(directory, 'instruments.pickle')
+            index = InstrumentIndex(BloombergBridge(self.session), index_file=index_file)
+            index.resolve('IBM')
+            self.assertEqual(0, index.refresh())
+            self.assertEqual(1, index.refresh(max_age=0))
+            self.assertEqual(2, len(self.session.sent_requests))
+
+            reloaded = InstrumentIndex(BloombergBridge(self.session), index_file=index_file)
+            self.assertEqual(4, len(reloaded.resolve('IBM')['IBM']))
+            self.assertEqual(2, len(self.session.sent_requests))
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import datetime
+import shutil
+import tempfile
+import unittest
+from collections import OrderedDict
+from os import path
+
+import numpy as np
+import pandas as pd
+
+from bbgbridge.loading import concat_frames, iter_json_batches, iter_json_frames, json_result_files, read_json_results
+from bbgbridge.result import BloombergRequestResult
+
+
+def price_result(symbol, fields, days=3):
+    rows = [OrderedDict([('date', datetime.date(2015, 8, 25 + i))] + [(f, 100.0 + i) for f in fields]) for i in range(days)]
+    security_data = OrderedDict([('security', symbol), ('fieldData', [{'fieldData': x} for x in rows])])
+    return BloombergRequestResult([{'securityData': security_data}],
+                                  {'HistoricalDataRequest': {'securities': [symbol], 'fields': fields}}, converter='price')
+
+
+class JsonLoaderTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        price_result('SPY US Equity', ['PX_LAST', 'VOLUME']).to_json_file(path.join(self.directory, 'a.json'))
+        price_result('QQQ US Equity', ['PX_LAST']).to_json_file(path.join(self.directory, 'b.json'))
+        price_result('IWM US Equity', ['PX_LAST', 'VOLUME'], days=2).to_json_file(path.join(self.directory, 'c.json'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_files_of_directory_or_glob(self):
+        self.assertEqual(['a.json', 'b.json', 'c.json'], [path.basename(x) for x in json_result_files(self.directory)])
+        self.assertEqual(['b.json'], [path.basename(x) for x in json_result_files(path.join(self.directory, 'b*.json'))])
+
+    def test_read_in_process_and_in_pool(self):
+        for processes in (1, 2):
+            df = read_json_results(self.directory, processes=processes)
+            self.assertEqual(8, len(df))
+            self.assertEqual(['date', 'PX_LAST', 'VOLUME', 'symbol'], list(df.columns))
+            self.assertEqual(['SPY US Equity'] * 3 + ['QQQ US Equity'] * 3 + ['IWM US Equity'] * 2, list(df['symbol']))
+            self.assertEqual(np.dtype('datetime64[ns]'), df['date'].dtype)
+            self.assertEqual({'SPY US Equity', 'QQQ US Equity', 'IWM US Equity'}, set(df['symbol'].cat.categories))
+            self.assertTrue(df['VOLUME'][3:6].isnull().all())
+
+    def test_frames_stream_in_order(self):
+        frames = iter_json_frames(self.directory, processes=2, max_pending=1, columns='PX_LAST')
+        self.assertEqual(['a.json', 'b.json', 'c.json'], [path.basename(x) for x, _ in frames])
+        batches = list(iter_json_batches(self.directory, batch_size=2, processes=1, symbols='SPY US Equity'))
+        self.assertEqual([3, 0], [len(x) for x in batches])
+
+    def test_bad_file_names_the_file(self):
+        with open(path.join(self.directory, 'd.json'), 'w') as f:
+            f.write('{')
+        with self.assertRaisesRegex(RuntimeError, 'd.json'):
+            read_json_results(self.directory, processes=1)
+
+    def test_concat_keeps_dtypes(self):
+        first = pd.DataFrame({'time': pd.to_datetime(['2015-08-25 09:30']), 'symbol': pd.Categorical(['A'])})
+        second = pd.DataFrame({'symbol': pd.Categorical(['B', 'A']), 'value': [1.0, 2.0]})
+        df = concat_frames([first, pd.DataFrame({'symbol': []}), second])
+        self.assertEqual(['time', 'symbol', 'value'], list(df.columns))
+        self.assertEqual(np.dtype('datetime64[ns]'), df['time'].dtype)
+        self.assertEqual(['A', 'B'], list(df['symbol'].cat.categories))
+        self.assertEqual([0, 1, 2], list(df.index))
@@ -0,0 +1,56 @@
+import unittest
+
+from bbgbridge import metrics
+from bbgbridge.api import BloombergBridge
+from bbgbridge.fake import FakeSession
+from tests.test_planning import FIELDS, SYMBOLS, dataset_responder
+
+
+class RequestMetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.bridge = BloombergBridge(FakeSession(dataset_responder))
+        self.recorder = metrics.enable()
+
+    def tearDown(self):
+        metrics.disable()
+
+    def test_disabled_records_nothing(self):
+        metrics.disable()
+        self.bridge.bdh(SYMBOLS, FIELDS, '2015-08-03', '2015-08-31').to_dataframe('price')
+        self.assertEqual([], self.recorder.records())
+        self.assertEqual('\n', self.recorder.snapshot())
+
+    def test_request_records(self):
+        self.bridge.bdh(SYMBOLS[:3], FIELDS, '2015-08-03', '2015-08-31')
+        self.bridge.bdp(SYMBOLS, FIELDS[0])
+        historical, reference = self.recorder.records()
+        self.assertEqual('HistoricalDataRequest', historical['request_type'])
+        self.assertEqual(2, historical['partial_responses'])
+        self.assertEqual(3, historical['messages'])
+        self.assertGreater(historical['elements'], 3 * 21 * 2)
+        self.assertLessEqual(historical['time_to_first_message'], historical['latency'])
+        self.assertEqual('ReferenceDataRequest', reference['request_type'])
+        self.assertEqual(0, reference['partial_responses'])
+
+    def test_streamed_frame_is_built_once(self):
+        request = self.bridge.create_request('HistoricalDataRequest', SYMBOLS[:3], FIELDS,
+                                             modifiers={'startDate': '20150803', 'endDate': '20150831'})
+        res = self.bridge.send_request(request, stream=True)
+        record, = self.recorder.records()
+        self.assertIs(res.frame, res.to_dataframe())
+        self.assertGreaterEqual(record['elements'], res.frame.size)
+
+    def test_snapshot(self):
+        self.bridge.bdh(SYMBOLS[:3], FIELDS, '2015-08-03', '2015-08-31').to_dataframe('price')
+        self.bridge.bdh(SYMBOLS[3:], FIELDS, '2015-08-03', '2015-08-31').to_dataframe('price')
+        lines = self.recorder.snapshot().splitlines()
+        self.assertIn('# TYPE bbgbridge_request_latency_seconds summary', lines)
+        self.assertIn('bbgbridge_request_latency_seconds_count{request_type="HistoricalDataRequest"} 2', lines)
+        self.assertIn('bbgbridge_partial_responses_total{request_type="HistoricalDataRequest"} 3', lines)
+        self.assertIn('bbgbridge_messages_total{request_type="HistoricalDataRequest"} 5', lines)
+        self.assertIn('bbgbridge_conversion_seconds_count{request_type="HistoricalDataRequest",converter="price"} 2', lines)
+        self.assertEqual(1, lines.count('# TYPE bbgbridge_request_latency_seconds summary'))
+
+
+if __name__ == '__main__':
+    unittest.main()
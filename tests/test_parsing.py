@@ -0,0 +1,70 @@
+import datetime
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from bbgbridge.fake import FakeElement, FakeMessage
+from bbgbridge.parsing import CompiledParser, parse_message
+from tests.test_api import SAMPLE_RESPONSES
+from tests.test_converters import load_sample
+
+
+def sample_messages():
+    messages = [FakeMessage(msg, message_type='HistoricalDataResponse') for x in SAMPLE_RESPONSES.values() for msg in x]
+    messages += [FakeMessage(msg, message_type='HistoricalDataResponse')
+                 for name in ('sample_futures_price.json', 'sample_generic_price.json')
+                 for msg in load_sample(name).result]
+    messages += [FakeMessage(msg, message_type='ReferenceDataResponse')
+                 for name in ('sample_futures_refdata.json', 'sample_generic_refdata.json')
+                 for msg in load_sample(name).result]
+    return messages
+
+
+class CompiledParserTest(unittest.TestCase):
+    def test_same_output_as_parse_message(self):
+        parser = CompiledParser()
+        for _ in range(2):  # the second time round with the plans compiled
+            for msg in sample_messages():
+                self.assertEqual(parse_message(msg), parser.parse_message(msg))
+
+    def test_plans_are_cached_per_message_type(self):
+        parser = CompiledParser()
+        for msg in sample_messages():
+            parser.parse_message(msg)
+        self.assertEqual(2, len(parser._plans))
+
+    def test_children_are_only_looked_up_by_name(self):
+        parser = CompiledParser()
+        messages = sample_messages()
+        for msg in messages:
+            parser.parse_message(msg)
+
+        lookups = {}
+        patches = [mock.patch.object(FakeElement, name, autospec=True, side_effect=getattr(FakeElement, name))
+                   for name in ('elementDefinition', 'isArray', 'datatype')]
+        for patch in patches:
+            lookups[patch.attribute] = patch.start()
+            self.addCleanup(patch.stop)
+        for msg in messages:
+            parser.parse_message(msg)
+        # the message and its choice only, not their children
+        self.assertEqual(len(messages), lookups['elementDefinition'].call_count)
+        self.assertEqual(2 * len(messages), lookups['isArray'].call_count)
+        self.assertEqual(2 * len(messages), lookups['datatype'].call_count)
+
+    def test_native_dates(self):
+        msg = FakeMessage({'securityData': {'security': 'SPY US Equity', 'fieldData': [
+            {'fieldData': {'date': datetime.date(2015, 8, 25), 'PX_LAST': 187.27}}]}}, message_type='HistoricalDataResponse')
+        row = CompiledParser(convert_datetime=False).parse_message(msg)['securityData']['fieldData'][0]['fieldData']
+        self.assertIs(datetime.date, type(row['date']))
+        self.assertEqual(pd.Timestamp('2015-08-25'), parse_message(msg)['securityData']['fieldData'][0]['fieldData']['date'])
+
+    def test_single_and_array_shapes_of_the_same_element(self):
+        parser = CompiledParser()
+        security_data = {'security': 'ESZ5 Index', 'fieldData': {'fieldData': {'NAME': 'S&P500 EMINI'}}}
+        single = FakeMessage({'securityData': security_data}, message_type='ReferenceDataResponse')
+        array = FakeMessage([{'securityData': security_data}, {'securityData': security_data}], message_type='ReferenceDataResponse')
+        for msg in (single, array, single):
+            self.assertEqual(parse_message(msg), parser.parse_message(msg))
+        self.assertIsInstance(parser.parse_message(array), list)
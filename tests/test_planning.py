@@ -0,0 +1,145 @@
+import json
+import unittest
+
+import pandas as pd
+import pandas.testing as pdt
+from collections import OrderedDict
+
+from bbgbridge.api import BloombergBridge
+from bbgbridge.fake import FakeSession
+from bbgbridge.planning import ChunkPlan, chunked, split_date_range
+from bbgbridge.result import BloombergRequestResult
+from bbgbridge.util import to_timestamp
+
+SYMBOLS = ['SPY US Equity', 'QQQ US Equity', 'IWM US Equity', 'ESZ5 Index', 'CLZ5 Comdty']
+FIELDS = ['PX_OPEN', 'PX_HIGH', 'PX_LOW', 'PX_LAST', 'PX_VOLUME']
+DATES = pd.bdate_range('2015-08-03', '2015-09-30')
+
+
+def field_value(symbol, field, date):
+    # leave some holes so that not every field is available on every date
+    if (len(symbol) + len(field) + date.day) % 7 == 0:
+        return None
+    return float(len(symbol) * 100 + FIELDS.index(field) + date.day / 100.0)
+
+
+def dataset_responder(req_object):
+    """ Answers requests like Bloomberg would, from a made up dataset """
+    (request_type, body), = req_object.items()
+    fields = body['fields']
+    if request_type == 'ReferenceDataRequest':
+        date = DATES[-1]
+        return [[{'securityData': OrderedDict([
+            ('security', symbol),
+            ('eidData', []),
+            ('fieldExceptions', []),
+            ('sequenceNumber', i),
+            ('fieldData', {'fieldData': OrderedDict(
+                (f, field_value(symbol, f, date)) for f in fields if field_value(symbol, f, date) is not None)})])}
+            for i, symbol in enumerate(body['securities'])]]
+
+    start, end = to_timestamp(body['startDate']), to_timestamp(body['endDate'])
+    messages = []
+    for i, symbol in enumerate(body['securities']):
+        rows = []
+        for date in DATES[(DATES >= start) & (DATES <= end)]:
+            values = [(f, field_value(symbol, f, date)) for f in fields]
+            values = [(f, v) for f, v in values if v is not None]
+            if values:
+                rows.append({'fieldData': OrderedDict([('date', date)] + values)})
+        messages.append({'securityData': OrderedDict([
+            ('security', symbol), ('eidData', []), ('sequenceNumber', i), ('fieldExceptions', []), ('fieldData', rows)])})
+    return messages
+
+
+class ChunkPlanTest(unittest.TestCase):
+    def test_chunked(self):
+        self.assertEqual([[1, 2], [3, 4], [5]], chunked([1, 2, 3, 4, 5], 2))
+        self.assertEqual([[1, 2, 3]], chunked([1, 2, 3]))
+
+    def test_split_date_range(self):
+        self.assertEqual(
+            [(to_timestamp('2015-01-01'), to_timestamp('2015-01-10')),
+             (to_timestamp('2015-01-11'), to_timestamp('2015-01-20')),
+             (to_timestamp('2015-01-21'), to_timestamp('2015-01-25'))],
+            split_date_range('2015-01-01', '2015-01-25', 10))
+        self.assertEqual([('2015-01-01', '2015-01-25')], split_date_range('2015-01-01', '2015-01-25'))
+
+    def test_historical_chunks_dedupes_symbols(self):
+        chunks = ChunkPlan(symbols_per_request=2).historical_chunks(['A', 'B', 'A', 'C'], 'PX_LAST', '20150101', '20150201')
+        self.assertEqual([['A', 'B'], ['C']], [symbols for symbols, _, _, _ in chunks])
+
+    def test_date_split_only_for_daily(self):
+        plan = ChunkPlan(days_per_request=30)
+        self.assertRaises(ValueError, plan.historical_chunks, SYMBOLS, FIELDS, '20150101', '20150601', 'WEEKLY')
+
+
+class ChunkedRequestTest(unittest.TestCase):
+    def setUp(self):
+        self.session = FakeSession(dataset_responder)
+        self.bridge = BloombergBridge(self.session)
+        self.plan = ChunkPlan(symbols_per_request=2, fields_per_request=2, days_per_request=20, max_in_flight=4)
+
+    def test_chunked_historical_data_matches_unchunked(self):
+        expected = self.bridge.bdh(SYMBOLS, FIELDS, '2015-08-01', '2015-09-30').to_dataframe('price')
+        self.assertEqual(1, len(self.session.sent_requests))
+
+        res = self.bridge.bdh(SYMBOLS, FIELDS, '2015-08-01', '2015-09-30', chunk_plan=self.plan, meta={'id': 1})
+        self.assertEqual(1 + 3 * 3 * 4, len(self.session.sent_requests))
+        self.assertEqual(4, self.session.max_outstanding)
+        self.assertEqual({'id': 1}, res.meta)
+        self.assertEqual(SYMBOLS, res.request['HistoricalDataRequest']['securities'])
+        self.assertEqual('20150801', res.request['HistoricalDataRequest']['startDate'])
+        pdt.assert_frame_equal(expected, res.to_dataframe('price'))
+
+    def test_chunked_reference_data_matches_unchunked(self):
+        expected = self.bridge.bdp(SYMBOLS, FIELDS).to_dataframe('refdata')
+        self.bridge.chunk_plan = self.plan
+        actual = self.bridge.bdp(SYMBOLS, FIELDS).to_dataframe('refdata')
+        self.assertEqual(1 + 3 * 3, len(self.session.sent_requests))
+        pdt.assert_frame_equal(expected, actual)
+
+
+def override_responder(req_object):
+    """ dataset_responder, with the SETTLE_DT override added to every value """
+    body = req_object['ReferenceDataRequest']
+    overrides = {x['overrides']['fieldId']: x['overrides']['value'] for x in body.get('overrides', [])}
+    messages = dataset_responder(req_object)
+    for y in messages[0]:
+        field_data = y['securityData']['fieldData']['fieldData']
+        for field in field_data:
+            field_data[field] += float(overrides.get('SETTLE_DT', '0')[-1:] or 0)
+    return messages
+
+
+class OverrideSweepTest(unittest.TestCase):
+    def setUp(self):
+        self.session = FakeSession(override_responder)
+        self.bridge = BloombergBridge(self.session, chunk_plan=ChunkPlan(symbols_per_request=2))
+
+    def test_sweep(self):
+        override_sets = [{'SETTLE_DT': '20150901'}, {'SETTLE_DT': '20150902'}, {'SETTLE_DT': '20150901'}]
+        res = self.bridge.request_reference_sweep(SYMBOLS, FIELDS[:2], override_sets, overrides={'PX_BID': 100})
+        self.assertEqual(2 * 3, len(self.session.sent_requests))
+        self.assertEqual([{'PX_BID': 100, 'SETTLE_DT': '20150901'}, {'PX_BID': 100, 'SETTLE_DT': '20150902'}], res.meta['override_sets'])
+
+        frame = res.to_dataframe()
+        self.assertEqual(['PX_BID', 'SETTLE_DT', 'symbol'], list(frame.index.names))
+        self.assertEqual(2 * len(SYMBOLS), len(frame))
+        first = frame.loc[(100, '20150901', SYMBOLS[0]), FIELDS[0]]
+        second = frame.loc[(100, '20150902', SYMBOLS[0]), FIELDS[0]]
+        self.assertEqual(1.0, second - first)
+
+        expected = self.bridge.bdp(SYMBOLS, FIELDS[:2], overrides={'PX_BID': 100, 'SETTLE_DT': '20150902'}).to_dataframe('refdata')
+        pdt.assert_frame_equal(expected.set_index('symbol'), frame.xs((100, '20150902')), check_names=False)
+
+    def test_refdata_converter_keeps_the_override_sets(self):
+        override_sets = [{'SETTLE_DT': '20150901'}, {'SETTLE_DT': '20150902'}]
+        res = self.bridge.request_reference_sweep(SYMBOLS, FIELDS[:2], override_sets)
+        pdt.assert_frame_equal(res.to_dataframe(), res.to_dataframe('refdata'))
+        pdt.assert_frame_equal(res.to_dataframe(), BloombergRequestResult.from_dict(json.loads(res.to_json())).to_dataframe())
+        self.assertEqual(2 * 2, len(res.to_dataframe('refdata', symbols=SYMBOLS[:2])))
+
+    def test_single_request(self):
+        res = BloombergBridge(self.session).request_reference_sweep(SYMBOLS[0], FIELDS[0], [{'SETTLE_DT': '20150901'}])
+        self.assertEqual(['SETTLE_DT', 'symbol'], list(res.to_dataframe().index.names))
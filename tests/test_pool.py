@@ -0,0 +1,99 @@
+import threading
+import time
+import unittest
+
+from bbgbridge.api import BloombergBridge, SessionTerminatedError
+from bbgbridge.fake import FakeSession, responses_by_security
+from bbgbridge.pool import SessionPool
+from tests.test_api import SAMPLE_RESPONSES
+
+
+class SessionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.sessions = []
+        self.pool = SessionPool(2, self.create_session)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def create_session(self):
+        session = FakeSession(responses_by_security(SAMPLE_RESPONSES))
+        self.sessions.append(session)
+        return session
+
+    def test_sessions_are_prestarted_and_services_opened_lazily(self):
+        self.assertEqual(2, len(self.sessions))
+        self.assertTrue(all(session.started for session in self.sessions))
+        self.assertEqual([], self.sessions[0].opened_services)
+        self.pool.bdp('SPY US Equity', 'PX_LAST')
+        self.assertEqual(['//blp/refdata'], [x for session in self.sessions for x in session.opened_services])
+
+    def test_bridges_are_reused(self):
+        with self.pool as pool:
+            for _ in range(3):
+                with pool.bridge() as bridge:
+                    bridge.bdp('SPY US Equity', 'PX_LAST')
+        self.assertEqual(2, len(self.sessions))
+        self.assertEqual(3, sum(len(session.sent_requests) for session in self.sessions))
+
+    def test_terminated_idle_session_is_replaced(self):
+        for session in self.sessions:
+            session.terminate()
+        res = self.pool.bdp('SPY US Equity', 'PX_LAST')
+        self.assertEqual(SAMPLE_RESPONSES['SPY US Equity'][0], res.result[0])
+        self.assertEqual(3, len(self.sessions))
+        self.assertEqual(2, self.pool.reconnects)
+
+    def test_request_is_retried_when_session_goes_down(self):
+        with self.pool.bridge() as bridge:
+            pass  # the next request goes to the most recently used bridge
+
+        def terminating_responder(req_object):
+            bridge.session.terminate()
+            return SAMPLE_RESPONSES['SPY US Equity']
+        bridge.session.responder = terminating_responder
+
+        res = self.pool.bdh('SPY US Equity', 'PX_LAST', '2015-08-01', '2015-09-01')
+        self.assertEqual(SAMPLE_RESPONSES['SPY US Equity'], res.result)
+        self.assertFalse(bridge.alive)
+        self.assertEqual(1, self.pool.reconnects)
+
+    def test_retries_exhausted(self):
+        self.pool.retries = 0
+        with self.pool.bridge() as bridge:
+            bridge.session.responder = lambda req_object: bridge.session.terminate() or SAMPLE_RESPONSES['SPY US Equity']
+        self.assertRaises(SessionTerminatedError, self.pool.bdp, 'SPY US Equity', 'PX_LAST')
+
+    def test_acquire_times_out(self):
+        with self.pool.bridge(), self.pool.bridge():
+            with self.assertRaisesRegex(TimeoutError, '2 bridges'):
+                self.pool.acquire(timeout=0.05)
+
+    def test_concurrent_acquires_create_at_most_size_bridges(self):
+        def create_slowly():
+            time.sleep(0.05)
+            return self.create_session()
+
+        self.pool.close()
+        self.sessions = []
+        self.pool = SessionPool(2, create_slowly, prestart=False)
+
+        def run():
+            with self.pool.bridge(timeout=5):
+                time.sleep(0.01)
+
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(2, len(self.sessions))
+
+
+class BridgeHealthTest(unittest.TestCase):
+    def test_is_healthy(self):
+        session = FakeSession(responses_by_security(SAMPLE_RESPONSES))
+        bridge = BloombergBridge(session)
+        self.assertTrue(bridge.is_healthy())
+        session.terminate()
+        self.assertFalse(bridge.is_healthy())
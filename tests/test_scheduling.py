@@ -0,0 +1,153 @@
+import multiprocessing
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from os import path
+
+from bbgbridge.api import BloombergBridge
+from bbgbridge.fake import FakeSession
+from bbgbridge.scheduling import (BATCH, INTERACTIVE, BudgetExceededError, DailyBudget, RequestScheduler, TokenBucket,
+                                  estimate_hits, priority)
+from tests.test_planning import FIELDS, SYMBOLS, dataset_responder
+
+
+class EstimateHitsTest(unittest.TestCase):
+    def test_reference_data(self):
+        req = {'ReferenceDataRequest': {'securities': SYMBOLS[:3], 'fields': FIELDS[:2]}}
+        self.assertEqual(6, estimate_hits(req))
+
+    def test_historical_data_counts_periods(self):
+        req = {'HistoricalDataRequest': {'securities': SYMBOLS[:2], 'fields': FIELDS[:2],
+                                         'startDate': '20200106', 'endDate': '20200117'}}
+        self.assertEqual(2 * 2 * 10, estimate_hits(req))
+        req['HistoricalDataRequest']['periodicitySelection'] = 'MONTHLY'
+        req['HistoricalDataRequest']['endDate'] = '20210105'
+        self.assertEqual(2 * 2 * 12, estimate_hits(req))
+
+    def test_single_security(self):
+        req = {'IntradayBarRequest': {'security': SYMBOLS[0], 'eventType': 'TRADE'}}
+        self.assertEqual(1, estimate_hits(req))
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_wait_time(self):
+        bucket = TokenBucket(10, capacity=20)
+        now = bucket.updated
+        self.assertEqual(0, bucket.wait_time(20, now))
+        bucket.take(20)
+        self.assertAlmostEqual(0.5, bucket.wait_time(5, now))
+        self.assertEqual(0, bucket.wait_time(5, now + 0.5))
+
+    def test_large_requests_need_a_full_bucket(self):
+        bucket = TokenBucket(10, capacity=20)
+        now = bucket.updated
+        self.assertEqual(0, bucket.wait_time(100, now))
+        bucket.take(100)
+        self.assertAlmostEqual(10, bucket.wait_time(100, now))
+
+
+def charge_budget(budget_file, limit, times):
+    """ Charge one hit times over, returning how many were within the budget """
+    budget, charged = DailyBudget(limit, budget_file), 0
+    for _ in range(times):
+        try:
+            budget.charge(1)
+            charged += 1
+        except BudgetExceededError:
+            pass
+    return charged
+
+
+class DailyBudgetTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.budget_file = path.join(self.directory, 'budget.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_budget_persists(self):
+        DailyBudget(100, self.budget_file).charge(60)
+        budget = DailyBudget(100, self.budget_file)
+        self.assertEqual(40, budget.remaining())
+        with self.assertRaises(BudgetExceededError):
+            budget.charge(41)
+        budget.charge(40)
+        self.assertEqual(0, budget.remaining())
+
+    def test_new_day_resets(self):
+        with open(self.budget_file, 'w') as f:
+            f.write('{"date": "20000101", "hits": 1000}')
+        self.assertEqual(100, DailyBudget(100, self.budget_file).remaining())
+
+    def test_concurrent_processes(self):
+        with multiprocessing.Pool(4) as pool:
+            charged = pool.starmap(charge_budget, [(self.budget_file, 1000, 50)] * 4)
+        self.assertEqual([50] * 4, charged)
+        self.assertEqual(200, DailyBudget(1000, self.budget_file).used())
+
+        with multiprocessing.Pool(4) as pool:
+            charged = pool.starmap(charge_budget, [(self.budget_file, 300, 50)] * 4)
+        self.assertEqual(100, sum(charged))
+        self.assertEqual(300, DailyBudget(300, self.budget_file).used())
+
+
+class RequestSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.session = FakeSession(dataset_responder)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_bridge_requests_are_rate_limited(self):
+        scheduler = RequestScheduler(hits_per_second=50, burst=5)
+        bridge = BloombergBridge(self.session, scheduler=scheduler)
+        start = time.monotonic()
+        for symbol in SYMBOLS[:3]:
+            bridge.bdp(symbol, FIELDS[:5])
+        # the burst covers the first request, the others wait 0.1s each
+        self.assertGreaterEqual(time.monotonic() - start, 0.18)
+        stats = scheduler.stats()
+        self.assertEqual(3, stats['admitted'])
+        self.assertEqual(15, stats['hits'])
+        self.assertEqual(0, stats['queue_depth'])
+        self.assertGreater(stats['max_wait'], 0.05)
+
+    def test_budget_exceeded_is_not_sent(self):
+        scheduler = RequestScheduler(daily_limit=10, budget_file=path.join(self.directory, 'budget.json'))
+        bridge = BloombergBridge(self.session, scheduler=scheduler)
+        bridge.bdp(SYMBOLS[:2], FIELDS[:5])
+        with self.assertRaises(BudgetExceededError):
+            bridge.bdp(SYMBOLS[0], FIELDS[0])
+        self.assertEqual(1, len(self.session.sent_requests))
+        self.assertEqual(0, scheduler.stats()['budget_remaining'])
+
+    def test_interactive_requests_go_first(self):
+        scheduler = RequestScheduler(hits_per_second=20, burst=1)
+        req = {'ReferenceDataRequest': {'securities': [SYMBOLS[0]], 'fields': [FIELDS[0]]}}
+        scheduler.admit(req)  # empty the bucket
+        order = []
+
+        def run(name, value):
+            with priority(value):
+                scheduler.admit(req)
+            order.append(name)
+
+        threads = [threading.Thread(target=run, args=('batch{}'.format(i), BATCH)) for i in range(3)]
+        for t in threads:
+            t.start()
+        while scheduler.queue_depth() < 3:
+            time.sleep(0.001)
+        threads.append(threading.Thread(target=run, args=('interactive', INTERACTIVE)))
+        threads[-1].start()
+        for t in threads:
+            t.join()
+        self.assertEqual('interactive', order[1] if order[0] != 'interactive' else order[0])
+        self.assertEqual(['batch0', 'batch1', 'batch2'], [x for x in order if x != 'interactive'])
+
+
+if __name__ == '__main__':
+    unittest.main()
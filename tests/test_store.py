@@ -0,0 +1,80 @@
+import shutil
+import tempfile
+import unittest
+
+import pandas.testing as pdt
+
+from bbgbridge.api import BloombergBridge
+from bbgbridge.fake import FakeSession
+from bbgbridge.store import HistoryStore, add_range, missing_ranges
+from bbgbridge.util import to_timestamp
+from tests.test_planning import FIELDS, SYMBOLS, dataset_responder
+
+
+def date_range(start, end):
+    return to_timestamp(start), to_timestamp(end)
+
+
+class DateRangeTest(unittest.TestCase):
+    def test_add_range_merges_adjacent_and_overlapping(self):
+        ranges = add_range([], *date_range('2015-01-01', '2015-01-10'))
+        ranges = add_range(ranges, *date_range('2015-01-20', '2015-01-31'))
+        self.assertEqual([date_range('2015-01-01', '2015-01-10'), date_range('2015-01-20', '2015-01-31')], ranges)
+        self.assertEqual([date_range('2015-01-01', '2015-01-31')], add_range(ranges, *date_range('2015-01-11', '2015-01-25')))
+
+    def test_missing_ranges(self):
+        ranges = [date_range('2015-01-05', '2015-01-10'), date_range('2015-01-20', '2015-01-31')]
+        self.assertEqual(
+            [date_range('2015-01-01', '2015-01-04'), date_range('2015-01-11', '2015-01-19'), date_range('2015-02-01', '2015-02-10')],
+            missing_ranges(ranges, *date_range('2015-01-01', '2015-02-10')))
+        self.assertEqual([], missing_ranges(ranges, *date_range('2015-01-06', '2015-01-09')))
+        self.assertEqual([date_range('2015-01-01', '2015-01-31')], missing_ranges([], *date_range('2015-01-01', '2015-01-31')))
+
+
+class HistoryStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.session = FakeSession(dataset_responder)
+        self.bridge = BloombergBridge(self.session)
+        self.store = HistoryStore(self.bridge, self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_only_missing_ranges_are_requested(self):
+        self.store.bdh(SYMBOLS[:2], FIELDS[:2], '2015-08-01', '2015-08-31')
+        self.assertEqual(1, len(self.session.sent_requests))
+
+        res = self.store.bdh(SYMBOLS[:2], FIELDS[:2], '2015-08-15', '2015-09-30', meta={'id': 1})
+        self.assertEqual(2, len(self.session.sent_requests))
+        body = self.session.sent_requests[-1]['HistoricalDataRequest']
+        self.assertEqual(('20150901', '20150930'), (body['startDate'], body['endDate']))
+        self.assertEqual({'id': 1}, res.meta)
+
+        expected = self.bridge.bdh(SYMBOLS[:2], FIELDS[:2], '2015-08-15', '2015-09-30').to_dataframe('price')
+        pdt.assert_frame_equal(expected, res.to_dataframe())
+
+    def test_new_fields_and_symbols_are_fetched_separately(self):
+        self.store.bdh(SYMBOLS[:2], FIELDS[:2], '2015-08-01', '2015-09-30')
+        res = self.store.bdh(SYMBOLS[:3], FIELDS[:3], '2015-08-01', '2015-09-30')
+        body = self.session.sent_requests[-1]['HistoricalDataRequest']
+        self.assertEqual(SYMBOLS[:3], body['securities'])
+        self.assertEqual(FIELDS[:3], body['fields'])
+
+        expected = self.bridge.bdh(SYMBOLS[:3], FIELDS[:3], '2015-08-01', '2015-09-30').to_dataframe('price')
+        pdt.assert_frame_equal(expected, res.to_dataframe())
+
+        self.store.bdh(SYMBOLS[:3], FIELDS[:3], '2015-08-10', '2015-09-10')
+        self.assertEqual(3, len(self.session.sent_requests))
+
+    def test_today_is_never_covered(self):
+        self.store.bdh(SYMBOLS[0], FIELDS[0], '2015-08-01')
+        self.store.bdh(SYMBOLS[0], FIELDS[0], '2015-08-01')
+        self.assertEqual(2, len(self.session.sent_requests))
+        (_, covered_end), = self.store.covered_ranges(SYMBOLS[0], FIELDS[0])
+        self.assertLess(covered_end, to_timestamp('today').normalize())
+
+    def test_partitioned_by_overrides(self):
+        self.store.bdh(SYMBOLS[0], FIELDS[0], '2015-08-01', '2015-08-31')
+        self.store.bdh(SYMBOLS[0], FIELDS[0], '2015-08-01', '2015-08-31', overrides={'BEST_FPERIOD_OVERRIDE': '1BF'})
+        self.assertEqual(2, len(self.session.sent_requests))
@@ -0,0 +1,182 @@
+import datetime
+import shutil
+import tempfile
+import unittest
+
+from collections import OrderedDict
+
+import pandas as pd
+import pandas.testing as pdt
+
+from bbgbridge.api import BloombergBridge
+from bbgbridge.archive import read_frame
+from bbgbridge.converters import price_to_frame
+from bbgbridge.fake import FakeSession
+from bbgbridge.planning import ChunkPlan, split_time_range
+from bbgbridge.util import to_timestamp
+from tests.test_planning import DATES, FIELDS, SYMBOLS, dataset_responder
+
+
+def bar_responder(req_object):
+    body = req_object['IntradayBarRequest']
+    start = to_timestamp(body['startDateTime'])
+    return [{'barData': OrderedDict([
+        ('eidData', []),
+        ('barTickData', [{'barTickData': OrderedDict([
+            ('time', start + pd.Timedelta(minutes=5 * i)),
+            ('open', 100.0 + i),
+            ('close', 100.5 + i),
+            ('volume', 10 * i),
+            ('numEvents', i)])} for i in range(3)])])}]
+
+
+def tick_responder(req_object):
+    """ A trade every 10 minutes, including at both ends of the requested range """
+    body = req_object['IntradayTickRequest']
+    times = pd.date_range(body['startDateTime'], body['endDateTime'], freq='10min')
+    return [{'tickData': OrderedDict([
+        ('eidData', []),
+        ('tickData', [{'tickData': OrderedDict([
+            ('time', t), ('type', 'TRADE'), ('value', 100.0 + t.minute), ('size', 100)])} for t in times])])}]
+
+
+class StreamingTest(unittest.TestCase):
+    def setUp(self):
+        self.session = FakeSession(dataset_responder)
+        self.bridge = BloombergBridge(self.session)
+
+    def test_streamed_frame_matches_parsed(self):
+        expected = self.bridge.bdh(SYMBOLS, FIELDS, '2015-08-01', '2015-09-30').to_dataframe('price')
+        res = self.bridge.bdh(SYMBOLS, FIELDS, '2015-08-01', '2015-09-30', stream=True)
+        pdt.assert_frame_equal(expected, res.to_dataframe())
+        self.assertEqual(SYMBOLS, [x['securityData']['security'] for x in res.result])
+        self.assertEqual([[]] * len(SYMBOLS), [x['securityData']['fieldData'] for x in res.result])
+
+    def test_keep_raw(self):
+        expected = self.bridge.bdh(SYMBOLS, FIELDS, '2015-08-01', '2015-09-30')
+        res = self.bridge.bdh(SYMBOLS, FIELDS, '2015-08-01', '2015-09-30', stream=True, keep_raw=True)
+        self.assertEqual(expected.result, res.result)
+        pdt.assert_frame_equal(price_to_frame(expected), res.to_dataframe())
+
+    def test_chunked_streams_are_joined(self):
+        expected = self.bridge.bdh(SYMBOLS, FIELDS, '2015-08-01', '2015-09-30', stream=True).to_dataframe()
+        plan = ChunkPlan(symbols_per_request=2, fields_per_request=2, days_per_request=20)
+        actual = self.bridge.bdh(SYMBOLS, FIELDS, '2015-08-01', '2015-09-30', stream=True, chunk_plan=plan).to_dataframe()
+        pdt.assert_frame_equal(expected, actual)
+        pdt.assert_frame_equal(self.bridge.bdh(SYMBOLS, FIELDS, '2015-08-01', '2015-09-30').to_dataframe('price'), actual)
+
+    def test_chunked_streams_keep_the_column_order_of_gaps(self):
+        def responder(req_object):
+            """ No PX_OPEN on the first date of the first symbol """
+            messages = dataset_responder(req_object)
+            for msg in messages:
+                rows = msg['securityData']['fieldData']
+                if msg['securityData']['security'] == SYMBOLS[0] and rows and rows[0]['fieldData']['date'] == DATES[0]:
+                    rows[0]['fieldData'].pop('PX_OPEN', None)
+                    if len(rows[0]['fieldData']) == 1:
+                        del rows[0]
+            return messages
+
+        self.session.responder = responder
+        expected = self.bridge.bdh(SYMBOLS[:2], ['PX_LAST', 'PX_OPEN'], '2015-08-01', '2015-09-30', stream=True).to_dataframe()
+        self.assertEqual(['date', 'PX_LAST', 'symbol', 'PX_OPEN'], list(expected.columns))
+        plan = ChunkPlan(fields_per_request=1, days_per_request=20)
+        actual = self.bridge.bdh(SYMBOLS[:2], ['PX_LAST', 'PX_OPEN'], '2015-08-01', '2015-09-30', stream=True, chunk_plan=plan)
+        pdt.assert_frame_equal(expected, actual.to_dataframe())
+
+    def test_intraday_bars(self):
+        self.session.responder = bar_responder
+        expected = self.bridge.bdib('SPY US Equity', 5, '2015-08-03 09:30', '2015-08-03 09:45').to_dataframe('intraday_bar')
+        res = self.bridge.bdib('SPY US Equity', 5, '2015-08-03 09:30', '2015-08-03 09:45', stream=True)
+        pdt.assert_frame_equal(expected, res.to_dataframe())
+        self.assertEqual(['int64', 'datetime64[ns]'], [str(res.frame['volume'].dtype), str(res.frame['time'].dtype)])
+        self.assertEqual([], res.result[0]['barData']['barTickData'])
+
+    def test_parsed_dates_are_timestamps_unless_native_dates(self):
+        self.session.responder = lambda req_object: [{'securityData': OrderedDict([
+            ('security', 'SPY US Equity'),
+            ('fieldData', [{'fieldData': OrderedDict([('date', datetime.date(2015, 8, 25)), ('PX_LAST', 187.27)])}])])}]
+        res = self.bridge.bdh('SPY US Equity', 'PX_LAST', '2015-08-01', '2015-09-30')
+        self.assertEqual(pd.Timestamp, type(res.result[0]['securityData']['fieldData'][0]['fieldData']['date']))
+        streamed = self.bridge.bdh('SPY US Equity', 'PX_LAST', '2015-08-01', '2015-09-30', stream=True).to_dataframe()
+        self.assertEqual('datetime64[ns]', str(streamed['date'].dtype))
+        pdt.assert_frame_equal(res.to_dataframe('price'), streamed)
+
+        native = self.bridge.bdh('SPY US Equity', 'PX_LAST', '2015-08-01', '2015-09-30', native_dates=True)
+        self.assertEqual(datetime.date, type(native.result[0]['securityData']['fieldData'][0]['fieldData']['date']))
+        self.assertEqual(datetime.date, type(native.to_dataframe('price_native_dates')['date'][0]))
+        pdt.assert_frame_equal(res.to_dataframe('price'), native.to_dataframe('price'))
+
+    def test_only_historical_and_intraday_bars_stream(self):
+        request = self.bridge.create_request('ReferenceDataRequest', SYMBOLS, FIELDS)
+        self.assertRaises(ValueError, self.bridge.send_request, request, stream=True)
+
+
+class IntradayTickTest(unittest.TestCase):
+    def setUp(self):
+        self.session = FakeSession(tick_responder)
+        self.bridge = BloombergBridge(self.session)
+
+    def test_split_time_range(self):
+        self.assertEqual(
+            [(pd.Timestamp('2015-08-03 09:30'), pd.Timestamp('2015-08-03 10:30')),
+             (pd.Timestamp('2015-08-03 10:30'), pd.Timestamp('2015-08-03 11:00'))],
+            split_time_range('2015-08-03 09:30', '2015-08-03 11:00', '1h'))
+        self.assertRaises(ValueError, split_time_range, '2015-08-03 09:30', '2015-08-03 11:00', 0)
+
+    def test_windows_are_streamed_without_overlap(self):
+        frames = list(self.bridge.bdit(['SPY US Equity', 'QQQ US Equity'], '2015-08-03 09:30', '2015-08-03 16:00',
+                                       window='2h', max_in_flight=3))
+        self.assertEqual(2 * 4, len(frames))
+        self.assertEqual(3, self.session.max_outstanding)
+        self.assertEqual(['IntradayTickRequest'], list(self.session.sent_requests[0]))
+        self.assertEqual(['TRADE'], self.session.sent_requests[0]['IntradayTickRequest']['eventTypes'])
+
+        ticks = pd.concat(frames).sort_values(['symbol', 'time'])
+        for symbol in ('SPY US Equity', 'QQQ US Equity'):
+            times = ticks[ticks['symbol'] == symbol]['time']
+            self.assertEqual(list(pd.date_range('2015-08-03 09:30', '2015-08-03 16:00', freq='10min')), list(times))
+
+    def test_requests_are_created_as_windows_complete(self):
+        service, created = self.bridge.refdata_service, []
+        create_request = service.createRequest
+        service.createRequest = lambda request_type: created.append(request_type) or create_request(request_type)
+        frames = self.bridge.bdit('SPY US Equity', '2015-08-03 09:30', '2015-08-03 16:00', window='1h', max_in_flight=2)
+        next(frames)
+        self.assertEqual(2, len(created))
+        frames.close()
+
+    def test_windows_written_to_disk(self):
+        directory = tempfile.mkdtemp()
+        try:
+            paths = list(self.bridge.bdit('SPY US Equity', '2015-08-03 09:30', '2015-08-03 10:30', window='30min', outdir=directory))
+            self.assertEqual(2, len(paths))
+            header, frame = read_frame(sorted(paths)[0])
+            self.assertEqual('SPY US Equity', header['request']['IntradayTickRequest']['security'])
+            self.assertEqual(3, len(frame))
+        finally:
+            shutil.rmtree(directory)
+
+
+class MultiSymbolIntradayBarTest(unittest.TestCase):
+    def setUp(self):
+        self.session = FakeSession(bar_responder)
+        self.bridge = BloombergBridge(self.session)
+        self.symbols = ['SPY US Equity', 'QQQ US Equity', 'IWM US Equity']
+
+    def test_bars_of_all_symbols_in_one_frame(self):
+        res = self.bridge.bdib(self.symbols, 5, '2015-08-03 09:30', '2015-08-03 09:45', max_in_flight=2, meta={'id': 1})
+        self.assertEqual(2, self.session.max_outstanding)
+        self.assertEqual(self.symbols, res.request['IntradayBarRequest']['securities'])
+        self.assertEqual({'id': 1}, res.meta)
+
+        df = res.to_dataframe('intraday_bar')
+        self.assertEqual(9, len(df))
+        self.assertEqual([s for s in self.symbols for _ in range(3)], list(df['symbol']))
+        single = self.bridge.bdib('QQQ US Equity', 5, '2015-08-03 09:30', '2015-08-03 09:45').to_dataframe('intraday_bar')
+        pdt.assert_frame_equal(single, df[df['symbol'] == 'QQQ US Equity'].reset_index(drop=True), check_categorical=False)
+
+    def test_streamed_bars_of_all_symbols(self):
+        expected = self.bridge.bdib(self.symbols, 5, '2015-08-03 09:30', '2015-08-03 09:45').to_dataframe('intraday_bar')
+        res = self.bridge.bdib(self.symbols, 5, '2015-08-03 09:30', '2015-08-03 09:45', stream=True)
+        pdt.assert_frame_equal(expected, res.to_dataframe())
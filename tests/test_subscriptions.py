@@ -0,0 +1,99 @@
+import time
+import unittest
+
+import numpy as np
+
+from bbgbridge.api import BloombergBridge
+from bbgbridge.fake import FakeSession, responses_by_security
+from bbgbridge.subscriptions import TickRingBuffer
+from tests.test_api import SAMPLE_RESPONSES
+
+FIELDS = ['LAST_PRICE', 'BID', 'ASK']
+
+
+def now():
+    return np.datetime64(time.time_ns(), 'ns')
+
+
+class TickRingBufferTest(unittest.TestCase):
+    def test_oldest_ticks_are_overwritten(self):
+        ticks = TickRingBuffer(FIELDS, 3)
+        for i in range(5):
+            ticks.append({'LAST_PRICE': float(i), 'BID': i - 0.5, 'MKTDATA_EVENT_TYPE': 'TRADE'}, now())
+        self.assertEqual(3, len(ticks))
+        frame = ticks.to_frame()
+        self.assertEqual(['time'] + FIELDS, list(frame.columns))
+        self.assertEqual([2.0, 3.0, 4.0], list(frame['LAST_PRICE']))
+        self.assertTrue(frame['ASK'].isnull().all())
+        self.assertTrue(frame['time'].is_monotonic_increasing)
+
+    def test_update_last(self):
+        ticks = TickRingBuffer(FIELDS, 3)
+        ticks.append({'LAST_PRICE': 1.0}, now())
+        ticks.update_last({'BID': 0.5}, now())
+        self.assertEqual([[1.0, 0.5]], ticks.to_frame()[['LAST_PRICE', 'BID']].values.tolist())
+
+
+class SubscriptionManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.session = FakeSession(responses_by_security(SAMPLE_RESPONSES))
+        self.bridge = BloombergBridge(self.session)
+
+    def tearDown(self):
+        self.bridge.stop()
+
+    def replay(self, ticks, manager):
+        self.session.replay(ticks)
+        manager.process_events(timeout=10)
+
+    def test_subscribe_and_replay(self):
+        manager = self.bridge.subscribe(['SPY US Equity', 'QQQ US Equity'], FIELDS, capacity=2)
+        self.assertIn('//blp/mktdata', self.session.opened_services)
+        self.assertEqual(['//blp/mktdata/ticker/SPY US Equity', '//blp/mktdata/ticker/QQQ US Equity'], list(self.session.subscriptions))
+
+        self.replay([('SPY US Equity', {'LAST_PRICE': 187.0 + i, 'BID': 186.9 + i}) for i in range(3)] +
+                    [('QQQ US Equity', {'ASK': 98.4, 'MKTDATA_EVENT_TYPE': 'QUOTE'}), ('IWM US Equity', {'ASK': 1.0})], manager)
+
+        self.assertEqual('SubscriptionStarted', manager.status('SPY US Equity'))
+        self.assertEqual([188.0, 189.0], list(manager.ticks('SPY US Equity')['LAST_PRICE']))
+        self.assertEqual({'ASK': 98.4, 'MKTDATA_EVENT_TYPE': 'QUOTE'}, dict(manager.last('QQQ US Equity')))
+
+        snapshot = manager.snapshot()
+        self.assertEqual(['SPY US Equity', 'QQQ US Equity'], list(snapshot['symbol']))
+        self.assertEqual([3, 1], list(snapshot['updates']))
+        self.assertEqual(189.0, snapshot['LAST_PRICE'][0])
+
+    def test_throttle_merges_ticks(self):
+        manager = self.bridge.subscribe('SPY US Equity', FIELDS, throttle=60)
+        self.replay([('SPY US Equity', {'LAST_PRICE': 187.0}), ('SPY US Equity', {'BID': 186.0})], manager)
+        self.assertEqual([[187.0, 186.0]], manager.ticks('SPY US Equity')[['LAST_PRICE', 'BID']].values.tolist())
+
+    def test_interval_option_and_unsubscribe(self):
+        manager = self.bridge.subscribe('SPY US Equity', FIELDS, interval=5)
+        self.assertEqual(['interval=5'], manager._options())
+        manager.unsubscribe()
+        self.assertEqual([], list(self.session.subscriptions))
+        self.assertEqual(0, len(manager.snapshot()))
+
+    def test_requests_hand_subscription_events_to_the_manager(self):
+        manager = self.bridge.subscribe('SPY US Equity', FIELDS)
+        self.session.replay([('SPY US Equity', {'LAST_PRICE': 187.0})])
+        self.bridge.bdp('QQQ US Equity', 'PX_LAST')
+        self.assertEqual(187.0, manager.last('SPY US Equity')['LAST_PRICE'])
+
+    def test_requests_run_while_subscriptions_are_processed_in_the_background(self):
+        self.session.latency = 0.02
+        self.bridge.request_timeout = 2
+        manager = self.bridge.subscribe('SPY US Equity', FIELDS)
+        manager.start()
+        try:
+            for i in range(5):
+                self.session.replay([('SPY US Equity', {'LAST_PRICE': 187.0 + i})])
+                res = self.bridge.bdp('QQQ US Equity', 'PX_LAST')
+                self.assertEqual('QQQ US Equity', res.result[0]['securityData']['security'])
+            deadline = time.monotonic() + 5
+            while manager.last('SPY US Equity').get('LAST_PRICE') != 191.0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(191.0, manager.last('SPY US Equity')['LAST_PRICE'])
+        finally:
+            manager.stop()